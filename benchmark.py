@@ -0,0 +1,608 @@
+import argparse
+import asyncio
+import datetime
+import gc
+import glob
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from main import Note, NoteManager
+from note_async import AsyncNoteManager
+from note_codec import CODECS
+from note_compact import CompactNote, CompactNoteStore
+from note_content import ContentStore, content_note_class, train_sample
+from note_server import NoteClient, NoteServer
+from note_storage import CACHE_SUFFIX, open_storage
+
+WORDS = ["meeting", "project", "idea", "shopping", "python", "todo", "budget", "travel",
+         "book", "call", "review", "draft", "plan", "weekly", "notes", "urgent"]
+
+
+class LegacyNote:
+    # the original Note layout: a __dict__ per note, string id and timestamp
+    def __init__(self, title, content, id=None, timestamp=None):
+        self.id = id
+        self.title = title
+        self.content = content
+        self.timestamp = timestamp
+
+
+def generate_notes(count, content_size=200, seed=0, variation=0.0):
+    # deterministic notes for a seed; variation=0.5 spreads content sizes over 50%-150% of content_size
+    rng = random.Random(seed)
+    start = datetime.datetime(2025, 1, 1)
+    for i in range(count):
+        title = " ".join(rng.choices(WORDS, k=rng.randint(1, 3)))
+        size = content_size * rng.uniform(1 - variation, 1 + variation) if variation else content_size
+        words = []
+        length = 0
+        while length < size:
+            word = rng.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+        timestamp = (start + datetime.timedelta(seconds=i * 37)).strftime("%Y-%m-%d %H:%M:%S")
+        yield {
+            "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            "title": title,
+            "content": " ".join(words),
+            "timestamp": timestamp,
+        }
+
+
+# each layout as NoteManager.notes holds it: note id -> note
+LAYOUTS = {
+    "legacy": lambda dicts: {d["id"]: LegacyNote(d["title"], d["content"], d["id"], d["timestamp"]) for d in dicts},
+    "slots": lambda dicts: {d["id"]: Note(d["title"], d["content"], d["id"], d["timestamp"]) for d in dicts},
+    "compact": lambda dicts: {d["id"]: CompactNote(d["title"], d["content"], d["id"], d["timestamp"]) for d in dicts},
+    "columns": lambda dicts: CompactNoteStore(
+        CompactNote(d["title"], d["content"], d["id"], d["timestamp"]) for d in dicts),
+    "content": lambda dicts: content_layout(dicts),
+}
+
+
+def content_layout(dicts):
+    # ContentNotes and the store holding their bodies, as NoteManager(compact="content") has them
+    dicts = list(dicts)
+    store = ContentStore()
+    store.train(train_sample([d["content"] for d in dicts]))
+    note_class = content_note_class(store)
+    return {d["id"]: note_class(d["title"], d["content"], d["id"], d["timestamp"]) for d in dicts}
+
+
+# the NoteManager(compact=...) mode that holds each layout
+MANAGER_LAYOUTS = {"slots": None, "compact": "notes", "columns": "columns", "content": "content"}
+
+
+def measure_memory(layout, count, content_size):
+    gc.collect()
+    tracemalloc.start()
+    notes = LAYOUTS[layout](generate_notes(count, content_size))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del notes
+    return current, peak
+
+
+def measure_loaded(layout, filename):
+    # a NoteManager loading the store: the notes and the search index over them
+    gc.collect()
+    tracemalloc.start()
+    manager = NoteManager(filename, verbose=False, compact=MANAGER_LAYOUTS[layout])
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del manager
+    return current, peak
+
+
+def run_memory(args):
+    layouts = args.layouts
+    measure = measure_memory
+    if args.loaded:
+        # the bare collections leave out the index, which takes most of a manager's memory
+        # and keeps every id string alive, so only "content" stays clearly below "slots"
+        layouts = [layout for layout in layouts if layout in MANAGER_LAYOUTS]
+        directory = tempfile.mkdtemp()
+        manager = build_manager(directory, args.count, args.content_size)
+        manager.save_notes()
+        manager.compact_notes()
+        # warm the snapshot cache, as a store that was opened before has it
+        NoteManager(manager.filename, verbose=False)
+        measure = lambda layout, count, content_size: measure_loaded(layout, manager.filename)
+    print(f"{args.count} notes, ~{args.content_size} characters of content each"
+          + (", loaded by a NoteManager" if args.loaded else ""))
+    print(f"{'layout':<10}{'total MB':>12}{'bytes/note':>12}{'peak MB':>12}")
+    baseline = None
+    for layout in layouts:
+        current, peak = measure(layout, args.count, args.content_size)
+        baseline = baseline or current
+        print(f"{layout:<10}{current / 1e6:>12.1f}{current / args.count:>12.0f}{peak / 1e6:>12.1f}"
+              f"   ({current / baseline:.0%} of {layouts[0]})")
+
+
+def build_manager(directory, count, content_size):
+    manager = NoteManager(os.path.join(directory, "notes.json"), verbose=False)
+    manager.notes = manager.new_note_store(
+        Note(d["title"], d["content"], d["id"], d["timestamp"]) for d in generate_notes(count, content_size))
+    return manager
+
+
+def run_export(args):
+    variants = [
+        ("csv", {}),
+        ("csv.gz", {"compress": True}),
+        (f"{args.shards} shards", {"shards": args.shards}),
+        (f"{args.shards} x gz", {"shards": args.shards, "compress": True}),
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        manager = build_manager(directory, args.count, args.content_size)
+        print(f"{args.count} notes, ~{args.content_size} characters of content each")
+        print(f"{'export':<12}{'seconds':>10}{'output MB':>12}{'CSV MB/s':>12}")
+        csv_bytes = None
+        for number, (name, options) in enumerate(variants):
+            filename = os.path.join(directory, f"export{number}.csv")
+            start = time.perf_counter()
+            manager.convert_to_csv(filename, chunk_size=args.chunk_size, **options)
+            elapsed = time.perf_counter() - start
+            output = sum(os.path.getsize(f) for f in glob.glob(filename.replace(".csv", "*")))
+            csv_bytes = csv_bytes or output
+            print(f"{name:<12}{elapsed:>10.2f}{output / 1e6:>12.1f}{csv_bytes / 1e6 / elapsed:>12.1f}")
+
+
+def run_codec(args):
+    # save (compaction) and load of one snapshot per codec, in a fresh process each
+    print(f"{args.count} notes, ~{args.content_size} characters of content each")
+    # decode: snapshot -> notes; streamed: the same through the chunked streaming parser;
+    # load: NoteManager() as a whole, which also builds the search index
+    print(f"{'codec':<10}{'save s':>10}{'decode s':>10}{'streamed s':>12}{'load s':>10}{'file MB':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        manager = build_manager(directory, args.count, args.content_size)
+        for codec in args.codecs:
+            filename = os.path.join(directory, f"notes-{codec}.json")
+            manager.storage = open_storage(filename, codec)
+            gc.collect()
+            start = time.perf_counter()
+            manager.compact_notes()
+            saved = time.perf_counter() - start
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                decoded, streamed, loaded = pool.submit(time_load, filename).result()
+            print(f"{codec:<10}{saved:>10.2f}{decoded:>10.2f}{streamed:>12.2f}{loaded:>10.2f}"
+                  f"{os.path.getsize(filename) / 1e6:>10.1f}")
+
+
+def time_load(filename):
+    times = []
+    for streaming in (False, True):
+        start = time.perf_counter()
+        notes = [Note(*row) for row in open_storage(filename).iter_load(streaming)]
+        times.append(time.perf_counter() - start)
+        del notes
+    start = time.perf_counter()
+    NoteManager(filename, verbose=False)
+    times.append(time.perf_counter() - start)
+    return times
+
+
+# what a short scripted run of the application pays before its first note operation
+STARTUP_SCRIPT = "import main; main.NoteManager({filename!r}, verbose=False)"
+STARTUP_RUNS = 5
+IMPORT_REPORT_LINES = 12
+
+
+def run_python(code, *options):
+    # wall-clock seconds of a fresh interpreter running code, and what it wrote to stderr
+    package = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package, os.environ.get("PYTHONPATH")])))
+    start = time.perf_counter()
+    done = subprocess.run([sys.executable, *options, "-c", code], env=env, check=True,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return time.perf_counter() - start, done.stderr
+
+
+def import_times(module):
+    # (cumulative microseconds, module) of every import below `module`, from -X importtime
+    _, report = run_python(f"import {module}", "-X", "importtime")
+    times = []
+    for line in report.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                times.append((int(cumulative), name.rstrip()))
+    return sorted(times, reverse=True)
+
+
+def run_startup(args):
+    times = import_times("main")
+    print(f"import main: {times[0][0] / 1000:.1f} ms (python -X importtime, cumulative)")
+    for microseconds, name in times[1:IMPORT_REPORT_LINES]:
+        print(f"{microseconds / 1000:>8.1f} ms {name}")
+    bare = min(run_python("pass")[0] for _ in range(STARTUP_RUNS))
+    imported = min(run_python("import main")[0] for _ in range(STARTUP_RUNS))
+    print(f"\ninterpreter {bare * 1000:.0f} ms, interpreter + import main {imported * 1000:.0f} ms")
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "notes.json")
+        write_dataset(filename, args.count, args.content_size)
+        script = STARTUP_SCRIPT.format(filename=filename)
+        # cold: decodes notes.json and builds the index (and writes the cache); warm: from the cache
+        cold = []
+        for _ in range(args.runs):
+            cache_filename = filename + CACHE_SUFFIX
+            if os.path.exists(cache_filename):
+                os.remove(cache_filename)
+            cold.append(run_python(script)[0])
+        warm = [run_python(script)[0] for _ in range(args.runs)]
+    print(f"start with {args.count} notes: cold {min(cold):.2f}s, warm {min(warm):.2f}s (best of {args.runs})")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def async_load_test(filename, clients, operations):
+    notes = await AsyncNoteManager.open(filename)
+    latencies = []
+
+    async def client(number):
+        note = await notes.add_note(f"client {number} note", f"written by client {number}")
+        for i in range(operations):
+            start = time.perf_counter()
+            step = i % 4
+            if step == 0:
+                await notes.add_note(f"client {number} note {i}", f"{WORDS[i % len(WORDS)]} from client {number}")
+            elif step == 1:
+                await notes.find_notes(WORDS[(number + i) % len(WORDS)], limit=10)
+            elif step == 2:
+                await notes.modify_note(note.id, lambda n: (n.title, n.content + " edited"))
+            else:
+                await notes.get_note(note.id)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(number) for number in range(clients)))
+    elapsed = time.perf_counter() - start
+    await notes.close()
+    return elapsed, latencies
+
+
+def run_async(args):
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "notes.db" if args.sqlite else "notes.json")
+        elapsed, latencies = asyncio.run(async_load_test(filename, args.clients, args.operations))
+    total = len(latencies)
+    print(f"{args.clients} concurrent clients, {total} operations in {elapsed:.2f}s "
+          f"({total / elapsed:.0f} ops/s)")
+    print(f"latency p50 {percentile(latencies, 0.5) * 1000:.2f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms")
+
+
+async def server_test(filename, requests, batch_size):
+    server = await (await NoteServer.open(filename, path=os.path.join(os.path.dirname(filename), "notes.sock"))).start()
+
+    def client():
+        results = {}
+        with NoteClient(server.path) as notes:
+            calls = [("add", {"title": f"note {i}", "content": f"{WORDS[i % len(WORDS)]} over the socket"})
+                     for i in range(requests)]
+            calls += [("search", {"term": WORDS[i % len(WORDS)], "limit": 10}) for i in range(requests)]
+            start = time.perf_counter()
+            for op, args in calls:
+                notes.call(op, **args)
+            results["one at a time"] = time.perf_counter() - start
+            start = time.perf_counter()
+            notes.pipeline(calls)
+            results["pipelined"] = time.perf_counter() - start
+            start = time.perf_counter()
+            for i in range(0, len(calls), batch_size):
+                notes.batch(calls[i:i + batch_size])
+            results[f"batches of {batch_size}"] = time.perf_counter() - start
+        return len(calls), results
+
+    try:
+        return await asyncio.to_thread(client)
+    finally:
+        await server.stop()
+
+
+def run_server(args):
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "notes.db" if args.sqlite else "notes.json")
+        total, results = asyncio.run(server_test(filename, args.requests, args.batch_size))
+    for name, elapsed in results.items():
+        print(f"{name}: {total} requests in {elapsed:.2f}s, {elapsed / total * 1e6:.0f} us per request")
+
+
+SUITE_SIZES = [10_000, 100_000, 1_000_000]
+SUITE_CONTENT_SIZES = [100, 1000]
+# compare flags an operation that got this much slower (or used this much more memory)
+REGRESSION_THRESHOLD = 0.10
+# differences below this many seconds per call are treated as noise
+NOISE_SECONDS = 1e-6
+
+
+def write_dataset(filename, count, content_size, seed=0, variation=0.5):
+    # a notes.json snapshot in the layout compact_notes writes, generated one note at a time
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, d in enumerate(generate_notes(count, content_size, seed, variation)):
+            f.write(",\n" if i else "\n")
+            f.write(json.dumps(d, indent=4))
+        f.write("\n]")
+
+
+def max_rss():
+    # peak resident memory of this process in bytes (None where resource is missing)
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def timed(function, trace_memory):
+    # (seconds, peak bytes allocated while running) for one call of function
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def run_case(count, content_size, calls, trace_memory, seed, codec=None):
+    # time every operation on one dataset; runs in a fresh process so max_rss is per dataset
+    results = []
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "notes.json")
+        write_dataset(filename, count, content_size, seed)
+        if codec is not None:
+            # rewrite the dataset in the codec under test
+            NoteManager(filename, verbose=False, codec=codec).compact_notes()
+        snapshot_bytes = os.path.getsize(filename)
+        managers = []
+        queries = [" ".join(rng.sample(WORDS, 2)) for _ in range(calls)]
+        calls = min(calls, count)
+
+        def load():
+            managers.append(NoteManager(filename, verbose=False, codec=codec))
+
+        def load_warm():
+            # a second start, from the snapshot cache the first one wrote
+            NoteManager(filename, verbose=False, codec=codec).storage.close()
+
+        def add():
+            for i in range(calls):
+                manager.add_note(f"benchmark note {i}", queries[i % len(queries)])
+
+        def edit():
+            for i in range(calls):
+                manager.edit_note(rng.randrange(len(manager.notes)), f"edited note {i}", queries[i % len(queries)])
+
+        def delete():
+            # delete_note asks for confirmation; remove_notes is what it calls
+            for note_id in rng.sample(list(manager.notes), calls):
+                manager.remove_notes([note_id])
+
+        def search():
+            # search_note prints the hits; find_notes is the search itself
+            for query in queries:
+                manager.find_notes(query)
+
+        def search_substring():
+            for query in queries[:10]:
+                manager.find_notes(query.split()[0], "substring")
+
+        def view_page():
+            # the listing by timestamp, sorted on the first call: random pages of it
+            manager.set_sort("timestamp")
+            pages = manager.page_count()
+            for _ in range(calls):
+                manager.page_notes(rng.randrange(pages))
+            manager.set_sort(None)
+
+        def time_range():
+            # a day of notes (the dataset spans count * 37 seconds), newest 20, and a search in it;
+            # the timestamp order is built on the first call
+            start = datetime.datetime(2025, 1, 1)
+            for i in range(calls):
+                since = start + datetime.timedelta(seconds=rng.randrange(max(1, count * 37)))
+                manager.notes_between(since, since + datetime.timedelta(days=1), limit=20)
+                manager.find_notes(queries[i % len(queries)], since=since, until=since + datetime.timedelta(days=1))
+
+        operations = [
+            ("load_notes", 1, load),
+            ("load_notes_warm", 1, load_warm),
+            ("add_note", calls, add),
+            ("edit_note", calls, edit),
+            ("delete_note", calls, delete),
+            ("search_note", len(queries), search),
+            ("search_substring", len(queries[:10]), search_substring),
+            ("view_page", calls, view_page),
+            ("time_range", calls, time_range),
+            ("save_notes", 1, lambda: manager.save_notes()),
+            ("compact_notes", 1, lambda: manager.compact_notes()),
+            ("convert_to_csv", 1, lambda: manager.convert_to_csv(os.path.join(directory, "notes.csv"))),
+        ]
+        for operation, operation_calls, function in operations:
+            seconds, peak = timed(function, trace_memory)
+            if operation == "load_notes":
+                manager = managers[0]
+            results.append({
+                "notes": count,
+                "content_size": content_size,
+                "operation": operation,
+                "calls": operation_calls,
+                "seconds": seconds,
+                "per_call": seconds / operation_calls,
+                "peak_bytes": peak,
+                "max_rss": max_rss(),
+                "snapshot_bytes": snapshot_bytes,
+            })
+        manager.storage.close()
+    return results
+
+
+def run_suite(args):
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {"sizes": args.sizes, "content_sizes": args.content_sizes, "calls": args.calls,
+                     "trace_memory": args.trace_memory, "seed": args.seed, "codec": args.codec},
+        "results": [],
+    }
+    print(f"{'notes':>10}{'content':>9}  {'operation':<18}{'calls':>7}{'seconds':>10}{'per call ms':>13}"
+          f"{'peak MB':>10}{'rss MB':>9}")
+    for count in args.sizes:
+        for content_size in args.content_sizes:
+            # one process per dataset keeps the memory figures of different sizes apart
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                results = pool.submit(run_case, count, content_size, args.calls, args.trace_memory,
+                                      args.seed, args.codec).result()
+            for r in results:
+                peak = "-" if r["peak_bytes"] is None else f"{r['peak_bytes'] / 1e6:.1f}"
+                rss = "-" if r["max_rss"] is None else f"{r['max_rss'] / 1e6:.0f}"
+                print(f"{count:>10}{content_size:>9}  {r['operation']:<18}{r['calls']:>7}{r['seconds']:>10.3f}"
+                      f"{r['per_call'] * 1000:>13.3f}{peak:>10}{rss:>9}")
+            report["results"].extend(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Results written to {args.output}")
+
+
+def compare_reports(baseline, current, threshold=REGRESSION_THRESHOLD):
+    # (key, metric, old, new, ratio) for every figure that got worse by more than threshold
+    def keyed(report):
+        return {(r["notes"], r["content_size"], r["operation"]): r for r in report["results"]}
+
+    old_results = keyed(baseline)
+    new_results = keyed(current)
+    rows = []
+    regressions = []
+    for key in sorted(old_results.keys() & new_results.keys()):
+        old, new = old_results[key], new_results[key]
+        metrics = [("per_call", old["per_call"], new["per_call"])]
+        if old.get("peak_bytes") and new.get("peak_bytes"):
+            metrics.append(("peak_bytes", old["peak_bytes"], new["peak_bytes"]))
+        for metric, old_value, new_value in metrics:
+            ratio = new_value / old_value if old_value else float("inf")
+            worse = ratio > 1 + threshold
+            if metric == "per_call" and new_value - old_value < NOISE_SECONDS:
+                worse = False
+            rows.append((key, metric, old_value, new_value, ratio, worse))
+            if worse:
+                regressions.append((key, metric, old_value, new_value, ratio))
+    missing = sorted(old_results.keys() ^ new_results.keys())
+    return rows, regressions, missing
+
+
+def run_compare(args):
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    if baseline.get("settings", {}).get("trace_memory") != current.get("settings", {}).get("trace_memory"):
+        print("Warning: only one run traced memory, which slows its timings down.")
+    rows, regressions, missing = compare_reports(baseline, current, args.threshold)
+    print(f"{'notes':>10}{'content':>9}  {'operation':<18}{'metric':<12}{'baseline':>12}{'current':>12}{'change':>9}")
+    for (count, content_size, operation), metric, old_value, new_value, ratio, worse in rows:
+        if metric == "per_call":
+            old_text, new_text = f"{old_value * 1000:.3f}ms", f"{new_value * 1000:.3f}ms"
+        else:
+            old_text, new_text = f"{old_value / 1e6:.1f}MB", f"{new_value / 1e6:.1f}MB"
+        flag = "  REGRESSION" if worse else ""
+        print(f"{count:>10}{content_size:>9}  {operation:<18}{metric:<12}{old_text:>12}{new_text:>12}"
+              f"{ratio - 1:>+9.0%}{flag}")
+    for count, content_size, operation in missing:
+        print(f"{operation} ({count} notes, content {content_size}) is only in one of the runs")
+    if regressions:
+        print(f"{len(regressions)} regressions (more than {args.threshold:.0%} worse)")
+        sys.exit(1)
+    print("No regressions.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the note-taking application.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    memory = commands.add_parser("memory", help="compare the memory used by the note layouts")
+    memory.add_argument("--count", type=int, default=100_000)
+    memory.add_argument("--content-size", type=int, default=200)
+    memory.add_argument("--layouts", nargs="+", choices=list(LAYOUTS), default=list(LAYOUTS))
+    memory.add_argument("--loaded", action="store_true",
+                        help="measure a NoteManager that loaded the notes, search index included")
+    memory.set_defaults(run=run_memory)
+
+    export = commands.add_parser("export", help="measure convert_to_csv throughput")
+    export.add_argument("--count", type=int, default=1_000_000)
+    export.add_argument("--content-size", type=int, default=200)
+    export.add_argument("--chunk-size", type=int, default=5000)
+    export.add_argument("--shards", type=int, default=4)
+    export.set_defaults(run=run_export)
+
+    codec = commands.add_parser("codec", help="compare save/load time and size of the snapshot codecs")
+    codec.add_argument("--count", type=int, default=1_000_000)
+    codec.add_argument("--content-size", type=int, default=200)
+    codec.add_argument("--codecs", nargs="+", choices=list(CODECS), default=list(CODECS))
+    codec.set_defaults(run=run_codec)
+
+    load = commands.add_parser("async", help="load test AsyncNoteManager with many concurrent clients")
+    load.add_argument("--clients", type=int, default=2000)
+    load.add_argument("--operations", type=int, default=20, help="operations per client")
+    load.add_argument("--sqlite", action="store_true", help="use the SQLite backend")
+    load.set_defaults(run=run_async)
+
+    served = commands.add_parser("server", help="request latency of NoteServer, one at a time and batched")
+    served.add_argument("--requests", type=int, default=5000, help="adds and as many searches")
+    served.add_argument("--batch-size", type=int, default=100)
+    served.add_argument("--sqlite", action="store_true", help="use the SQLite backend")
+    served.set_defaults(run=run_server)
+
+    startup = commands.add_parser("startup", help="import time and cold/warm start of the application")
+    startup.add_argument("--count", type=int, default=100_000)
+    startup.add_argument("--content-size", type=int, default=200)
+    startup.add_argument("--runs", type=int, default=STARTUP_RUNS)
+    startup.set_defaults(run=run_startup)
+
+    suite = commands.add_parser("run", help="time the NoteManager operations at several note counts")
+    suite.add_argument("--sizes", type=int, nargs="+", default=SUITE_SIZES)
+    suite.add_argument("--content-sizes", type=int, nargs="+", default=SUITE_CONTENT_SIZES,
+                       help="average content length; each note varies by up to 50%%")
+    suite.add_argument("--calls", type=int, default=1000, help="adds/edits/deletes/searches per dataset")
+    suite.add_argument("--trace-memory", action="store_true",
+                       help="record the peak allocation of every operation (slows the timings down)")
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--codec", choices=list(CODECS), help="snapshot format (default: as written, JSON)")
+    suite.add_argument("--output", help="write the results to this JSON file")
+    suite.set_defaults(run=run_suite)
+
+    compare = commands.add_parser("compare", help="compare two JSON results of run and flag regressions")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                         help="relative slowdown that counts as a regression (0.1 = 10%%)")
+    compare.set_defaults(run=run_compare)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
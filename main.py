@@ -1,12 +1,50 @@
 import datetime
 import json
+import os
+import re
 import uuid
-from colorama import Fore, Style
+from itertools import starmap
+from note_codec import ID_FIELD, CodecError
+from note_compact import CompactNote, CompactNoteStore
+from note_index import SEARCH_MODES, tokenize
+from note_sort import SORT_ORDERS, check_sort, to_seconds
+from note_storage import gc_paused, open_storage
 
 MAX_MENU_NUMBER = 7
 MIN_CHA_NUMBER = 3
+PAGE_SIZE = 20
+# None: plain Note objects, "notes": slotted CompactNote objects, "columns": CompactNoteStore,
+# "content": ContentNote objects, their bodies deduplicated and compressed (see note_content).
+# "notes" and "columns" are not a way to save memory in a manager: the id strings stay
+# alive as store keys and in the search index, which takes most of a loaded manager, so
+# they come within 1-2% of plain notes (benchmark.py memory --loaded). Only "content"
+# shrinks a loaded manager noticeably, and only when the bodies are long or repeated.
+COMPACT_MODES = (None, "notes", "columns", "content")
+# NoteManager methods timed when NOTES_METRICS includes "metrics" (see note_metrics)
+INSTRUMENTED_METHODS = ("load_notes", "save_notes", "add_note", "update_note", "remove_notes", "find_notes",
+                        "import_notes", "convert_to_csv", "compact_notes", "refresh_notes", "view_note",
+                        "page_notes")
+
+class LazyImport:
+    # `from module import name` done on first use: colorama alone takes longer to
+    # import than the rest of startup, and a run without errors never needs it.
+    # Modules that only some code paths need are imported inside those functions.
+    def __init__(self, module, name):
+        self.module = module
+        self.name = name
+        self.target = None
+
+    def __getattr__(self, attr):
+        if self.target is None:
+            self.target = getattr(__import__(self.module, fromlist=[self.name]), self.name)
+        return getattr(self.target, attr)
+
+Fore = LazyImport("colorama", "Fore")
+Style = LazyImport("colorama", "Style")
 
 class Note:
+    __slots__ = ("id", "title", "content", "timestamp")
+
     def __init__(self, title, content, id=None, timestamp=None):
         self.id = id if id is not None else str(uuid.uuid4())
         self.title = title
@@ -27,94 +65,374 @@ class Note:
     #     print(f"{self.title} and {self.content}")
 
 class NoteManager:
-    def __init__(self, filename="notes.json"):
-        self.filename="notes.json"
-        self.notes = []
+    def __init__(self, filename="notes.json", streaming=False, compact=None, storage=None, verbose=True, codec=None,
+                 autosave=None):
+        if compact not in COMPACT_MODES:
+            raise ValueError(f"Unknown compact mode: {compact}")
+        self.filename = filename
+        # verbose=False keeps the manager quiet when it is used as a library
+        self.verbose = verbose
+        # JSON snapshot + journal by default, SQLite for notes.db (see open_storage);
+        # codec="binary" or "pretty" changes the snapshot format (see note_codec),
+        # codec="mmap" maps a binary snapshot instead of loading it (see note_mmap)
+        self.storage = storage if storage is not None else open_storage(filename, codec)
+        # streaming=True parses notes.json lazily, only as far as the notes asked for
+        self.streaming = streaming
+        self.compact = compact
+        self.note_class = Note if compact is None else CompactNote
+        if compact == "content":
+            from note_content import ContentStore, content_note_class
+            # the notes keep their bodies as stored in this manager's store
+            self.note_class = content_note_class(ContentStore())
+        self.unread_notes = None
+        # note id -> note, in insertion order
+        self.notes = self.new_note_store()
+        # menu numbers: note ids in display order, rebuilt only after a delete
+        self.order = None
+        # listing order: None (insertion order) or a note_sort.SORT_ORDERS name
+        self.sort = None
+        # sort name -> SortedOrder (see NoteStorage.sorted_order), built on first use and
+        # kept up to date afterwards
+        self.sorted_orders = {}
+        self.index = self.storage.new_index()
+        # worker processes for substring/regex scans of large stores (None = one per core)
+        self.search_processes = None
+        # their note_parallel.ScanPool, started on the first scan that needs it
+        self.scan_pool = None
+        from note_cache import SearchCache
+        # recent find_notes results, for stores held in memory (see note_cache)
+        self.search_cache = SearchCache()
         self.load_notes()
+        # autosave=seconds writes the unsaved changes in the background that long after
+        # the last one (see note_autosave); None leaves it to save_notes
+        self.autosaver = None
+        if autosave:
+            from note_autosave import Autosaver
+            self.autosaver = Autosaver(self.autosave, autosave)
+            # a full batch of records is written by the autosave thread as well
+            self.storage.flush_soon = self.autosaver.flush_soon
     
-    def load_notes(self):
+    def say(self, *args):
+        if self.verbose:
+            print(*args)
+
+    def record(self, op, note_dict):
+        self.storage.record(op, note_dict)
+        if self.autosaver is not None:
+            self.autosaver.touch()
+
+    def autosave(self):
+        # runs on the autosave thread: append the dirty notes to the journal, nothing more
         try:
-            with open(self.filename, "r") as f:
-                # # [{'name': 'Alice', 'age': 25}, {'name': 'Bob', 'age': 30}, ...], 苦手
-                notes_as_dicts = json.load(f)
-                self.notes = [Note(d["id"], d["title"], d["content"], d["timestamp"]) for d in notes_as_dicts]
-            print(f"Notes loaded from {self.filename}")
-        except FileNotFoundError:
-            print("No saved notes file found. Starting with an empty list.")
-            self.notes = []
-        except json.JSONDecodeError:
-             print("Error decoding notes file. Starting with an empty list.")
-             self.notes = []
+            if self.storage.unsaved():
+                import note_metrics
+                self.storage.flush()
+                note_metrics.count("autosaves")
         except Exception as e:
-            print(f"An unexpected error occurred while loading notes: {e}")
-            self.notes = []
+            self.say(Fore.RED + f"An error occurred while autosaving notes: {e}" + Style.RESET_ALL)
+
+    def close(self):
+        # stop autosaving and the scan workers, and write what is left
+        if self.autosaver is not None:
+            self.storage.flush_soon = None
+            self.autosaver.stop()
+            self.autosaver = None
+        if self.scan_pool is not None:
+            self.scan_pool.shutdown()
+        self.storage.close()
+
+    def load_notes(self):
+        with gc_paused():
+            self.unread_notes = None
+            self.order = None
+            self.sorted_orders = {}
+            self.search_cache.clear()
+            try:
+                if not self.storage.in_memory:
+                    # the notes stay in the database and are read as they are needed
+                    self.notes = self.storage.open_notes(self.note_class)
+                    self.say(f"Notes opened from {self.filename}")
+                elif self.streaming:
+                    self.notes = self.new_note_store()
+                    self.unread_notes = self.storage.iter_load()
+                    self.say(f"Streaming notes from {self.filename}")
+                else:
+                    # rows are (title, content, id, timestamp), the note_class arguments
+                    rows = self.storage.load()
+                    if self.compact == "content":
+                        self.new_content_store(rows)
+                    self.notes = self.notes_from_rows(rows)
+                    self.say(f"Notes loaded from {self.filename}")
+            except FileNotFoundError:
+                self.say("No saved notes file found. Starting with an empty list.")
+                self.notes = self.empty_notes()
+            except (json.JSONDecodeError, CodecError):
+                # keep the damaged file for recovery instead of overwriting it on the next save
+                backup = self.storage.quarantine()
+                if backup is not None:
+                    self.say(f"Error decoding notes file. It was moved to {backup}.")
+                    # whatever the journal holds is still loaded
+                    return self.load_notes()
+                self.say("Error decoding notes file. Starting with an empty list.")
+                self.notes = self.empty_notes()
+            except Exception as e:
+                # the next save would overwrite a file that could not be read, so it is
+                # moved aside as well; if that fails too the error is not swallowed
+                backup = self.storage.quarantine()
+                if backup is not None:
+                    self.say(f"An unexpected error occurred while loading notes: {e}. "
+                             f"The notes file was moved to {backup}.")
+                    return self.load_notes()
+                self.say(f"An unexpected error occurred while loading notes: {e}")
+                self.notes = self.empty_notes()
+            for notice in self.storage.take_notices():
+                self.say(Fore.RED + notice + Style.RESET_ALL)
+            self.storage.build_index(self.index, self.notes)
+
+    def new_note_store(self, notes=()):
+        if self.compact == "columns":
+            return CompactNoteStore(notes)
+        return {note.id: note for note in notes}
+
+    def notes_from_rows(self, rows):
+        # keyed by the rows' own id strings, which the index built from the same rows
+        # shares (see JournalStorage.extend_index); note.id would be a new string per
+        # note for the compact layouts
+        if self.compact == "columns":
+            return CompactNoteStore(starmap(self.note_class, rows))
+        note_class = self.note_class
+        return {row[ID_FIELD]: note_class(*row) for row in rows}
+
+    def empty_notes(self):
+        # what a failed load starts over with
+        if self.storage.in_memory:
+            return self.new_note_store()
+        return self.storage.empty_notes(self.note_class)
+
+    def note_order(self):
+        if self.sort is not None:
+            return self.sorted_order(self.sort)
+        if self.order is None:
+            self.order = self.storage.note_order(self.notes)
+        return self.order
+
+    def sorted_order(self, sort):
+        if sort not in self.sorted_orders:
+            self.read_notes()
+            self.sorted_orders[sort] = self.storage.sorted_order(sort, self.notes)
+        return self.sorted_orders[sort]
+
+    def set_sort(self, sort):
+        # changes the menu numbers too: they follow the listing
+        self.sort = check_sort(sort)
+
+    def update_sorted(self, note):
+        for order in self.sorted_orders.values():
+            order.update(note)
+
+    def remove_sorted(self, note_id):
+        for order in self.sorted_orders.values():
+            order.discard(note_id)
+
+    def read_notes(self, count=None):
+        # streaming mode: parse further into the file until `count` notes are loaded (None = all)
+        if self.unread_notes is None:
+            return
+        try:
+            for row in self.unread_notes:
+                note = self.note_class(*row)
+                self.notes[note.id] = note
+                if self.order is not None:
+                    self.order.append(note.id)
+                self.index.add(note, keep_sorted=False)
+                if count is not None and len(self.notes) >= count:
+                    return
+        except (json.JSONDecodeError, CodecError):
+            message = f"Error decoding notes file. Keeping the {len(self.notes)} notes read so far."
+            # a later compaction would replace the file with only those notes
+            backup = self.storage.quarantine()
+            if backup is not None:
+                message += f" The file was moved to {backup}."
+            self.say(message)
+        self.unread_notes = None
+
+    def iter_notes(self):
+        # in listing order
+        if self.unread_notes is None and self.sort is None:
+            yield from self.notes.values()
+            return
+        i = 0
+        while True:
+            if i >= len(self.note_order()):
+                self.read_notes(i + PAGE_SIZE)
+                if i >= len(self.note_order()):
+                    return
+            yield self.notes[self.note_order()[i]]
+            i += 1
+
+    def list_notes(self, cursor=0, page_size=PAGE_SIZE):
+        # (notes from position `cursor` on, cursor of the next page or None after the last);
+        # only these notes are read, whatever the size of the store
+        self.read_notes(cursor + page_size + 1)
+        order = self.note_order()
+        note_ids = order[cursor:cursor + page_size]
+        next_cursor = cursor + page_size if cursor + page_size < len(order) else None
+        return [self.notes[note_id] for note_id in note_ids], next_cursor
+
+    def page_notes(self, page, page_size=PAGE_SIZE):
+        return self.list_notes(page * page_size, page_size)[0]
+
+    def page_count(self, page_size=PAGE_SIZE):
+        # None while streaming: the number of notes is not known before they are all read
+        if self.unread_notes is not None:
+            return None
+        return max(1, -(-len(self.notes) // page_size))
+
+    def notes_between(self, since=None, until=None, limit=None):
+        # notes last modified at or after `since` and before `until` (datetimes or
+        # timestamp strings, None = open-ended), newest first; answered from the
+        # timestamp order, so the cost grows with the notes returned, not the store
+        note_ids = self.sorted_order("timestamp").between(to_seconds(since), to_seconds(until), limit)
+        return [self.notes[note_id] for note_id in note_ids]
+
+    def recent_notes(self, count):
+        return self.notes_between(limit=count)
+
+    def get_note_id(self, index):
+        # menu position -> note id, or None when there is no such note
+        self.read_notes(index + 1)
+        order = self.note_order()
+        if 0 <= index < len(order):
+            return order[index]
+        return None
     
     def add_note(self, title, content):
-        if not title or not content:
-            print(Fore.RED + "Error: Title and content cannot be empty.")
-            print(Style.RESET_ALL)
+        from note_import import validate_note
+        error = validate_note(title, content, MIN_CHA_NUMBER)
+        if error:
+            self.say(Fore.RED + error)
+            self.say(Style.RESET_ALL)
             # False -> break?, True -> main menu
             return False
-        if len(title) <= MIN_CHA_NUMBER or len(content) <= MIN_CHA_NUMBER:
-            print(Fore.RED + f"Title and content must be at least {MIN_CHA_NUMBER} characters long.")
-            print(Style.RESET_ALL)
-            return False
-        note = Note(title, content)
-        self.notes.append(note)
-        print("Note added successfully!")
-        return True
+        self.read_notes()
+        note = self.note_class(title, content)
+        self.notes[note.id] = note
+        if self.order is not None:
+            self.order.append(note.id)
+        self.index.add(note)
+        self.update_sorted(note)
+        self.search_cache.note_changed(after=(note.title, note.content))
+        self.record("add", note.to_dict())
+        self.say("Note added successfully!")
+        return note
     
-    def view_note(self):
+    def import_notes(self, filename, fmt=None, batch_size=None, processes=0):
+        # Bulk import from CSV or JSON Lines. Rows are checked against the same rules as
+        # add_note a batch at a time (optionally in worker processes), rejects are
+        # collected in the returned report, and each batch is committed in one go.
+        import csv
+        from note_import import IMPORT_BATCH_SIZE, ImportReport, checked_batches, detect_format
+        batch_size = batch_size or IMPORT_BATCH_SIZE
+        fmt = fmt or detect_format(filename)
+        self.read_notes()
+        report = ImportReport()
+        try:
+            for checked, rejects in checked_batches(filename, fmt, MIN_CHA_NUMBER, batch_size, processes):
+                report.rejected.extend(rejects)
+                batch = []
+                for row, title, content, note_id, timestamp in checked:
+                    if note_id is not None and note_id in self.notes:
+                        report.rejected.append((row, f"Duplicate id: {note_id}"))
+                        continue
+                    note = self.note_class(title, content, note_id, timestamp)
+                    self.notes[note.id] = note
+                    self.index.add(note, keep_sorted=False)
+                    self.update_sorted(note)
+                    batch.append(note)
+                if self.order is not None:
+                    self.order.extend(note.id for note in batch)
+                if batch:
+                    # cheaper than checking every cached query against every note
+                    self.search_cache.clear()
+                self.storage.record_many("add", [note.to_dict() for note in batch])
+                report.imported += len(batch)
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            self.say(Fore.RED + f"An error occurred while importing notes: {e}")
+            self.say(Style.RESET_ALL)
+        self.say(report.summary())
+        return report
+
+    def view_note(self, page=None, page_size=PAGE_SIZE):
+        # page=None lists every note, otherwise only that page is read and printed
+        self.read_notes(page_size)
         if not self.notes:
             print("No notes to display.")
             return
-        print("\n--- Your Notes ---")
-        for i, note in enumerate(self.notes):
+        # in streaming mode the first notes are printed while the rest is still being parsed
+        if page is None:
+            print("\n--- Your Notes ---")
+            notes, start = self.iter_notes(), 0
+        else:
+            pages = self.page_count(page_size)
+            of_pages = f" of {pages}" if pages else ""
+            sort = f", by {self.sort}" if self.sort else ""
+            print(f"\n--- Your Notes (page {page + 1}{of_pages}{sort}) ---")
+            notes, start = self.page_notes(page, page_size), page * page_size
+        for i, note in enumerate(notes, start):
             print(f"{i + 1}. Title: {note.title}")
             print(f"   Timestamp: {note.timestamp}")
             print("------------------")
     
     def get_note_detail(self, index):
-        if index < 0 or len(self.notes) - 1 < index:
-            print(f"There are {len(self.notes)} notes.")
+        note_id = self.get_note_id(index)
+        if note_id is None:
+            self.say(f"There are {len(self.notes)} notes.")
             return
         else:
-            return self.notes[index]
+            return self.notes[note_id]
         
     def edit_note(self, index, new_title, new_content):
-        if index < 0 or len(self.notes) - 1 < index:
-            print(Fore.RED + f"No.{note_index} note does not exist.")
-            print(Style.RESET_ALL)
+        note_id = self.get_note_id(index)
+        if note_id is None:
+            self.say(Fore.RED + f"No.{index + 1} note does not exist.")
+            self.say(Style.RESET_ALL)
             return False
+        return self.update_note(note_id, new_title, new_content)
 
-        if not new_title or not new_content:
-            print(Fore.RED + "Error: Title and content cannot be empty.")
-            print(Style.RESET_ALL)
-            return False
-
-        if len(new_title) <= MIN_CHA_NUMBER or len(new_content) <= MIN_CHA_NUMBER:
-            print(Fore.RED + f"Title and content must be at least {MIN_CHA_NUMBER} characters long.")
-            print(Style.RESET_ALL)
+    def update_note(self, note_id, new_title, new_content):
+        from note_import import validate_note
+        error = validate_note(new_title, new_content, MIN_CHA_NUMBER)
+        if error:
+            self.say(Fore.RED + error)
+            self.say(Style.RESET_ALL)
             return False
         # get old data
-        if self.notes[index]:
-            target_note = self.notes[index]
+        target_note = self.notes.get(note_id)
+        if target_note:
+            before = (target_note.title, target_note.content)
             # target_note["title"]がダメな理由
             target_note.title = new_title
             target_note.content = new_content
             target_note.timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            print("Note updated successfully!")
+            # column stores hand out copies, so the edited note is written back
+            self.notes[note_id] = target_note
+            self.index.update(target_note)
+            self.update_sorted(target_note)
+            self.search_cache.note_changed(before, (new_title, new_content))
+            self.record("edit", target_note.to_dict())
+            self.say("Note updated successfully!")
             return True
         else:
-            print("Does not exist.")
+            self.say("Does not exist.")
             return False
     
     def delete_note(self, index):
-        if 0 <= index < len(self.notes):
+        note_id = self.get_note_id(index)
+        if note_id is not None:
             while True:
-                confirm = input(f"Are you sure you want to delete this note (title: {self.notes[index].title})? (y/n): ")
+                confirm = input(f"Are you sure you want to delete this note (title: {self.notes[note_id].title})? (y/n): ")
                 if confirm == "y":
-                    deleted_note = self.notes.pop(index)
+                    self.remove_notes([note_id])
                     print(f"Note deleted successfully!")
                     break
                 elif confirm == "n":
@@ -127,14 +445,84 @@ class NoteManager:
             print("Does not exist.")
             return False
 
-    def search_note(self, term):
-        # いったん両方小文字に変換して検索
-        lower_term = term.lower()
-        result_notes = []
-        for note in self.notes:
-            if lower_term in note.title.lower() or lower_term in note.content.lower():
-                result_notes.append(note)
-        
+    def remove_notes(self, note_ids):
+        # delete by id without asking; each delete is O(1), the menu numbers are renumbered once afterwards
+        self.read_notes()
+        removed = 0
+        for note_id in note_ids:
+            note = self.notes.pop(note_id, None)
+            if note is None:
+                continue
+            self.index.remove(note_id)
+            self.remove_sorted(note_id)
+            self.search_cache.note_changed(before=(note.title, note.content))
+            self.record("delete", {"id": note_id})
+            removed += 1
+        if removed:
+            self.order = None
+        return removed
+
+    def find_notes(self, term, mode="all", prefix=True, limit=None, since=None, until=None):
+        # "all"/"any" use the inverted index (AND/OR over words, ranked by relevance),
+        # "fuzzy" too, allowing a typo or two per word (see note_fuzzy),
+        # "substring" and "regex" scan every note (split over worker processes for large
+        # stores, see note_parallel) and rank by the number of hits.
+        # since/until keep only the notes modified in that range (see notes_between).
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        import note_metrics
+        from note_cache import query_key
+        self.read_notes()
+        # only stores held in memory see every change to their notes
+        cache = self.search_cache if self.storage.in_memory else None
+        key = query_key(term, mode, prefix, limit, since, until)
+        note_ids = cache.get(key) if cache is not None else None
+        if note_ids is None:
+            note_ids = self.search_ids(term, mode, prefix, limit, since, until)
+            if cache is not None:
+                cache.put(key, note_ids)
+        note_metrics.count("search_hits", len(note_ids))
+        return [self.notes[note_id] for note_id in note_ids]
+
+    def search_ids(self, term, mode, prefix, limit, since, until):
+        in_range = None
+        if since is not None or until is not None:
+            in_range = set(self.sorted_order("timestamp").between(to_seconds(since), to_seconds(until)))
+        # the limit applies after the range filter
+        search_limit = limit if in_range is None else None
+        # a query without any words (e.g. "!!") can only be answered by the scan
+        if mode in ("all", "any", "fuzzy") and tokenize(term):
+            if in_range is not None and self.storage.in_memory:
+                # the in-memory index scores the notes in range only
+                note_ids = self.index.search(term, mode, prefix, limit, within=in_range)
+            else:
+                note_ids = self.index.search(term, mode, prefix, search_limit)
+        else:
+            # いったん両方小文字に変換して検索
+            from note_parallel import ScanPool, scan_notes
+            if self.scan_pool is None:
+                self.scan_pool = ScanPool()
+            note_ids = scan_notes(self.notes, term, "regex" if mode == "regex" else "substring", search_limit,
+                                  self.search_processes, in_memory=self.storage.in_memory, pool=self.scan_pool)
+        if in_range is not None:
+            note_ids = [note_id for note_id in note_ids if note_id in in_range][:limit]
+        return note_ids
+
+    def search_note(self, term, mode="all", since=None, until=None):
+        try:
+            result_notes = self.find_notes(term, mode, since=since, until=until)
+        except re.error as e:
+            print(Fore.RED + f"Invalid regular expression: {e}")
+            print(Style.RESET_ALL)
+            return False
+        if not result_notes and mode == "all" and tokenize(term):
+            # no exact hit: maybe a typo
+            try:
+                result_notes = self.find_notes(term, "fuzzy", since=since, until=until)
+            except ValueError:
+                result_notes = []
+            if result_notes:
+                print("No exact match. Similar notes:")
         if len(result_notes) > 0:
             print("\n--- Results ---")
             for i, note in enumerate(result_notes):
@@ -147,14 +535,118 @@ class NoteManager:
             return True
 
     def save_notes(self):
+        # only the changes since the last save are appended to the journal
         try:
-            with open(self.filename, "w") as f:
-                notes_as_dicts = [note.to_dict() for note in self.notes]
-                json.dump(notes_as_dicts, f, indent=4)
-            print(f"Notes saved to {self.filename}")
+            self.storage.flush()
+            self.refresh_notes()
+            if self.storage.needs_compaction():
+                self.compact_notes()
+            self.say(f"Notes saved to {self.filename}")
         except Exception as e:
-            print(f"An error occurred while saving notes: {e}")
+            self.say(f"An error occurred while saving notes: {e}")
 
+    def convert_to_csv(self, filename="notes.csv", compress=False, shards=1, chunk_size=None):
+        # compress=True writes gzip, shards > 1 splits the export into files written in parallel
+        from note_export import EXPORT_CHUNK_SIZE, note_rows, write_csv, write_csv_shards
+        chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+        self.read_notes()
+        if not self.notes:
+            self.say("No notes to export")
+            return False
+        if compress and not filename.endswith(".gz"):
+            filename += ".gz"
+        try:
+            rows = note_rows(self.notes.values())
+            if shards > 1:
+                filenames = write_csv_shards(rows, len(self.notes), filename, shards, compress, chunk_size)
+                self.say(f"Notes exported to {', '.join(filenames)}")
+            else:
+                write_csv(rows, filename, compress, chunk_size)
+                self.say(f"Notes exported to {filename}")
+            return True
+        except Exception as e:
+            self.say(f"An error occurred while exporting notes: {e}")
+            return False
+
+    def new_content_store(self, rows):
+        # a fresh store for a full load, its dictionary trained on the loaded bodies
+        from note_content import ContentStore, content_note_class, train_sample
+        store = ContentStore()
+        store.train(train_sample([row[1] for row in rows]))
+        self.note_class = content_note_class(store)
+
+    def compact_notes(self):
+        # fold the journal into a fresh notes.json snapshot
+        self.read_notes()
+        self.refresh_notes()
+        compacted = self.storage.compact(self.notes)
+        if self.compact == "content" and self.storage.in_memory:
+            # drop the bodies of deleted and edited notes along with their log records
+            self.note_class.store.sweep(note.body for note in self.notes.values())
+        return compacted
+
+    def content_stats(self):
+        # dedup ratio and the memory and disk the content store saves (see
+        # ContentStore.stats); without compact="content", what it would save
+        from note_content import ContentStore, train_sample
+        self.read_notes()
+        if self.compact == "content":
+            store = self.note_class.store
+            bodies = [note.body for note in self.notes.values()]
+        else:
+            contents = [note.content for note in self.notes.values()]
+            store = ContentStore()
+            store.train(train_sample(contents))
+            bodies = list(map(store.put, contents))
+        stats = store.stats(bodies)
+        # what the snapshot takes now, in whichever codec it was written (codec="packed"
+        # stores the bodies as the content store does)
+        stats["snapshot_bytes"] = os.path.getsize(self.filename) if os.path.isfile(self.filename) else None
+        return stats
+
+    def reshard_notes(self, shard_count):
+        # grow a sharded store (notes.shards, see note_shard); returns how many notes moved
+        if not hasattr(self.storage, "reshard"):
+            raise ValueError("Only a sharded store can be resharded")
+        self.read_notes()
+        return self.storage.reshard(shard_count, self.notes)
+
+    def refresh_notes(self):
+        # pick up what other processes saved to the same store; True when anything changed
+        if not self.storage.has_changes():
+            return False
+        self.read_notes()
+        changes = self.storage.read_changes()
+        if changes is None:
+            # the store was compacted elsewhere: save ours to the new journal, then reload
+            self.storage.flush()
+            self.load_notes()
+            return True
+        self.merge_changes(changes)
+        return bool(changes)
+
+    def merge_changes(self, changes):
+        for note_id, d in changes.items():
+            old = self.notes.get(note_id)
+            before = (old.title, old.content) if old is not None else None
+            if d is None:
+                if self.notes.pop(note_id, None) is not None:
+                    self.index.remove(note_id)
+                    self.remove_sorted(note_id)
+                    self.search_cache.note_changed(before=before)
+                    self.order = None
+                continue
+            note = self.note_class(d["title"], d["content"], d["id"], d["timestamp"])
+            is_new = old is None
+            self.search_cache.note_changed(before, (note.title, note.content))
+            self.notes[note_id] = note
+            if is_new:
+                self.index.add(note)
+                if self.order is not None:
+                    self.order.append(note_id)
+            else:
+                self.index.update(note)
+            self.update_sorted(note)
 
 
 # 苦手
@@ -184,8 +676,58 @@ def get_user_choice():
         else:
             print(f"Invalid choice. Please enter a number between 1 and {MAX_MENU_NUMBER}.")
 
+def choose_note(note_manager, prompt, page=0):
+    # Show a page of notes and let the user page through them until a note is picked.
+    # Returns (note index or None on Enter, current page).
+    note_manager.view_note(page)
+    while note_manager.notes:
+        choice = input(f"{prompt} (n/p: next/previous page, g<number>: go to page, "
+                       f"s: change sort, Enter: return): ").strip().lower()
+        if not choice:
+            return None, page
+        if choice in ("n", "p") or choice.startswith("g"):
+            if choice == "n":
+                target = page + 1
+            elif choice == "p":
+                target = page - 1
+            elif choice[1:].strip().isdigit():
+                target = int(choice[1:]) - 1
+            else:
+                print("Please enter a page number after g.")
+                continue
+            # only the target page is read, also to find out whether it exists
+            if target < 0 or (target > 0 and not note_manager.page_notes(target)):
+                print("No such page.")
+                continue
+            page = target
+            note_manager.view_note(page)
+        elif choice == "s":
+            # insertion order -> newest first -> by title -> insertion order
+            sorts = (None,) + tuple(SORT_ORDERS)
+            note_manager.set_sort(sorts[(sorts.index(note_manager.sort) + 1) % len(sorts)])
+            page = 0
+            note_manager.view_note(page)
+        elif choice.isdigit():
+            return int(choice) - 1, page
+        else:
+            print("Invalid input. Please enter a number or press Enter.")
+    return None, page
+
 def main():
-    note_manager = NoteManager()
+    # NOTES_METRICS=metrics,profile,memory prints latency/profile/memory reports on exit
+    import note_metrics
+    modes = note_metrics.parse_modes(os.environ.get(note_metrics.METRICS_ENV, ""))
+    capture = note_metrics.Capture(modes, NoteManager, INSTRUMENTED_METHODS).start() if modes else None
+    try:
+        run_menu()
+    finally:
+        if capture is not None:
+            capture.stop()
+
+def run_menu():
+    # changes are written in the background as they are made, and at exit at the latest
+    from note_autosave import AUTOSAVE_DELAY
+    note_manager = NoteManager(autosave=AUTOSAVE_DELAY)
     
     while True:
         choice = get_user_choice()
@@ -194,52 +736,41 @@ def main():
             content = input("Enter note content: ").strip()
             note_manager.add_note(title, content)
         elif choice == '2':
-            note_manager.view_note()
-            if note_manager.notes:
-                while True:
-                    try:
-                        detail_choice = input("Enter note number to view details (or press Enter to return): ")
-                        if not detail_choice:
-                            break
-                        note_index = int(detail_choice) - 1
-                        note = note_manager.get_note_detail(note_index)
-                        if note:
-                            print("\n--- Note Details ---")
-                            print(note.content)
-                            print("------------------")
-                        else:
-                            print("Invalid note number.")
-                    except ValueError:
-                        print("Invalid input. Please enter a number or press Enter.")
+            page = 0
+            while True:
+                note_index, page = choose_note(note_manager, "Enter note number to view details", page)
+                if note_index is None:
+                    break
+                note = note_manager.get_note_detail(note_index)
+                if note:
+                    print("\n--- Note Details ---")
+                    print(note.content)
+                    print("------------------")
+                else:
+                    print("Invalid note number.")
         elif choice == '3':
-            note_manager.view_note()
-            if note_manager.notes:
-                try:
-                    edit_choice = int(input("Enter note number to edit: "))
-                    if not edit_choice:
-                        break
-                    note_index = edit_choice - 1
-                    new_title = input("Enter new title: ").strip()
-                    new_content = input("Enter new content: ").strip()
-                    note_manager.edit_note(note_index, new_title, new_content)
-                except ValueError:
-                    print("Invalid input. Please enter a number or press Enter.")
+            note_index, _ = choose_note(note_manager, "Enter note number to edit")
+            if note_index is not None:
+                new_title = input("Enter new title: ").strip()
+                new_content = input("Enter new content: ").strip()
+                note_manager.edit_note(note_index, new_title, new_content)
         elif choice == '4':
-            note_manager.view_note()
-            if note_manager.notes:
-                try:
-                    delete_choice = int(input("Enter note number to delete: "))
-                    note_index = delete_choice - 1
-                    note_manager.delete_note(note_index)
-                except ValueError:
-                    print("Invalid input. Please enter a number or press Enter.")
+            note_index, _ = choose_note(note_manager, "Enter note number to delete")
+            if note_index is not None:
+                note_manager.delete_note(note_index)
         elif choice == '5':
             search_term = input("Enter search word: ").strip()
-            note_manager.search_note(search_term)
+            days = input("Only notes modified in the last how many days? (press Enter for all): ").strip()
+            if days.isdigit():
+                since = datetime.datetime.now() - datetime.timedelta(days=int(days))
+                note_manager.search_note(search_term, since=since)
+            else:
+                note_manager.search_note(search_term)
         elif choice == '6':
             note_manager.convert_to_csv()
         elif choice == '7':
             note_manager.save_notes()
+            note_manager.close()
             print("Exiting application. Goodbye!")
             break
 
@@ -0,0 +1,74 @@
+import asyncio
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from main import NoteManager
+
+
+class AsyncNoteManager:
+    # asyncio front end for NoteManager. Every call runs on one worker thread that owns
+    # the manager, so file and database I/O never blocks the event loop and the manager
+    # itself needs no locking. Per-note locks keep read-modify-write sequences on the
+    # same note (modify_note) from interleaving.
+    def __init__(self, manager, executor=None):
+        self.manager = manager
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="notes")
+        self.note_locks = weakref.WeakValueDictionary()
+
+    @classmethod
+    async def open(cls, filename="notes.json", **options):
+        # the manager is created on the worker thread too (SQLite connections are per thread)
+        options.setdefault("verbose", False)
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="notes")
+        loop = asyncio.get_running_loop()
+        manager = await loop.run_in_executor(executor, functools.partial(NoteManager, filename, **options))
+        return cls(manager, executor)
+
+    async def call(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(method, *args, **kwargs))
+
+    def lock_note(self, note_id):
+        lock = self.note_locks.get(note_id)
+        if lock is None:
+            lock = self.note_locks[note_id] = asyncio.Lock()
+        return lock
+
+    async def add_note(self, title, content):
+        return await self.call(self.manager.add_note, title, content)
+
+    async def get_note(self, note_id):
+        return await self.call(self.manager.notes.get, note_id)
+
+    async def update_note(self, note_id, title, content):
+        async with self.lock_note(note_id):
+            return await self.call(self.manager.update_note, note_id, title, content)
+
+    async def modify_note(self, note_id, change):
+        # change(note) returns the new (title, content); no other edit of this note
+        # can slip in between reading it and writing it back
+        async with self.lock_note(note_id):
+            note = await self.call(self.manager.notes.get, note_id)
+            if note is None:
+                return False
+            title, content = change(note)
+            return await self.call(self.manager.update_note, note_id, title, content)
+
+    async def delete_note(self, note_id):
+        async with self.lock_note(note_id):
+            return await self.call(self.manager.remove_notes, [note_id]) == 1
+
+    async def find_notes(self, term, mode="all", prefix=True, limit=None):
+        return await self.call(self.manager.find_notes, term, mode, prefix, limit)
+
+    async def page_notes(self, page, page_size):
+        return await self.call(self.manager.page_notes, page, page_size)
+
+    async def save_notes(self):
+        return await self.call(self.manager.save_notes)
+
+    async def close(self):
+        await self.save_notes()
+        await self.call(self.manager.close)
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,77 @@
+import atexit
+import threading
+import time
+
+# seconds without a further change before the unsaved changes are written
+AUTOSAVE_DELAY = 2.0
+# a steady stream of changes is still written at least this often
+AUTOSAVE_MAX_DELAY = 30.0
+
+
+class Autosaver:
+    # Calls flush() from a background thread once the changes have settled: `delay`
+    # seconds after the last one, or `max_delay` after the first unsaved one, or right
+    # away after flush_soon() (a full batch). touch() is all an interactive operation
+    # pays (a timestamp under a lock); the write itself happens here. stop() (also run
+    # at interpreter exit) writes what is left.
+    def __init__(self, flush, delay=AUTOSAVE_DELAY, max_delay=AUTOSAVE_MAX_DELAY):
+        self.flush = flush
+        self.delay = delay
+        self.max_delay = max(delay, max_delay)
+        self.condition = threading.Condition()
+        # monotonic time of the first and the last change since the last flush
+        self.first_change = self.last_change = None
+        # flush without waiting for the delay
+        self.urgent = False
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name="notes-autosave", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def touch(self):
+        now = time.monotonic()
+        with self.condition:
+            if self.first_change is None:
+                self.first_change = now
+                self.condition.notify()
+            self.last_change = now
+
+    def flush_soon(self):
+        with self.condition:
+            self.urgent = True
+            self.condition.notify()
+
+    def due(self):
+        # seconds until the next flush, None when there is nothing to write
+        if self.urgent:
+            return 0
+        if self.first_change is None:
+            return None
+        due = min(self.last_change + self.delay, self.first_change + self.max_delay)
+        return due - time.monotonic()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped:
+                    wait = self.due()
+                    if wait is not None and wait <= 0:
+                        break
+                    self.condition.wait(wait)
+                if self.stopped:
+                    return
+                self.first_change = self.last_change = None
+                self.urgent = False
+            # outside the lock, so changes can still be touched while this writes
+            self.flush()
+
+    def stop(self):
+        with self.condition:
+            if self.stopped:
+                return
+            self.stopped = True
+            self.condition.notify()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        atexit.unregister(self.stop)
+        self.flush()
@@ -0,0 +1,139 @@
+import re
+from bisect import bisect_left
+from collections import OrderedDict
+
+import note_metrics
+from note_fuzzy import bounded_distance, max_distance
+from note_index import tokenize
+
+# at most this many cached queries, holding at most this many note ids in total
+CACHE_ENTRIES = 256
+CACHE_IDS = 100000
+
+
+def query_key(term, mode, prefix, limit, since, until):
+    # Normalized form of a find_notes call: word queries by their distinct words in
+    # sorted order (the order does not change AND/OR results), substring queries
+    # lowercased (they match case-insensitively), regular expressions as written.
+    if mode in ("all", "any", "fuzzy"):
+        words = tuple(sorted(set(tokenize(term))))
+        if words:
+            return mode, words, prefix and mode != "fuzzy", limit, since, until
+        mode = "substring"
+    if mode == "substring":
+        return mode, term.lower(), False, limit, since, until
+    return mode, term, False, limit, since, until
+
+
+class NoteText:
+    # the parts of one version of a note that cached queries are checked against
+    __slots__ = ("title", "content", "words")
+
+    def __init__(self, title, content):
+        self.title = title
+        self.content = content
+        self.words = sorted(set(tokenize(title)) | set(tokenize(content)))
+
+    def has_word(self, term, prefix):
+        i = bisect_left(self.words, term)
+        if i == len(self.words):
+            return False
+        return self.words[i] == term or (prefix and self.words[i].startswith(term))
+
+    def has_similar_word(self, term):
+        distance = max_distance(term)
+        return any(bounded_distance(term, word, distance) is not None for word in self.words)
+
+
+def could_match(key, text):
+    # whether a note with this text can be part of the key's results
+    mode, query, prefix = key[:3]
+    if mode == "fuzzy":
+        return any(text.has_similar_word(term) for term in query)
+    if mode in ("all", "any"):
+        return any(text.has_word(term, prefix) for term in query)
+    if mode == "substring":
+        return query in text.title.lower() or query in text.content.lower()
+    try:
+        pattern = re.compile(query, re.IGNORECASE)
+    except re.error:
+        return False
+    return bool(pattern.search(text.title) or pattern.search(text.content))
+
+
+def mixes_weights(key):
+    mode, query, prefix = key[:3]
+    return mode in ("all", "any", "fuzzy") and (len(query) > 1 or prefix or mode == "fuzzy")
+
+
+class SearchCache:
+    # LRU cache of find_notes results (note ids, best first). A change to a note only
+    # evicts the queries that note can match, before or after the change. Adding or
+    # deleting a note also evicts the word queries that rank several indexed words
+    # against each other (more than one word, prefix or fuzzy matches): the note count
+    # shifts their idf weights relative to each other. Edits of other notes, and
+    # substring/regex scans (ranked by hit counts), are never affected.
+    def __init__(self, max_entries=CACHE_ENTRIES, max_ids=CACHE_IDS):
+        self.max_entries = max_entries
+        self.max_ids = max_ids
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        note_ids = self.entries.get(key)
+        if note_ids is None:
+            self.misses += 1
+            note_metrics.count("search_cache_misses")
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        note_metrics.count("search_cache_hits")
+        return note_ids
+
+    def put(self, key, note_ids):
+        if len(note_ids) > self.max_ids:
+            return
+        self.discard(key)
+        self.entries[key] = note_ids
+        self.size += len(note_ids)
+        while len(self.entries) > self.max_entries or self.size > self.max_ids:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def discard(self, key):
+        note_ids = self.entries.pop(key, None)
+        if note_ids is not None:
+            self.size -= len(note_ids)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def note_changed(self, before=None, after=None):
+        # before/after: (title, content) of the changed note, None when it was added/deleted
+        if not self.entries:
+            return
+        texts = [NoteText(*version) for version in (before, after) if version is not None]
+        count_changed = before is None or after is None
+        stale = [key for key in self.entries
+                 if (count_changed and mixes_weights(key)) or any(could_match(key, text) for text in texts)]
+        for key in stale:
+            self.discard(key)
+        self.invalidations += len(stale)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "note_ids": self.size,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
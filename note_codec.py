@@ -0,0 +1,332 @@
+import io
+import json
+import re
+import struct
+import sys
+import zlib
+from array import array
+from itertools import accumulate, chain, islice
+from operator import attrgetter, itemgetter
+
+# snapshots are read and written as rows in the order of Note's constructor
+# arguments, so a row becomes a note with note_class(*row)
+ROW_FIELDS = ("title", "content", "id", "timestamp")
+ID_FIELD = ROW_FIELDS.index("id")
+row_from_dict = itemgetter(*ROW_FIELDS)
+row_from_note = attrgetter(*ROW_FIELDS)
+
+# how much of a JSON snapshot the streaming loader reads at a time
+READ_CHUNK_SIZE = 1 << 16
+# notes encoded per json.dumps call when writing
+ENCODE_BATCH_SIZE = 10000
+
+# binary snapshot: header, then per field the uint64 end offset of every value
+# followed by all values of the field as one UTF-8 blob
+BINARY_MAGIC = b"NOTB"
+BINARY_VERSION = 1
+HEADER = struct.Struct("<4sHHQ")
+OFFSET_SIZE = 8
+
+# packed snapshot (see note_content): header, the shared dictionary, the title, id and
+# timestamp columns as in the binary format, the uint32 body number of every note and
+# every distinct body once, compressed
+PACKED_MAGIC = b"NOTP"
+PACKED_VERSION = 1
+# magic, version, compressor, notes, bodies, dictionary size
+PACKED_HEADER = struct.Struct("<4sHHQQI")
+PACKED_FIELDS = ("title", "id", "timestamp")
+BODY_NUMBER = "I"
+
+WHITESPACE = re.compile(r"\s*")
+
+
+class CodecError(ValueError):
+    pass
+
+
+def iter_json_array(f, chunk_size=READ_CHUNK_SIZE):
+    # yield the elements of a top-level JSON array one by one, reading the file in chunks
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def read_more():
+        nonlocal buffer, pos, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return True
+
+    def next_char():
+        nonlocal pos
+        while True:
+            pos = WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer):
+                return buffer[pos]
+            if not read_more():
+                return ""
+
+    if next_char() != "[":
+        raise json.JSONDecodeError("Expecting '['", buffer, pos)
+    pos += 1
+    if next_char() == "]":
+        return
+
+    while True:
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # the element is cut off at the end of the buffer
+            if eof or not read_more():
+                raise
+            continue
+        if end == len(buffer) and not eof and read_more():
+            # a number or literal may continue in the next chunk
+            continue
+        yield item
+        pos = end
+
+        c = next_char()
+        if c == "]":
+            return
+        if c != ",":
+            raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+        pos += 1
+        next_char()
+
+
+class JsonCodec:
+    # a JSON array of note objects; indent=4 is the original notes.json layout
+    def __init__(self, name, indent=None):
+        self.name = name
+        self.indent = indent
+
+    def dump(self, rows, f):
+        # encoded a batch at a time: the C encoder is only used without indent
+        # for whole documents, and one json.dumps per note would be slower still
+        separators = (",", ": ") if self.indent else (",", ":")
+        rows = iter(rows)
+        f.write(b"[")
+        first = True
+        while True:
+            # keys in the order Note.to_dict uses
+            batch = [{"id": id, "title": title, "content": content, "timestamp": timestamp}
+                     for title, content, id, timestamp in islice(rows, ENCODE_BATCH_SIZE)]
+            if not batch:
+                break
+            text = json.dumps(batch, ensure_ascii=False, indent=self.indent, separators=separators)
+            if not first:
+                f.write(b",")
+            # drop the brackets of the batch (and the newline before "]" when indented)
+            f.write(text[1:-2 if self.indent else -1].encode("utf-8"))
+            first = False
+        f.write(b"\n]" if self.indent else b"]")
+
+    def load(self, f, streaming=False):
+        text = io.TextIOWrapper(f, encoding="utf-8")
+        if streaming:
+            return checked_rows(iter_json_array(text))
+        try:
+            notes = json.load(text)
+        except UnicodeDecodeError as e:
+            raise CodecError(f"Corrupt notes file: {e}") from None
+        # leave f open for the caller
+        text.detach()
+        if not isinstance(notes, list):
+            raise CodecError("Malformed notes file: expected a list of notes")
+        try:
+            return list(map(row_from_dict, notes))
+        except (TypeError, KeyError) as e:
+            raise CodecError(f"Malformed notes file: {e!r}") from None
+
+
+def checked_rows(notes):
+    # rows of a streamed JSON array; text that is not UTF-8 or an element that is not
+    # a note is a damaged file like broken JSON, not an unexpected error
+    try:
+        yield from map(row_from_dict, notes)
+    except UnicodeDecodeError as e:
+        raise CodecError(f"Corrupt notes file: {e}") from None
+    except (TypeError, KeyError) as e:
+        raise CodecError(f"Malformed notes file: {e!r}") from None
+
+
+class BinaryCodec:
+    # A stdlib struct/array format: every field is stored as a column, so writing and
+    # reading are a handful of bulk operations per field instead of work per note.
+    name = "binary"
+
+    def dump(self, rows, f):
+        columns = list(zip(*rows)) or [()] * len(ROW_FIELDS)
+        f.write(HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(ROW_FIELDS), len(columns[0])))
+        for column in columns:
+            write_column(f, column)
+
+    def load(self, f, streaming=False):
+        data = f.read()
+        if len(data) < HEADER.size:
+            raise CodecError("Truncated binary notes file")
+        magic, version, fields, count = HEADER.unpack_from(data)
+        if version != BINARY_VERSION or fields != len(ROW_FIELDS):
+            raise CodecError(f"Unsupported binary notes file (version {version})")
+        pos = HEADER.size
+        columns = []
+        for _ in range(fields):
+            column, pos = read_column(data, pos, count)
+            columns.append(column)
+        return zip(*columns)
+
+
+class PackedCodec:
+    # The binary layout with the bodies stored by content (see note_content.ContentStore):
+    # a body shared by many notes is written once, and every body is compressed with
+    # zlib and a dictionary trained on the bodies, or with lzma. Each distinct body is
+    # decompressed once on load, so notes with the same body share one str.
+    def __init__(self, name, compressor):
+        self.name = name
+        self.compressor = compressor
+
+    def dump(self, rows, f):
+        from note_content import COMPRESSORS, ContentStore, train_sample
+        titles, contents, ids, timestamps = list(zip(*rows)) or [()] * len(ROW_FIELDS)
+        store = ContentStore(self.compressor)
+        store.train(train_sample(contents))
+        bodies = list(map(store.put, contents))
+        numbers = {id(blob): number for number, blob in enumerate(store.blobs.values())}
+        f.write(PACKED_HEADER.pack(PACKED_MAGIC, PACKED_VERSION, COMPRESSORS.index(self.compressor), len(titles),
+                                   len(numbers), len(store.dictionary)))
+        f.write(store.dictionary)
+        for column in (titles, ids, timestamps):
+            write_column(f, column)
+        body_numbers = array(BODY_NUMBER, (numbers[id(blob)] for blob in bodies))
+        if sys.byteorder == "big":
+            body_numbers.byteswap()
+        f.write(body_numbers.tobytes())
+        write_ends(f, map(len, store.blobs.values()))
+        for blob in store.blobs.values():
+            f.write(blob)
+
+    def load(self, f, streaming=False):
+        from note_content import COMPRESSORS, ContentStore
+        data = f.read()
+        if len(data) < PACKED_HEADER.size:
+            raise CodecError("Truncated packed notes file")
+        magic, version, compressor, count, body_count, dictionary_size = PACKED_HEADER.unpack_from(data)
+        if version != PACKED_VERSION or compressor >= len(COMPRESSORS):
+            raise CodecError(f"Unsupported packed notes file (version {version})")
+        pos = PACKED_HEADER.size + dictionary_size
+        store = ContentStore(COMPRESSORS[compressor], data[PACKED_HEADER.size:pos])
+        titles, pos = read_column(data, pos, count)
+        ids, pos = read_column(data, pos, count)
+        timestamps, pos = read_column(data, pos, count)
+        body_numbers = array(BODY_NUMBER)
+        size = count * body_numbers.itemsize
+        if len(data) < pos + size:
+            raise CodecError("Truncated packed notes file")
+        body_numbers.frombytes(data[pos:pos + size])
+        if sys.byteorder == "big":
+            body_numbers.byteswap()
+        ends, pos = read_ends(data, pos + size, body_count)
+        if len(body_numbers) != count or pos + (ends[-1] if body_count else 0) > len(data):
+            raise CodecError("Truncated packed notes file")
+        try:
+            bodies = [store.decompress(data[pos + start:pos + end]).decode("utf-8")
+                      for start, end in zip(chain((0,), ends), ends)]
+            contents = list(map(bodies.__getitem__, body_numbers))
+        except (zlib.error, ValueError, IndexError, EOFError) as e:
+            # lzma.LZMAError and UnicodeDecodeError are ValueErrors as well
+            raise CodecError(f"Corrupt packed notes file: {e}") from None
+        return zip(titles, contents, ids, timestamps)
+
+
+def write_ends(f, lengths):
+    ends = array("Q", accumulate(lengths))
+    if sys.byteorder == "big":
+        ends.byteswap()
+    f.write(ends.tobytes())
+
+
+def read_ends(data, pos, count):
+    chunk = data[pos:pos + count * OFFSET_SIZE]
+    if len(chunk) != count * OFFSET_SIZE:
+        raise CodecError("Truncated notes file")
+    ends = array("Q")
+    ends.frombytes(chunk)
+    if sys.byteorder == "big":
+        ends.byteswap()
+    return ends, pos + count * OFFSET_SIZE
+
+
+def write_column(f, column):
+    # the end offset of every value, then the values as one UTF-8 blob
+    text = "".join(column)
+    blob = text.encode("utf-8")
+    if len(blob) == len(text):
+        # ASCII only: character lengths are byte lengths
+        write_ends(f, map(len, column))
+    else:
+        write_ends(f, (len(value.encode("utf-8")) for value in column))
+    f.write(blob)
+
+
+def read_column(data, pos, count):
+    # (values, position after the column)
+    ends, pos = read_ends(data, pos, count)
+    size = ends[-1] if count else 0
+    if pos + size > len(data):
+        raise CodecError("Truncated notes file")
+    return split_blob(data[pos:pos + size], ends), pos + size
+
+
+def split_blob(blob, ends):
+    starts = chain((0,), ends)
+    try:
+        if blob.isascii():
+            # decode once and slice the str: byte offsets are character offsets
+            text = blob.decode("ascii")
+            return list(map(text.__getitem__, map(slice, starts, ends)))
+        return [blob[start:end].decode("utf-8") for start, end in zip(starts, ends)]
+    except UnicodeDecodeError as e:
+        raise CodecError(f"Corrupt binary notes file: {e}") from None
+
+
+CODECS = {
+    "pretty": JsonCodec("pretty", indent=4),
+    "json": JsonCodec("json"),
+    "binary": BinaryCodec(),
+    "packed": PackedCodec("packed", "zlib"),
+    "packed-lzma": PackedCodec("packed-lzma", "lzma"),
+}
+# packed snapshots by compressor (note_content.COMPRESSORS order)
+PACKED_CODECS = ("packed", "packed-lzma")
+DEFAULT_CODEC = "json"
+
+
+def get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown codec: {name}") from None
+
+
+def detect_codec(f):
+    # binary snapshots start with BINARY_MAGIC, packed ones with PACKED_MAGIC and the
+    # compressor, anything else is read as JSON
+    start = f.tell()
+    head = f.read(8)
+    f.seek(start)
+    if head.startswith(BINARY_MAGIC):
+        return CODECS["binary"]
+    if head.startswith(PACKED_MAGIC) and len(head) == 8:
+        compressor = int.from_bytes(head[6:8], "little")
+        return CODECS[PACKED_CODECS[min(compressor, len(PACKED_CODECS) - 1)]]
+    return CODECS["json"]
+
+
+def load_rows(f, streaming=False):
+    # rows of a snapshot opened in binary mode, in whichever format it was written
+    return detect_codec(f).load(f, streaming)
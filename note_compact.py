@@ -0,0 +1,155 @@
+import datetime
+import sys
+import uuid
+from array import array
+from collections.abc import MutableMapping, ValuesView
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# timestamps are wall-clock strings without a timezone, so they are counted from a
+# naive epoch; that keeps the string <-> int conversion exact in both directions
+EPOCH = datetime.datetime(1970, 1, 1)
+SECOND = datetime.timedelta(seconds=1)
+UUID_SIZE = 16
+
+
+def parse_timestamp(text):
+    # fromisoformat is ~15x faster than strptime but accepts more layouts, so it
+    # only gets strings shaped like TIMESTAMP_FORMAT
+    if len(text) == 19 and text[10] == " " and text[13] == ":" and text[16] == ":":
+        moment = datetime.datetime.fromisoformat(text)
+    else:
+        moment = datetime.datetime.strptime(text, TIMESTAMP_FORMAT)
+    return (moment - EPOCH) // SECOND
+
+
+def format_timestamp(seconds):
+    return (EPOCH + datetime.timedelta(seconds=seconds)).strftime(TIMESTAMP_FORMAT)
+
+
+def now_seconds():
+    return int((datetime.datetime.now() - EPOCH).total_seconds())
+
+
+class CompactNote:
+    # Same interface as Note, but no __dict__, a 16-byte uuid and an int timestamp.
+    # id and timestamp are turned back into strings only when they are read.
+    __slots__ = ("uuid_bytes", "title", "content", "seconds")
+
+    def __init__(self, title, content, id=None, timestamp=None):
+        self.uuid_bytes = uuid.UUID(id).bytes if id is not None else uuid.uuid4().bytes
+        self.title = sys.intern(title)
+        self.content = content
+        self.seconds = parse_timestamp(timestamp) if timestamp is not None else now_seconds()
+
+    @property
+    def id(self):
+        return str(uuid.UUID(bytes=self.uuid_bytes))
+
+    @property
+    def timestamp(self):
+        return format_timestamp(self.seconds)
+
+    @timestamp.setter
+    def timestamp(self, text):
+        self.seconds = parse_timestamp(text)
+
+    def __str__(self):
+        return f"Title: {self.title}\nContent: {self.content}\nTimestamp: {self.timestamp}"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "title": self.title,
+            "content": self.content,
+            "timestamp": self.timestamp
+        }
+
+
+class CompactNoteStore(MutableMapping):
+    # An ordered note id -> note mapping kept as columns: packed uuids, an int64 array
+    # of timestamps, interned titles and contents. Reading an item builds a CompactNote
+    # from its row; write an edited note back with store[note.id] = note.
+    # Deleting leaves a hole in the columns; holes are squeezed out once they make up
+    # half of the rows, so deletes stay O(1) on average.
+    def __init__(self, notes=()):
+        self.clear()
+        for note in notes:
+            self[note.id] = note
+
+    def clear(self):
+        self.uuids = bytearray()
+        self.seconds = array("q")
+        self.titles = []
+        self.contents = []
+        # uuid bytes -> row
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def row(self, index):
+        note = CompactNote.__new__(CompactNote)
+        note.uuid_bytes = bytes(self.uuids[index * UUID_SIZE:(index + 1) * UUID_SIZE])
+        note.title = self.titles[index]
+        note.content = self.contents[index]
+        note.seconds = self.seconds[index]
+        return note
+
+    def __getitem__(self, note_id):
+        return self.row(self.rows[uuid.UUID(note_id).bytes])
+
+    def __iter__(self):
+        for index, title in enumerate(self.titles):
+            if title is not None:
+                yield str(uuid.UUID(bytes=bytes(self.uuids[index * UUID_SIZE:(index + 1) * UUID_SIZE])))
+
+    def values(self):
+        return CompactNoteValues(self)
+
+    def iter_rows(self):
+        for index, title in enumerate(self.titles):
+            if title is not None:
+                yield self.row(index)
+
+    def __setitem__(self, note_id, note):
+        note = self.compact(note)
+        key = uuid.UUID(note_id).bytes
+        index = self.rows.get(key)
+        if index is None:
+            self.rows[key] = len(self.titles)
+            self.uuids += key
+            self.seconds.append(note.seconds)
+            self.titles.append(note.title)
+            self.contents.append(note.content)
+        else:
+            self.seconds[index] = note.seconds
+            self.titles[index] = note.title
+            self.contents[index] = note.content
+
+    def __delitem__(self, note_id):
+        index = self.rows.pop(uuid.UUID(note_id).bytes)
+        self.titles[index] = None
+        self.contents[index] = None
+        if len(self.titles) > 2 * len(self.rows):
+            self.squeeze()
+
+    def squeeze(self):
+        notes = list(self.iter_rows())
+        self.clear()
+        for note in notes:
+            self.rows[note.uuid_bytes] = len(self.titles)
+            self.uuids += note.uuid_bytes
+            self.seconds.append(note.seconds)
+            self.titles.append(note.title)
+            self.contents.append(note.content)
+
+    def compact(self, note):
+        if isinstance(note, CompactNote):
+            return note
+        return CompactNote(note.title, note.content, note.id, note.timestamp)
+
+
+class CompactNoteValues(ValuesView):
+    # iterate the rows directly instead of going through the string ids
+    def __iter__(self):
+        return self._mapping.iter_rows()
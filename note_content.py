@@ -0,0 +1,220 @@
+import datetime
+import hashlib
+import re
+import sys
+import uuid
+import zlib
+from collections import Counter, OrderedDict
+
+COMPRESSORS = ("zlib", "lzma")
+DEFAULT_COMPRESSOR = "zlib"
+# zlib looks back at most 32 KB, but loading the dictionary is paid on every body:
+# half of that keeps most of the gain at about half the cost
+DICTIONARY_SIZE = 16 * 1024
+ZLIB_LEVEL = 6
+# bodies the dictionary is trained on; the ones put before it exists stay uncompressed
+TRAIN_SAMPLE = 1000
+# shorter bodies are stored as they are: compression would not pay for its header
+MIN_COMPRESS_SIZE = 64
+# decompressed bodies kept for repeated reads of the same notes
+RECENT_BODIES = 64
+# the first byte of a stored body says how the rest is encoded
+RAW, ZLIB, LZMA = b"r", b"z", b"x"
+# a raw LZMA2 stream (0x21 is lzma.FILTER_LZMA2), without the .xz container around it;
+# a small dictionary, since a body is compressed on its own (the default 8 MB costs
+# most of a millisecond per body to set up)
+LZMA_FILTERS = [{"id": 0x21, "preset": 6, "dict_size": 1 << 16}]
+# lines and words that make it into the dictionary
+MIN_LINE_LENGTH = 16
+WORD_PATTERN = re.compile(r"\w{4,}")
+
+
+def body_key(data):
+    # content address of a body's UTF-8 bytes
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def train_dictionary(texts, size=DICTIONARY_SIZE):
+    # A zlib preset dictionary for note bodies: the lines (boilerplate) and then the
+    # words that recur in the most sample bodies. zlib finds matches near the end of
+    # the dictionary most cheaply, so the most common strings go last.
+    lines = Counter()
+    words = Counter()
+    for text in texts:
+        lines.update({line for line in text.splitlines() if len(line) >= MIN_LINE_LENGTH})
+        words.update(set(WORD_PATTERN.findall(text)))
+    parts = []
+    used = 0
+    for counter, separator in ((lines, "\n"), (words, " ")):
+        for part, count in sorted(counter.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+            if count < 2:
+                break
+            data = (part + separator).encode("utf-8")
+            if used + len(data) > size:
+                continue
+            parts.append(data)
+            used += len(data)
+    return b"".join(reversed(parts))
+
+
+def train_sample(texts):
+    # every n-th text, about TRAIN_SAMPLE of them
+    return texts[::max(1, len(texts) // TRAIN_SAMPLE)]
+
+
+class ContentStore:
+    # Content-addressed note bodies: each distinct body is kept once, under the hash of
+    # its text, compressed with zlib and a dictionary trained on the bodies themselves
+    # (or with lzma, which has no preset dictionaries in the stdlib). put() returns the
+    # stored body, which the note keeps: notes with the same text share one bytes
+    # object. Bodies are decompressed only when read, and the last few reads are kept.
+    def __init__(self, compressor=DEFAULT_COMPRESSOR, dictionary=None):
+        if compressor not in COMPRESSORS:
+            raise ValueError(f"Unknown compressor: {compressor}")
+        self.compressor = compressor
+        self.dictionary = dictionary if dictionary is not None or compressor == "zlib" else b""
+        # key -> stored body (tag byte + data)
+        self.blobs = {}
+        # the texts put before there was a dictionary, to train it on
+        self.sample = []
+        # stored body -> its text, for the recently read bodies
+        self.recent = OrderedDict()
+
+    def __len__(self):
+        return len(self.blobs)
+
+    def train(self, texts):
+        # the bodies stored before this stay uncompressed until the next load
+        if self.dictionary is None:
+            self.dictionary = train_dictionary(texts)
+            self.sample = []
+
+    def put(self, text):
+        data = text.encode("utf-8")
+        key = body_key(data)
+        blob = self.blobs.get(key)
+        if blob is None:
+            if self.dictionary is None:
+                self.sample.append(text)
+                if len(self.sample) >= TRAIN_SAMPLE:
+                    self.train(self.sample)
+            blob = self.blobs[key] = self.compress(data)
+        # a note just written is likely to be read right away (indexing, display)
+        self.remember(blob, text)
+        return blob
+
+    def get(self, blob):
+        text = self.recent.get(blob)
+        if text is not None:
+            self.recent.move_to_end(blob)
+            return text
+        text = self.decompress(blob).decode("utf-8")
+        self.remember(blob, text)
+        return text
+
+    def remember(self, blob, text):
+        self.recent[blob] = text
+        self.recent.move_to_end(blob)
+        if len(self.recent) > RECENT_BODIES:
+            self.recent.popitem(last=False)
+
+    def compress(self, data):
+        if len(data) >= MIN_COMPRESS_SIZE and self.dictionary is not None:
+            if self.compressor == "lzma":
+                import lzma
+                packed = LZMA + lzma.compress(data, format=lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+            else:
+                compressor = (zlib.compressobj(ZLIB_LEVEL, zdict=self.dictionary) if self.dictionary
+                              else zlib.compressobj(ZLIB_LEVEL))
+                packed = ZLIB + compressor.compress(data) + compressor.flush()
+            if len(packed) < len(data) + 1:
+                return packed
+        return RAW + data
+
+    def decompress(self, blob):
+        tag, data = blob[:1], blob[1:]
+        if tag == RAW:
+            return data
+        if tag == ZLIB:
+            decompressor = zlib.decompressobj(zdict=self.dictionary) if self.dictionary else zlib.decompressobj()
+            return decompressor.decompress(data) + decompressor.flush()
+        if tag == LZMA:
+            import lzma
+            return lzma.decompress(data, format=lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+        raise ValueError(f"Unknown body encoding: {tag!r}")
+
+    def sweep(self, bodies):
+        # forget the bodies no note refers to any more (deleted or edited notes)
+        live = set(map(id, bodies))
+        self.blobs = {key: blob for key, blob in self.blobs.items() if id(blob) in live}
+        self.recent = OrderedDict((blob, text) for blob, text in self.recent.items() if id(blob) in live)
+
+    def stats(self, bodies):
+        # bodies: the body of every note, duplicates included. Sizes are not kept per
+        # body (that would cost more than it saves), so each distinct body is
+        # decompressed once here.
+        references = Counter(map(id, bodies))
+        content_bytes = plain_memory = stored_bytes = memory = 0
+        for key, blob in self.blobs.items():
+            count = references.get(id(blob))
+            if not count:
+                continue
+            data = self.decompress(blob)
+            content_bytes += len(data) * count
+            # a plain Note holds its own str
+            plain_memory += sys.getsizeof(data.decode("utf-8")) * count
+            stored_bytes += len(blob)
+            memory += sys.getsizeof(blob) + sys.getsizeof(key)
+        dictionary = len(self.dictionary or b"")
+        stored_bytes += dictionary
+        memory += sys.getsizeof(self.blobs) + dictionary
+        notes = sum(references.values())
+        return {
+            "notes": notes,
+            "bodies": len(references),
+            "dedup_ratio": notes / len(references) if references else 1.0,
+            "compressor": self.compressor,
+            "content_bytes": content_bytes,
+            "stored_bytes": stored_bytes,
+            "disk_saved": content_bytes - stored_bytes,
+            "plain_memory": plain_memory,
+            "memory": memory,
+            "memory_saved": plain_memory - memory,
+        }
+
+
+class ContentNote:
+    # Same interface as Note, but the content lives in a ContentStore: the note keeps the
+    # stored body (shared with the notes of the same text) and decompresses it when read.
+    # Instances come from content_note_class(store), which binds the store.
+    __slots__ = ("id", "title", "body", "timestamp")
+    store = None
+
+    def __init__(self, title, content, id=None, timestamp=None):
+        self.id = id if id is not None else str(uuid.uuid4())
+        self.title = title
+        self.body = self.store.put(content)
+        self.timestamp = timestamp if timestamp is not None else datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    @property
+    def content(self):
+        return self.store.get(self.body)
+
+    @content.setter
+    def content(self, text):
+        self.body = self.store.put(text)
+
+    def __str__(self):
+        return f"Title: {self.title}\nContent: {self.content}\nTimestamp: {self.timestamp}"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "title": self.title,
+            "content": self.content,
+            "timestamp": self.timestamp
+        }
+
+
+def content_note_class(store):
+    return type("ContentNote", (ContentNote,), {"__slots__": (), "store": store})
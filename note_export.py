@@ -0,0 +1,72 @@
+import io
+import os
+from itertools import islice
+
+CSV_FIELDS = ["id", "title", "content", "timestamp"]
+# rows formatted in memory before they are handed to the file in one write
+EXPORT_CHUNK_SIZE = 5000
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def note_rows(notes):
+    for note in notes:
+        yield (note.id, note.title, note.content, note.timestamp)
+
+
+def open_csv(filename, compress=False):
+    if compress:
+        import gzip
+        return gzip.open(filename, "wt", newline="", encoding="utf-8", compresslevel=6)
+    return open(filename, "w", newline="", encoding="utf-8", buffering=WRITE_BUFFER_SIZE)
+
+
+def write_csv(rows, filename, compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+    # stream rows to filename, chunk_size rows per write; returns the number of rows
+    import csv
+    chunk = io.StringIO()
+    writer = csv.writer(chunk)
+    writer.writerow(CSV_FIELDS)
+    count = 0
+    with open_csv(filename, compress) as f:
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+            if count % chunk_size == 0:
+                f.write(chunk.getvalue())
+                chunk.seek(0)
+                chunk.truncate()
+        f.write(chunk.getvalue())
+    return count
+
+
+def shard_filename(filename, number):
+    # notes.csv -> notes-000.csv, notes.csv.gz -> notes-000.csv.gz
+    base, ext = os.path.splitext(filename)
+    if ext == ".gz":
+        base, inner = os.path.splitext(base)
+        ext = inner + ext
+    return f"{base}-{number:03d}{ext}"
+
+
+def write_csv_shards(rows, total, filename, shards, compress=False, chunk_size=EXPORT_CHUNK_SIZE, workers=None):
+    # split the rows into `shards` files written by a process pool; only as many
+    # shards as there are workers are held in memory at a time
+    from concurrent.futures import ProcessPoolExecutor
+    shard_size = max(1, -(-total // shards))
+    rows = iter(rows)
+    filenames = []
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        while True:
+            shard = list(islice(rows, shard_size))
+            if not shard:
+                break
+            name = shard_filename(filename, len(filenames))
+            filenames.append(name)
+            pending.append(pool.submit(write_csv, shard, name, compress, chunk_size))
+            if len(pending) >= workers:
+                pending.pop(0).result()
+        for future in pending:
+            future.result()
+    return filenames
@@ -0,0 +1,74 @@
+from collections import Counter
+
+# "$$" in front and "$" behind, so every term of n letters has n + 1 trigrams and
+# short terms get some as well
+PADDING_START = "$$"
+PADDING_END = "$"
+
+
+def trigrams(term):
+    padded = PADDING_START + term + PADDING_END
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_distance(term):
+    # typos allowed in a query term of this length: none in very short terms, where
+    # anything would match, one in ordinary words and two in long ones
+    if len(term) <= 2:
+        return 0
+    return 1 if len(term) <= 5 else 2
+
+
+def bounded_distance(a, b, limit):
+    # Levenshtein distance of a and b, or None once it is certain to exceed limit
+    if abs(len(a) - len(b)) > limit:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+class TrigramIndex:
+    # trigram -> terms containing it, over the vocabulary of an InvertedIndex
+    # (the distinct words, far fewer than the notes)
+    def __init__(self, terms=()):
+        self.terms = {}
+        for term in terms:
+            self.add(term)
+
+    def add(self, term):
+        for gram in trigrams(term):
+            self.terms.setdefault(gram, set()).add(term)
+
+    def discard(self, term):
+        for gram in trigrams(term):
+            terms = self.terms.get(gram)
+            if terms is not None:
+                terms.discard(term)
+                if not terms:
+                    del self.terms[gram]
+
+    def similar(self, term, distance=None):
+        # term -> similarity (1 = same word) for every indexed term within `distance` edits.
+        # An edit changes at most 3 trigrams, so a candidate has to share all but
+        # 3 * distance of them; only terms that do are compared letter by letter.
+        distance = max_distance(term) if distance is None else distance
+        grams = trigrams(term)
+        needed = max(1, len(grams) - 3 * distance)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.terms.get(gram, ()))
+        matches = {}
+        for candidate, count in shared.items():
+            if count < needed:
+                continue
+            edits = bounded_distance(term, candidate, distance)
+            if edits is not None:
+                matches[candidate] = 1 - edits / max(len(term), len(candidate))
+        return matches
@@ -0,0 +1,156 @@
+import datetime
+import json
+import os
+from collections import deque
+from itertools import islice
+
+IMPORT_BATCH_SIZE = 10000
+IMPORT_FORMATS = ("csv", "jsonl")
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def validate_note(title, content, min_chars):
+    # the message to show for an invalid title/content, or None when they are fine
+    if not title or not content:
+        return "Error: Title and content cannot be empty."
+    if len(title) <= min_chars or len(content) <= min_chars:
+        return f"Title and content must be at least {min_chars} characters long."
+    return None
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        # (row number, reason) for every rejected row
+        self.rejected = []
+
+    def summary(self):
+        return f"{self.imported} notes imported, {len(self.rejected)} rejected."
+
+    def write(self, filename):
+        import csv
+        with open(filename, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["row", "reason"])
+            writer.writerows(self.rejected)
+
+
+def detect_format(filename):
+    name = filename[:-3] if filename.endswith(".gz") else filename
+    return "csv" if name.endswith(".csv") else "jsonl"
+
+
+def open_text(filename):
+    # utf-8-sig skips the byte order mark spreadsheet programs put in front of a CSV
+    if filename.endswith(".gz"):
+        import gzip
+        return gzip.open(filename, "rt", newline="", encoding="utf-8-sig")
+    return open(filename, "r", newline="", encoding="utf-8-sig")
+
+
+def read_batches(f, fmt, batch_size):
+    # CSV rows are split by the csv module here (quoted fields may span lines);
+    # JSON lines are passed on raw so that decoding can happen in the workers
+    import csv
+    items = csv.DictReader(f) if fmt == "csv" else f
+    first_row = 1
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield first_row, batch
+        first_row += len(batch)
+
+
+def check_batch(fmt, first_row, items, min_chars):
+    # parse and validate one batch; returns (notes, rejects) with notes as
+    # (row number, title, content, id, timestamp) tuples
+    import uuid
+    notes = []
+    rejects = []
+    for row, item in enumerate(items, first_row):
+        if fmt == "jsonl":
+            if not item.strip():
+                continue
+            try:
+                item = json.loads(item)
+            except json.JSONDecodeError as e:
+                rejects.append((row, f"Invalid JSON: {e}"))
+                continue
+            if not isinstance(item, dict):
+                rejects.append((row, "Expected a JSON object"))
+                continue
+        title = item.get("title") or ""
+        content = item.get("content") or ""
+        if not isinstance(title, str) or not isinstance(content, str):
+            rejects.append((row, "Title and content must be text."))
+            continue
+        title = title.strip()
+        content = content.strip()
+        error = validate_note(title, content, min_chars)
+        note_id = item.get("id") or None
+        timestamp = item.get("timestamp") or None
+        if error is None and note_id is not None:
+            try:
+                note_id = str(uuid.UUID(note_id))
+            except (ValueError, TypeError, AttributeError):
+                error = f"Invalid id: {note_id}"
+        if error is None and timestamp is not None:
+            try:
+                # stored zero-padded: "2024-2-1 0:0:0" parses but would sort as text out of order
+                timestamp = datetime.datetime.strptime(timestamp, TIMESTAMP_FORMAT).strftime(TIMESTAMP_FORMAT)
+            except (ValueError, TypeError):
+                error = f"Invalid timestamp: {timestamp}"
+        if error is not None:
+            rejects.append((row, error))
+        else:
+            notes.append((row, title, content, note_id, timestamp))
+    return notes, rejects
+
+
+def checked_batches(filename, fmt, min_chars, batch_size=IMPORT_BATCH_SIZE, processes=0):
+    # yield (notes, rejects) per batch, in file order; with processes > 0 the
+    # batches are checked in a process pool, a few batches ahead of the caller
+    with open_text(filename) as f:
+        batches = read_batches(f, fmt, batch_size)
+        if not processes:
+            for first_row, items in batches:
+                yield check_batch(fmt, first_row, items, min_chars)
+            return
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            pending = deque()
+            for first_row, items in batches:
+                pending.append(pool.submit(check_batch, fmt, first_row, items, min_chars))
+                if len(pending) > 2 * processes:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+
+def main():
+    import argparse
+    from main import NoteManager
+
+    parser = argparse.ArgumentParser(description="Import notes from a CSV or JSON Lines file.")
+    parser.add_argument("source", help="file to import (.csv, .jsonl, optionally .gz)")
+    parser.add_argument("--notes-file", default="notes.json")
+    parser.add_argument("--format", choices=IMPORT_FORMATS)
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument("--processes", type=int, default=0,
+                        help="check batches in this many worker processes (0 = in this process)")
+    parser.add_argument("--errors", help="write rejected rows to this CSV file")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        parser.error(f"{args.source} does not exist")
+    note_manager = NoteManager(args.notes_file)
+    report = note_manager.import_notes(args.source, args.format, args.batch_size, args.processes)
+    note_manager.save_notes()
+    if args.errors and report.rejected:
+        report.write(args.errors)
+        print(f"Rejected rows written to {args.errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import heapq
+import math
+import re
+from bisect import bisect_left, insort
+
+from note_fuzzy import TrigramIndex
+
+TOKEN_PATTERN = re.compile(r"\w+")
+TITLE_WEIGHT = 2
+
+SEARCH_MODES = ("all", "any", "fuzzy", "substring", "regex")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class InvertedIndex:
+    def __init__(self):
+        # term -> {note_id: weight}, weight = how often the term appears (title counts double)
+        self.postings = {}
+        # note_id -> terms of that note, so a note can be removed without re-tokenizing it
+        self.note_terms = {}
+        # every term in sorted order, used for prefix queries (None = re-sort on next use)
+        self.terms = []
+        # trigrams of the terms for fuzzy queries (None = build on next use)
+        self.trigrams = None
+
+    def __len__(self):
+        return len(self.note_terms)
+
+    def clear(self):
+        self.postings.clear()
+        self.note_terms.clear()
+        self.terms = []
+        self.trigrams = None
+
+    def build(self, notes):
+        self.clear()
+        for note in notes:
+            self.add(note, keep_sorted=False)
+
+    def add(self, note, keep_sorted=True):
+        self.add_text(note.id, note.title, note.content, keep_sorted)
+
+    def add_text(self, note_id, title, content, keep_sorted=True):
+        weights = {}
+        for term in tokenize(title):
+            weights[term] = weights.get(term, 0) + TITLE_WEIGHT
+        for term in tokenize(content):
+            weights[term] = weights.get(term, 0) + 1
+
+        for term, weight in weights.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                # bulk loads sort the vocabulary once, on the next prefix query
+                if not keep_sorted:
+                    self.terms = None
+                elif self.terms is not None:
+                    insort(self.terms, term)
+                if self.trigrams is not None:
+                    self.trigrams.add(term)
+            posting[note_id] = weight
+        self.note_terms[note_id] = tuple(weights)
+
+    def state(self):
+        # the index as plain dicts and tuples (what marshal can store, see note_storage)
+        return self.postings, self.note_terms
+
+    def merge(self, postings, note_terms):
+        # add a saved state() of other notes; its dicts are taken over, not copied
+        for term, posting in postings.items():
+            mine = self.postings.get(term)
+            if mine is None:
+                self.postings[term] = posting
+            else:
+                mine.update(posting)
+        self.note_terms.update(note_terms)
+        self.terms = None
+        self.trigrams = None
+
+    def remove(self, note_id):
+        terms = self.note_terms.pop(note_id, ())
+        for term in terms:
+            posting = self.postings[term]
+            del posting[note_id]
+            if not posting:
+                del self.postings[term]
+                if self.terms is not None:
+                    del self.terms[bisect_left(self.terms, term)]
+                if self.trigrams is not None:
+                    self.trigrams.discard(term)
+
+    def update(self, note):
+        self.remove(note.id)
+        self.add(note)
+
+    def expand(self, term, prefix=False):
+        # exact term, or every indexed term starting with it
+        if not prefix:
+            return [term] if term in self.postings else []
+        if self.terms is None:
+            self.terms = sorted(self.postings)
+        start = bisect_left(self.terms, term)
+        end = start
+        while end < len(self.terms) and self.terms[end].startswith(term):
+            end += 1
+        return self.terms[start:end]
+
+    def match(self, term, prefix=False, total=None, within=None):
+        # note_id -> score for one query term (tf-idf, summed over prefix expansions);
+        # total is the number of notes the idf is based on, this index by default
+        total = total or len(self.note_terms) or 1
+        scores = {}
+        for expanded in self.expand(term, prefix):
+            posting = self.postings[expanded]
+            idf = math.log(1 + total / len(posting))
+            for note_id, weight in posting_items(posting, within):
+                scores[note_id] = scores.get(note_id, 0) + weight * idf
+        return scores
+
+    def fuzzy_match(self, term, within=None):
+        # note_id -> score for one query term, over every indexed term within a few typos
+        # of it (see note_fuzzy), weighted by how similar that term is
+        if self.trigrams is None:
+            self.trigrams = TrigramIndex(self.postings)
+        total = len(self.note_terms) or 1
+        scores = {}
+        for similar, similarity in self.trigrams.similar(term).items():
+            posting = self.postings[similar]
+            idf = math.log(1 + total / len(posting))
+            for note_id, weight in posting_items(posting, within):
+                scores[note_id] = scores.get(note_id, 0) + weight * idf * similarity
+        return scores
+
+    def search(self, query, mode="all", prefix=True, limit=None, within=None):
+        # within: only score these note ids (e.g. the notes of a time range)
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        if mode == "fuzzy":
+            # every word of the query has to match, each within a few typos
+            return rank([self.fuzzy_match(term, within) for term in terms], "all", limit)
+        return rank([self.match(term, prefix, within=within) for term in terms], mode, limit)
+
+
+def posting_items(posting, within=None):
+    # (note_id, weight) of a posting, restricted to the ids in `within` (None = all);
+    # walks whichever of the two is smaller
+    if within is None:
+        return posting.items()
+    if len(within) < len(posting):
+        return [(note_id, posting[note_id]) for note_id in within if note_id in posting]
+    return [(note_id, weight) for note_id, weight in posting.items() if note_id in within]
+
+
+def rank(matches, mode="all", limit=None):
+    # combine the note_id -> score dicts of the query terms (AND for "all", OR for
+    # "any") into note ids, best first
+    if mode == "all":
+        # start from the smallest posting so the intersection stays cheap
+        matches.sort(key=len)
+        candidates = set(matches[0])
+        for scores in matches[1:]:
+            candidates.intersection_update(scores)
+            if not candidates:
+                return []
+    elif mode == "any":
+        candidates = set()
+        for scores in matches:
+            candidates.update(scores)
+    else:
+        raise ValueError(f"Unknown search mode: {mode}")
+
+    ranked = {}
+    for note_id in candidates:
+        ranked[note_id] = sum(scores.get(note_id, 0) for scores in matches)
+    if limit is not None:
+        return heapq.nlargest(limit, ranked, key=ranked.get)
+    return sorted(ranked, key=ranked.get, reverse=True)
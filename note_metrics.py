@@ -0,0 +1,169 @@
+import functools
+import io
+import sys
+import time
+from bisect import bisect_left
+from collections import Counter
+
+# NOTES_METRICS=metrics,profile,memory (or "all") turns the capture modes on for main()
+METRICS_ENV = "NOTES_METRICS"
+CAPTURE_MODES = ("metrics", "profile", "memory")
+PROFILE_FILENAME = "notes.prof"
+# latency histogram buckets: upper bounds from 10 microseconds to ~10 seconds, doubling
+BUCKETS = [1e-5 * 2 ** i for i in range(21)]
+REPORT_LINES = 20
+
+# the active Metrics while instrumentation is on; None keeps every hook a no-op
+metrics = None
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        # upper bound of the bucket holding the given fraction of the calls
+        needed = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= needed and count:
+                return min(self.max, BUCKETS[bucket]) if bucket < len(BUCKETS) else self.max
+        return self.max
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = Counter()
+
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(seconds)
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def report(self):
+        lines = [f"{'operation':<16}{'calls':>8}{'total s':>10}{'mean ms':>10}{'p50 ms':>10}"
+                 f"{'p99 ms':>10}{'max ms':>10}"]
+        for name, h in sorted(self.histograms.items(), key=lambda item: -item[1].total):
+            lines.append(f"{name:<16}{h.count:>8}{h.total:>10.3f}{h.total / h.count * 1000:>10.3f}"
+                         f"{h.percentile(0.5) * 1000:>10.3f}{h.percentile(0.99) * 1000:>10.3f}"
+                         f"{h.max * 1000:>10.3f}")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:<16}{value:>8}")
+        return "\n".join(lines)
+
+
+def count(name, amount=1):
+    # hook for counters (bytes read/written, search hits); free while metrics is None
+    if metrics is not None:
+        metrics.count(name, amount)
+
+
+def timed(function, name):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if metrics is not None:
+                metrics.observe(name, time.perf_counter() - start)
+    wrapper.untimed = function
+    return wrapper
+
+
+def instrument(cls, names):
+    # Wrap the named methods with latency timing. Done only when metrics are switched
+    # on, so an uninstrumented class pays nothing at all.
+    for name in names:
+        function = getattr(cls, name)
+        if not hasattr(function, "untimed"):
+            setattr(cls, name, timed(function, name))
+
+
+def uninstrument(cls, names):
+    for name in names:
+        function = getattr(cls, name)
+        if hasattr(function, "untimed"):
+            setattr(cls, name, function.untimed)
+
+
+def parse_modes(value):
+    modes = {mode.strip().lower() for mode in value.split(",") if mode.strip()}
+    if modes & {"1", "all", "on", "true"}:
+        return set(CAPTURE_MODES)
+    unknown = modes - set(CAPTURE_MODES)
+    if unknown:
+        raise ValueError(f"Unknown {METRICS_ENV} mode: {', '.join(sorted(unknown))}")
+    return modes
+
+
+class Capture:
+    # one run of main() with the chosen modes: "metrics" collects latencies and
+    # counters, "profile" runs cProfile, "memory" traces allocations
+    def __init__(self, modes, cls=None, methods=()):
+        self.modes = set(modes)
+        self.cls = cls
+        self.methods = methods
+        self.profiler = None
+
+    def start(self):
+        global metrics
+        import cProfile
+        import tracemalloc
+        if "metrics" in self.modes:
+            metrics = Metrics()
+            if self.cls is not None:
+                instrument(self.cls, self.methods)
+        if "memory" in self.modes:
+            tracemalloc.start(10)
+        if "profile" in self.modes:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+
+    def stop(self, out=None):
+        global metrics
+        import cProfile
+        import pstats
+        import tracemalloc
+        out = out or sys.stderr
+        if "memory" in self.modes and tracemalloc.is_tracing():
+            # the profiler's own bookkeeping is not the application's memory
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, module.__file__) for module in (cProfile, pstats, tracemalloc)])
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"\n--- Memory: {current / 1e6:.1f} MB in use, peak {peak / 1e6:.1f} MB ---", file=out)
+            for stat in snapshot.statistics("lineno")[:REPORT_LINES]:
+                print(stat, file=out)
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(PROFILE_FILENAME)
+            text = io.StringIO()
+            pstats.Stats(self.profiler, stream=text).sort_stats("cumulative").print_stats(REPORT_LINES)
+            print(f"\n--- Profile (full data in {PROFILE_FILENAME}) ---", file=out)
+            print(text.getvalue().strip(), file=out)
+            self.profiler = None
+        if metrics is not None:
+            print("\n--- Metrics ---", file=out)
+            print(metrics.report(), file=out)
+            metrics = None
+            if self.cls is not None:
+                uninstrument(self.cls, self.methods)
@@ -0,0 +1,479 @@
+import math
+import mmap
+import os
+import re
+import sys
+from array import array
+from bisect import bisect_right
+from collections.abc import MutableMapping, ValuesView
+
+from note_codec import (BINARY_MAGIC, BINARY_VERSION, HEADER, OFFSET_SIZE, ROW_FIELDS, CodecError, load_rows,
+                        row_from_dict)
+from note_fuzzy import TrigramIndex
+from note_index import TITLE_WEIGHT, InvertedIndex, rank, tokenize
+from note_sort import SortedOrder
+from note_storage import JournalStorage
+
+TITLE, CONTENT, ID, TIMESTAMP = (ROW_FIELDS.index(field) for field in ("title", "content", "id", "timestamp"))
+# every cased character is below this code point
+CASED_LIMIT = 0x20000
+# char -> the other characters whose lower() gives it (built on first use)
+CASE_VARIANTS = None
+
+
+def case_variants():
+    # İ lowers to "i" plus a combining dot, which tokenize drops: it counts as an "i"
+    global CASE_VARIANTS
+    if CASE_VARIANTS is None:
+        variants = {}
+        for code in range(CASED_LIMIT):
+            char = chr(code)
+            lower = char.lower()
+            if lower != char:
+                variants.setdefault(lower[0], []).append(char)
+        CASE_VARIANTS = variants
+    return CASE_VARIANTS
+
+
+def term_pattern(term):
+    # bytes pattern for the term in any case that lowers to it; a match is only a
+    # candidate, checked against the decoded value (see MmapIndex.match)
+    variants = case_variants()
+    parts = []
+    for char in term:
+        choices = [char] + variants.get(char, [])
+        escaped = [re.escape(choice.encode("utf-8")) for choice in choices]
+        parts.append(escaped[0] if len(escaped) == 1 else b"(?:" + b"|".join(escaped) + b")")
+    return re.compile(b"".join(parts))
+
+
+def file_identity(stat):
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class MappedSnapshot:
+    # A binary snapshot (see note_codec.BinaryCodec) opened with mmap. Nothing is read
+    # up front: the offset tables are memoryview casts into the mapping and a value is
+    # decoded straight from its slice when it is asked for. Processes mapping the same
+    # file share its pages through the page cache.
+    def __init__(self, f):
+        self.filename = f.name
+        self.identity = file_identity(os.fstat(f.fileno()))
+        self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+        if len(self.view) < HEADER.size:
+            self.close()
+            raise CodecError("Truncated binary notes file")
+        magic, version, fields, self.count = HEADER.unpack_from(self.view)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION or fields != len(ROW_FIELDS):
+            self.close()
+            raise CodecError("Not a binary notes file")
+        # per field: end offset of every value (relative to the blob), blob start and end
+        self.ends = []
+        self.blobs = []
+        pos = HEADER.size
+        for _ in range(fields):
+            table = self.view[pos:pos + self.count * OFFSET_SIZE]
+            if sys.byteorder == "little":
+                ends = table.cast("Q")
+            else:
+                ends = array("Q", table.tobytes())
+                ends.byteswap()
+            pos += self.count * OFFSET_SIZE
+            size = ends[-1] if self.count else 0
+            if len(table) != self.count * OFFSET_SIZE or pos + size > len(self.view):
+                table.release()
+                self.close()
+                raise CodecError("Truncated binary notes file")
+            self.ends.append(ends)
+            self.blobs.append((pos, pos + size))
+            pos += size
+
+    def is_current(self):
+        # whether self.filename still names the mapped file (compaction replaces it)
+        try:
+            return self.filename is not None and file_identity(os.stat(self.filename)) == self.identity
+        except FileNotFoundError:
+            return False
+
+    @classmethod
+    def empty(cls):
+        snapshot = cls.__new__(cls)
+        snapshot.filename = snapshot.mm = snapshot.view = None
+        snapshot.count = 0
+        snapshot.ends = [[] for _ in ROW_FIELDS]
+        snapshot.blobs = [(0, 0) for _ in ROW_FIELDS]
+        return snapshot
+
+    def value(self, field, position):
+        ends = self.ends[field]
+        start = self.blobs[field][0]
+        end = start + ends[position]
+        if position:
+            start += ends[position - 1]
+        return str(self.view[start:end], "utf-8")
+
+    def row(self, position):
+        return tuple(self.value(field, position) for field in range(len(ROW_FIELDS)))
+
+    def values(self, field):
+        return (self.value(field, position) for position in range(self.count))
+
+    def find_values(self, pattern, field):
+        # (position, value) of every note whose value of `field` contains a match of
+        # pattern. Values are stored back to back: a match running into the next value
+        # is checked by the caller like any other, and the scan goes on from the end of
+        # each value found.
+        start, end = self.blobs[field]
+        if self.mm is None or start == end:
+            return
+        ends = self.ends[field]
+        base = start
+        position = 0
+        while True:
+            m = pattern.search(self.mm, start, end)
+            if m is None:
+                return
+            # matches come in order, so the search for the note can start at the last one
+            position = bisect_right(ends, m.start() - base, position)
+            yield position, self.value(field, position)
+            start = base + ends[position]
+
+    def close(self):
+        if self.mm is None:
+            return
+        for ends in getattr(self, "ends", ()):
+            if isinstance(ends, memoryview):
+                ends.release()
+        self.view.release()
+        self.mm.close()
+        self.mm = self.view = None
+
+
+class MmapStorage(JournalStorage):
+    # Read-optimized storage: the snapshot is a binary file that is mapped, not
+    # loaded, so opening a store is instant however many notes it holds and views
+    # and searches decode only the notes they touch. Changes go to the journal as
+    # usual and are kept in a small in-memory overlay until compaction writes a new
+    # snapshot and maps that instead.
+    in_memory = False
+
+    def __init__(self, filename, **options):
+        options["codec"] = "binary"
+        super().__init__(filename, **options)
+        self.store = None
+
+    def open_notes(self, note_class):
+        try:
+            f, changes = self.open_snapshot()
+        except FileNotFoundError:
+            f, changes = None, {}
+        overlay = {}
+        if f is None:
+            snapshot = MappedSnapshot.empty()
+        else:
+            with f:
+                try:
+                    snapshot = MappedSnapshot(f)
+                except (CodecError, ValueError):
+                    # not a binary snapshot (or an empty file): everything goes in the
+                    # overlay and the next compaction writes the binary layout
+                    snapshot = MappedSnapshot.empty()
+                    f.seek(0)
+                    for row in load_rows(f):
+                        overlay[row[ID]] = note_class(*row)
+        for note_id, d in changes.items():
+            overlay[note_id] = None if d is None else note_class(*row_from_dict(d))
+        return self.new_store(snapshot, note_class, overlay)
+
+    def empty_notes(self, note_class):
+        return self.new_store(MappedSnapshot.empty(), note_class)
+
+    def new_store(self, snapshot, note_class, overlay=None):
+        if self.store is not None:
+            self.store.snapshot.close()
+        self.store = MmapNoteStore(snapshot, note_class, overlay)
+        return self.store
+
+    def new_index(self):
+        return MmapIndex(self)
+
+    def sorted_order(self, sort, notes):
+        # from the mapped id, title and timestamp columns: the contents stay undecoded
+        return SortedOrder(sort, notes.sort_fields())
+
+    def note_order(self, notes):
+        # a live view while no mapped note is deleted, a plain list of ids otherwise
+        if any(note is None for note in notes.overlay.values()):
+            return list(notes)
+        return MmapNoteOrder(notes)
+
+    def compact(self, notes):
+        if not super().compact(notes):
+            return False
+        with open(self.filename, "rb") as f:
+            notes.reset(MappedSnapshot(f))
+        return True
+
+    def close(self):
+        super().close()
+        if self.store is not None:
+            self.store.snapshot.close()
+
+
+class MmapNoteStore(MutableMapping):
+    # note id -> note: the mapped snapshot plus an overlay of the notes added, edited
+    # (id -> note) or deleted (id -> None) since it was written
+    def __init__(self, snapshot, note_class, overlay=None):
+        self.note_class = note_class
+        self.reset(snapshot, overlay)
+
+    def reset(self, snapshot, overlay=None):
+        if getattr(self, "snapshot", None) is not None and self.snapshot is not snapshot:
+            self.snapshot.close()
+        self.snapshot = snapshot
+        self.overlay = overlay or {}
+        # id -> position in the snapshot, filled in as ids are decoded; complete once
+        # an id had to be looked up that was not decoded yet
+        self.positions = {}
+        self.complete = snapshot.count == 0
+        self.count = None
+        self.overlay_index = InvertedIndex()
+        for note in self.overlay.values():
+            if note is not None:
+                self.overlay_index.add(note, keep_sorted=False)
+
+    def note_id(self, position):
+        note_id = self.snapshot.value(ID, position)
+        self.positions[note_id] = position
+        return note_id
+
+    def position(self, note_id):
+        position = self.positions.get(note_id)
+        if position is None and not self.complete:
+            for position in range(self.snapshot.count):
+                self.note_id(position)
+            self.complete = True
+            position = self.positions.get(note_id)
+        return position
+
+    def mapped_note(self, position):
+        return self.note_class(*self.snapshot.row(position))
+
+    def __len__(self):
+        if self.count is None:
+            count = self.snapshot.count
+            for note_id, note in self.overlay.items():
+                mapped = self.position(note_id) is not None
+                if note is None and mapped:
+                    count -= 1
+                elif note is not None and not mapped:
+                    count += 1
+            self.count = count
+        return self.count
+
+    def __contains__(self, note_id):
+        if note_id in self.overlay:
+            return self.overlay[note_id] is not None
+        return self.position(note_id) is not None
+
+    def __getitem__(self, note_id):
+        if note_id in self.overlay:
+            note = self.overlay[note_id]
+        else:
+            position = self.position(note_id)
+            note = None if position is None else self.mapped_note(position)
+        if note is None:
+            raise KeyError(note_id)
+        return note
+
+    def __setitem__(self, note_id, note):
+        self.overlay[note_id] = note
+        self.count = None
+
+    def __delitem__(self, note_id):
+        if note_id not in self:
+            raise KeyError(note_id)
+        if self.position(note_id) is not None:
+            self.overlay[note_id] = None
+        else:
+            del self.overlay[note_id]
+        self.count = None
+
+    def __iter__(self):
+        for position in range(self.snapshot.count):
+            note_id = self.note_id(position)
+            if self.overlay.get(note_id, True) is not None:
+                yield note_id
+        for note_id in self.added():
+            yield note_id
+
+    def added(self):
+        # ids of the overlay notes that are not in the snapshot, in insertion order
+        return [note_id for note_id, note in self.overlay.items()
+                if note is not None and self.position(note_id) is None]
+
+    def values(self):
+        return MmapNoteValues(self)
+
+    def sort_fields(self):
+        # what a SortedOrder reads of every note: overlay notes as they are, mapped ones
+        # as their id, title and timestamp
+        snapshot = self.snapshot
+        for position in range(snapshot.count):
+            note_id = self.note_id(position)
+            if note_id not in self.overlay:
+                yield SortFields(note_id, snapshot.value(TITLE, position), snapshot.value(TIMESTAMP, position))
+        for note in self.overlay.values():
+            if note is not None:
+                yield note
+
+    def iter_rows(self):
+        for note_id in self:
+            yield self[note_id]
+
+
+class SortFields:
+    __slots__ = ("id", "title", "timestamp")
+
+    def __init__(self, id, title, timestamp):
+        self.id = id
+        self.title = title
+        self.timestamp = timestamp
+
+
+class MmapNoteValues(ValuesView):
+    def __iter__(self):
+        return self._mapping.iter_rows()
+
+
+class MmapNoteOrder:
+    # menu numbers without decoding every id: position i < snapshot.count is the i-th
+    # mapped note (valid as long as none of them is deleted), then the added notes
+    def __init__(self, notes):
+        self.notes = notes
+
+    def __len__(self):
+        return len(self.notes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        count = self.notes.snapshot.count
+        if index < 0:
+            index += len(self)
+        if 0 <= index < count:
+            return self.notes.note_id(index)
+        added = self.notes.added()
+        if 0 <= index - count < len(added):
+            return added[index - count]
+        raise IndexError("note index out of range")
+
+    # new notes show up through the overlay by themselves
+    def append(self, note_id):
+        pass
+
+    def extend(self, note_ids):
+        pass
+
+
+class MmapIndex:
+    # Same interface as InvertedIndex. The mapped notes are searched in place with a
+    # bytes regex per term over the title and content blobs; only the notes that
+    # match are decoded. The overlay notes have a small InvertedIndex of their own,
+    # kept by the store.
+    def __init__(self, storage):
+        self.storage = storage
+        # trigrams of every word in the notes, for fuzzy queries (None = read on next use)
+        self.trigrams = None
+        # the snapshot they were read from
+        self.trigrams_snapshot = None
+
+    @property
+    def overlay(self):
+        return self.storage.store.overlay_index
+
+    def build(self, notes):
+        self.trigrams = None
+
+    def add(self, note, keep_sorted=True):
+        self.overlay.add(note, keep_sorted)
+        if self.trigrams is not None:
+            for term in tokenize(note.title) + tokenize(note.content):
+                self.trigrams.add(term)
+
+    def update(self, note):
+        # the words the edit removed stay in the vocabulary; they just match nothing
+        self.overlay.remove(note.id)
+        self.add(note)
+
+    def remove(self, note_id):
+        self.overlay.remove(note_id)
+
+    def match(self, term, prefix, total, shadowed):
+        # key -> tf-idf score of the term; keys are snapshot positions for mapped notes
+        # (ids are decoded only for the final results) and ids for overlay notes. The
+        # notes the bytes scan finds are checked on their lowered text with the \w rule
+        # of tokenize, so words, case and weights (per prefix expansion) come out the same.
+        snapshot = self.storage.store.snapshot
+        pattern = term_pattern(term)
+        # the tokens of the lowered value that are (or start with) the term; the check
+        # for a word character before it comes after the literal, which keeps the scan fast
+        tokens = re.compile(r"(?s)" + re.escape(term) + r"(?<!\w.{%d})" % len(term)
+                            + (r"\w*" if prefix else r"(?!\w)"))
+        # expanded term -> {key: weight}
+        postings = {}
+        for field, weight in ((TITLE, TITLE_WEIGHT), (CONTENT, 1)):
+            for position, value in snapshot.find_values(pattern, field):
+                # edited and deleted notes are answered by the overlay
+                if position in shadowed:
+                    continue
+                for token in tokens.findall(value.lower()):
+                    posting = postings.setdefault(token, {})
+                    posting[position] = posting.get(position, 0) + weight
+        overlay = self.overlay
+        for expanded in overlay.expand(term, prefix):
+            postings.setdefault(expanded, {}).update(overlay.postings[expanded])
+        scores = {}
+        for posting in postings.values():
+            idf = math.log(1 + total / len(posting))
+            for key, weight in posting.items():
+                scores[key] = scores.get(key, 0) + weight * idf
+        return scores
+
+    def vocabulary(self):
+        # every word of the mapped notes is decoded once per snapshot; the overlay's
+        # words come from its index and from add
+        snapshot = self.storage.store.snapshot
+        if self.trigrams is None or self.trigrams_snapshot is not snapshot:
+            terms = set(self.overlay.postings)
+            for field in (TITLE, CONTENT):
+                for value in snapshot.values(field):
+                    terms.update(tokenize(value))
+            self.trigrams = TrigramIndex(terms)
+            self.trigrams_snapshot = snapshot
+        return self.trigrams
+
+    def fuzzy_match(self, term, total, shadowed):
+        # key -> score over every word within a few typos of term, weighted by how
+        # similar it is (as InvertedIndex.fuzzy_match)
+        scores = {}
+        for similar, similarity in self.vocabulary().similar(term).items():
+            for key, score in self.match(similar, False, total, shadowed).items():
+                scores[key] = scores.get(key, 0) + score * similarity
+        return scores
+
+    def search(self, query, mode="all", prefix=True, limit=None):
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        if mode not in ("all", "any", "fuzzy"):
+            raise ValueError(f"Search mode {mode} is not supported by this storage")
+        notes = self.storage.store
+        total = len(notes) or 1
+        shadowed = {notes.position(note_id) for note_id in notes.overlay} - {None}
+        if mode == "fuzzy":
+            keys = rank([self.fuzzy_match(term, total, shadowed) for term in terms], "all", limit)
+        else:
+            keys = rank([self.match(term, prefix, total, shadowed) for term in terms], mode, limit)
+        return [notes.note_id(key) if isinstance(key, int) else key for key in keys]
@@ -0,0 +1,154 @@
+import heapq
+import os
+import re
+
+from note_index import TITLE_WEIGHT
+
+# below this many notes a scan stays in this process: starting a pool costs more
+PARALLEL_THRESHOLD = 50000
+
+# the mapped snapshot a worker opened last (see scan_mapped)
+_snapshot = None
+
+
+def compile_matcher(term, mode):
+    # text -> number of hits, case-insensitive in both modes
+    if mode == "regex":
+        pattern = re.compile(term, re.IGNORECASE)
+        return lambda text: len(pattern.findall(text))
+    if mode == "substring":
+        lower_term = term.lower()
+        return lambda text: text.lower().count(lower_term) if lower_term else 1
+    raise ValueError(f"Unknown scan mode: {mode}")
+
+
+def scan_texts(texts, term, mode, limit=None):
+    # [(score, i)] for the (i, title, content) texts that match, i being anything that
+    # sorts in note order; titles count double.
+    # With a limit the scan stops at the first `limit` matches.
+    matcher = compile_matcher(term, mode)
+    hits = []
+    for i, title, content in texts:
+        score = matcher(title) * TITLE_WEIGHT + matcher(content)
+        if score:
+            hits.append((score, i))
+            if limit is not None and len(hits) >= limit:
+                break
+    return hits
+
+
+def scan_columns(start, titles, contents, term, mode, limit=None):
+    # scan_texts over a shard of the columns, numbered from start
+    return scan_texts(zip(range(start, start + len(titles)), titles, contents), term, mode, limit)
+
+
+def scan_snapshot(snapshot, start, end, term, mode, limit=None, skip=()):
+    # scan_texts over notes start..end of a mapped snapshot (but the positions in
+    # skip), decoding one note at a time
+    from note_mmap import CONTENT, TITLE
+    texts = ((i, snapshot.value(TITLE, i), snapshot.value(CONTENT, i)) for i in range(start, end) if i not in skip)
+    return scan_texts(texts, term, mode, limit)
+
+
+def scan_mapped(filename, start, end, term, mode, limit, skip):
+    # in a worker: the snapshot stays mapped between queries until a compaction
+    # replaces the file
+    global _snapshot
+    if _snapshot is None or _snapshot.filename != filename or not _snapshot.is_current():
+        from note_mmap import MappedSnapshot
+        if _snapshot is not None:
+            _snapshot.close()
+        with open(filename, "rb") as f:
+            _snapshot = MappedSnapshot(f)
+    return scan_snapshot(_snapshot, start, end, term, mode, limit, skip)
+
+
+def merge(shards, limit=None):
+    # best score first, ties in note order; with a limit, of the first `limit` matches
+    # in note order, whichever shards they were found in
+    hits = [hit for shard in shards for hit in shard]
+    if limit is not None:
+        hits = heapq.nsmallest(limit, hits, key=lambda hit: hit[1])
+    return sorted(hits, key=lambda hit: (-hit[0], hit[1]))
+
+
+def shards(count, processes):
+    # range(count) split into one (start, end) per process
+    size = -(-count // processes)
+    return [(start, min(count, start + size)) for start in range(0, count, size)]
+
+
+class ScanPool:
+    # The worker processes of a session, started on the first parallel scan and kept
+    # until shutdown. They come from the forkserver (spawn where there is none): the
+    # manager has an autosave thread and may run in an executor, and forking a process
+    # with threads can leave a lock held forever in the child.
+    def __init__(self):
+        self.executor = None
+        self.processes = None
+
+    def run(self, processes, tasks):
+        # results of the (function, args) tasks, in order
+        if self.executor is None or self.processes != processes:
+            self.shutdown()
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self.executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context(method))
+            self.processes = processes
+        futures = [self.executor.submit(function, *args) for function, args in tasks]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+def scan_notes(notes, term, mode="substring", limit=None, processes=None, threshold=PARALLEL_THRESHOLD,
+               in_memory=True, pool=None):
+    # Ids of the notes matching term, best first; with a limit, the best of the first
+    # `limit` matches in note order. Large stores are split across the processes of
+    # pool (a ScanPool kept by the caller, or one for this scan): in-memory notes are
+    # sent to the workers a shard each, a mapped store is opened by every worker.
+    # A store that is not in memory is scanned here one note at a time.
+    compile_matcher(term, mode)  # report a bad pattern before any pool is started
+    processes = processes or os.cpu_count() or 1
+    parallel = processes > 1 and len(notes) >= threshold
+    if parallel and pool is None:
+        with ScanPool() as pool:
+            return scan_notes(notes, term, mode, limit, processes, threshold, in_memory, pool)
+    snapshot = getattr(notes, "snapshot", None)
+
+    if snapshot is not None:
+        # the mapped notes, minus the ones the overlay replaces, then the overlay notes
+        # (numbered after the mapped ones)
+        count = snapshot.count
+        shadowed = {notes.position(note_id) for note_id in notes.overlay} - {None}
+        # workers open the file by name, which must still be the snapshot we mapped
+        if parallel and count and snapshot.is_current():
+            hits = pool.run(processes, [(scan_mapped, (snapshot.filename, start, end, term, mode, limit, shadowed))
+                                        for start, end in shards(count, processes)])
+        else:
+            hits = [scan_snapshot(snapshot, 0, count, term, mode, limit, shadowed)]
+        added = [note for note in notes.overlay.values() if note is not None]
+        hits.append(scan_texts(((count + i, note.title, note.content) for i, note in enumerate(added)),
+                               term, mode, limit))
+        return [notes.note_id(i) if i < count else added[i - count].id for _, i in merge(hits, limit)]
+
+    if parallel and in_memory:
+        values = list(notes.values())
+        titles = [note.title for note in values]
+        contents = [note.content for note in values]
+        hits = pool.run(processes, [(scan_columns, (start, titles[start:end], contents[start:end], term, mode, limit))
+                                    for start, end in shards(len(values), processes)])
+        return [values[i].id for _, i in merge(hits, limit)]
+    # the position keeps the note order, the id comes along for the matches
+    texts = (((i, note.id), note.title, note.content) for i, note in enumerate(notes.values()))
+    return [note_id for _, (i, note_id) in merge([scan_texts(texts, term, mode, limit)], limit)]
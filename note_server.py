@@ -0,0 +1,358 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import socket
+
+from main import MIN_CHA_NUMBER, PAGE_SIZE
+from note_async import AsyncNoteManager
+from note_autosave import AUTOSAVE_DELAY
+from note_import import validate_note
+from note_sort import check_sort
+
+SOCKET_NAME = "notes.sock"
+# one request line (a batch included) may be at most this long
+MAX_REQUEST_SIZE = 16 << 20
+READ_SIZE = 1 << 16
+# pipelined requests a client sends before reading their replies
+PIPELINE_WINDOW = 256
+
+
+class NoteServerError(Exception):
+    pass
+
+
+# Protocol: JSON lines over one persistent connection. A request is
+#   {"id": 1, "op": "add", "args": {"title": ..., "content": ...}}
+# and its reply {"id": 1, "ok": true, "result": ...} or {"id": 1, "ok": false, "error": "..."}.
+# A line holding a list of requests is a batch: it runs as one call on the manager's
+# thread and is answered by one line holding the list of replies. Requests may be
+# pipelined (sent without waiting); the replies of a connection come back in order.
+
+def note_dict(note):
+    return None if note is None else note.to_dict()
+
+
+def checked(title, content):
+    error = validate_note(title, content, MIN_CHA_NUMBER)
+    if error:
+        raise ValueError(error)
+
+
+def op_add(manager, title, content):
+    checked(title, content)
+    return note_dict(manager.add_note(title, content))
+
+
+def op_get(manager, id):
+    return note_dict(manager.notes.get(id))
+
+
+def op_edit(manager, id, title, content):
+    checked(title, content)
+    if not manager.update_note(id, title, content):
+        raise KeyError(f"No note with id {id}")
+    return note_dict(manager.notes.get(id))
+
+
+def op_delete(manager, ids):
+    # how many of the ids were deleted
+    return manager.remove_notes([ids] if isinstance(ids, str) else ids)
+
+
+def op_search(manager, term, mode="all", prefix=True, limit=None, since=None, until=None):
+    return [note.to_dict() for note in manager.find_notes(term, mode, prefix, limit, since, until)]
+
+
+def op_list(manager, cursor=0, page_size=PAGE_SIZE, sort=None):
+    # the sort applies to this request only: other clients keep their own
+    if sort is None:
+        notes, next_cursor = manager.list_notes(cursor, page_size)
+    else:
+        order = manager.sorted_order(check_sort(sort))
+        notes = [manager.notes[note_id] for note_id in order[cursor:cursor + page_size]]
+        next_cursor = cursor + page_size if cursor + page_size < len(order) else None
+    return {"notes": [note.to_dict() for note in notes], "next": next_cursor}
+
+
+def op_recent(manager, count=PAGE_SIZE, since=None, until=None):
+    return [note.to_dict() for note in manager.notes_between(since, until, count)]
+
+
+def op_export(manager, export_dir, filename="notes.csv", compress=False, shards=1):
+    # clients only name the file: it is written to the server's export directory
+    if not isinstance(filename, str) or not filename or os.path.basename(filename) != filename \
+            or filename.startswith("."):
+        raise ValueError("The export filename must be a plain file name")
+    return manager.convert_to_csv(os.path.join(export_dir, filename), compress, shards)
+
+
+def op_save(manager):
+    manager.save_notes()
+    return True
+
+
+def op_stats(manager):
+    manager.read_notes()
+    return {"notes": len(manager.notes), "unsaved": manager.storage.unsaved(),
+            "search_cache": manager.search_cache.stats()}
+
+
+OPERATIONS = {
+    "add": op_add,
+    "get": op_get,
+    "edit": op_edit,
+    "delete": op_delete,
+    "search": op_search,
+    "list": op_list,
+    "recent": op_recent,
+    "export": op_export,
+    "save": op_save,
+    "stats": op_stats,
+}
+
+
+def run_request(manager, request, export_dir):
+    # one request -> its reply; a failing request does not stop the rest of a batch
+    request_id = request.get("id") if isinstance(request, dict) else None
+    try:
+        if not isinstance(request, dict):
+            raise ValueError("A request must be a JSON object")
+        operation = OPERATIONS.get(request.get("op"))
+        if operation is None:
+            raise ValueError(f"Unknown operation: {request.get('op')}")
+        args = request.get("args", {})
+        if not isinstance(args, dict):
+            raise ValueError("The args of a request must be a JSON object")
+        if operation is op_export:
+            result = operation(manager, export_dir, **args)
+        else:
+            result = operation(manager, **args)
+    except (ValueError, KeyError, TypeError, re.error) as e:
+        return {"id": request_id, "ok": False, "error": str(e.args[0]) if e.args else type(e).__name__}
+    except Exception as e:
+        # e.g. an argument of the wrong type deep in the manager: reported like the rest,
+        # since dropping the connection would lose the replies of the whole batch
+        return {"id": request_id, "ok": False, "error": f"{type(e).__name__}: {e}"}
+    return {"id": request_id, "ok": True, "result": result}
+
+
+def run_line(manager, line, export_dir):
+    try:
+        requests = json.loads(line)
+    except ValueError as e:
+        return {"id": None, "ok": False, "error": f"Invalid JSON: {e}"}
+    if isinstance(requests, list):
+        return [run_request(manager, request, export_dir) for request in requests]
+    return run_request(manager, requests, export_dir)
+
+
+def run_lines(manager, lines, export_dir):
+    # the reply lines for every request line that arrived together
+    return b"".join(json.dumps(run_line(manager, line, export_dir)).encode("utf-8") + b"\n"
+                    for line in lines if line.strip())
+
+
+class NoteServer:
+    # Keeps one NoteManager loaded for as long as it runs and serves it on a Unix socket
+    # (or localhost TCP port). The request lines read together (a batch, or pipelined
+    # requests) take one hop to the manager's thread (see AsyncNoteManager), so they cost
+    # little more than one; changes are autosaved in the background and on stop().
+    # Exports are written to export_dir, under a plain file name chosen by the client.
+    def __init__(self, notes, path=None, port=None, export_dir="."):
+        self.notes = notes
+        self.path = path
+        self.port = port
+        self.export_dir = export_dir
+        self.server = None
+        self.stopping = False
+        self.stopped = asyncio.Event()
+
+    @classmethod
+    async def open(cls, filename="notes.json", path=SOCKET_NAME, port=None, export_dir=".", **options):
+        options.setdefault("autosave", AUTOSAVE_DELAY)
+        notes = await AsyncNoteManager.open(filename, **options)
+        return cls(notes, None if port is not None else path, port, export_dir)
+
+    async def start(self):
+        if self.port is not None:
+            self.server = await asyncio.start_server(self.serve, "127.0.0.1", self.port)
+            self.port = self.server.sockets[0].getsockname()[1]
+        else:
+            if os.path.exists(self.path):
+                # left behind by a server that did not stop cleanly
+                os.remove(self.path)
+            self.server = await asyncio.start_unix_server(self.serve, self.path)
+        return self
+
+    async def serve(self, reader, writer):
+        sock = writer.get_extra_info("socket")
+        if sock is not None and sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # pipelined request lines that arrive in one read are run in one hop as well
+        buffer = bytearray()
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                buffer += data
+                end = buffer.rfind(b"\n")
+                if end < 0:
+                    if len(buffer) > MAX_REQUEST_SIZE:
+                        writer.write(b'{"id": null, "ok": false, "error": "Request too long"}\n')
+                        break
+                    continue
+                lines = bytes(buffer[:end]).split(b"\n")
+                del buffer[:end + 1]
+                replies = await self.notes.call(run_lines, self.notes.manager, lines, self.export_dir)
+                if replies:
+                    writer.write(replies)
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def wait(self):
+        await self.stopped.wait()
+
+    async def stop(self):
+        if self.stopping:
+            return
+        self.stopping = True
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+            if self.path is not None and os.path.exists(self.path):
+                os.remove(self.path)
+        await self.notes.close()
+        self.stopped.set()
+
+
+class NoteClient:
+    # Blocking client for NoteServer; one connection, reused for every call.
+    #   client = NoteClient("notes.sock")      # or NoteClient(port=8765)
+    #   note = client.add("title", "content")
+    #   client.batch([("add", {...}), ("search", {"term": "idea"})])
+    def __init__(self, path=SOCKET_NAME, port=None, timeout=None):
+        if port is not None:
+            self.sock = socket.create_connection(("127.0.0.1", port), timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(path)
+        self.replies = self.sock.makefile("rb")
+        self.next_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, op, args):
+        self.next_id += 1
+        return {"id": self.next_id, "op": op, "args": args}
+
+    def send(self, payload):
+        self.sock.sendall(json.dumps(payload).encode("utf-8") + b"\n")
+
+    def receive(self):
+        line = self.replies.readline()
+        if not line:
+            raise ConnectionError("The note server closed the connection")
+        return json.loads(line)
+
+    def call(self, op, **args):
+        self.send(self.request(op, args))
+        return result(self.receive())
+
+    def batch(self, calls):
+        # [(op, args), ...] in one round trip; a failed call's entry is its NoteServerError
+        self.send([self.request(op, args) for op, args in calls])
+        return [result(reply, raise_error=False) for reply in self.receive()]
+
+    def pipeline(self, calls):
+        # like batch, but as separate requests sent ahead of their replies, a window at a
+        # time (with nobody reading the replies, both sides could block on full buffers)
+        calls = list(calls)
+        results = []
+        for start in range(0, len(calls), PIPELINE_WINDOW):
+            window = calls[start:start + PIPELINE_WINDOW]
+            self.sock.sendall(b"".join(json.dumps(self.request(op, args)).encode("utf-8") + b"\n"
+                                       for op, args in window))
+            results += [result(self.receive(), raise_error=False) for _ in window]
+        return results
+
+    def add(self, title, content):
+        return self.call("add", title=title, content=content)
+
+    def get(self, note_id):
+        return self.call("get", id=note_id)
+
+    def edit(self, note_id, title, content):
+        return self.call("edit", id=note_id, title=title, content=content)
+
+    def delete(self, *note_ids):
+        return self.call("delete", ids=list(note_ids))
+
+    def search(self, term, mode="all", prefix=True, limit=None, since=None, until=None):
+        return self.call("search", term=term, mode=mode, prefix=prefix, limit=limit, since=since, until=until)
+
+    def list(self, cursor=0, page_size=PAGE_SIZE, sort=None):
+        return self.call("list", cursor=cursor, page_size=page_size, sort=sort)
+
+    def recent(self, count=PAGE_SIZE, since=None, until=None):
+        return self.call("recent", count=count, since=since, until=until)
+
+    def export(self, filename="notes.csv", compress=False, shards=1):
+        return self.call("export", filename=filename, compress=compress, shards=shards)
+
+    def save(self):
+        return self.call("save")
+
+    def stats(self):
+        return self.call("stats")
+
+    def close(self):
+        self.replies.close()
+        self.sock.close()
+
+
+def result(reply, raise_error=True):
+    if reply.get("ok"):
+        return reply.get("result")
+    error = NoteServerError(reply.get("error"))
+    if raise_error:
+        raise error
+    return error
+
+
+async def serve_forever(args):
+    server = await NoteServer.open(args.file, args.socket, args.port, args.export_dir)
+    await server.start()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, lambda: asyncio.ensure_future(server.stop()))
+    where = f"127.0.0.1:{server.port}" if server.port is not None else server.path
+    print(f"Serving {args.file} on {where} (Ctrl+C to stop)")
+    await server.wait()
+    print("Notes saved. Goodbye!")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the notes to local clients (see NoteClient).")
+    parser.add_argument("--file", default="notes.json", help="note store to serve")
+    parser.add_argument("--socket", default=SOCKET_NAME, help="Unix socket path")
+    parser.add_argument("--port", type=int, help="listen on this localhost TCP port instead of a socket")
+    parser.add_argument("--export-dir", default=".", help="directory the export operation writes to")
+    asyncio.run(serve_forever(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import hashlib
+import json
+import os
+import zlib
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+
+from note_codec import ID_FIELD, CodecError, row_from_note
+from note_index import InvertedIndex
+from note_storage import JournalStorage, NoteStorage
+
+MANIFEST_NAME = "manifest.json"
+CHECKSUM_SUFFIX = ".sum"
+SHARD_COUNT = 8
+# points per shard on the hash ring: more points spread the notes more evenly
+VIRTUAL_NODES = 64
+READ_CHUNK_SIZE = 1 << 20
+
+
+class ChecksumError(CodecError):
+    pass
+
+
+def hash_key(key):
+    # stable across processes and runs, unlike hash()
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    # Consistent hashing: every shard owns the arcs of the ring before its points and a
+    # note belongs to the shard owning its id's hash. A new shard takes over some arcs
+    # from each existing one, so growing from N to N + 1 shards moves about 1/(N + 1)
+    # of the notes instead of nearly all of them as hash % N would.
+    def __init__(self, shards, virtual_nodes=VIRTUAL_NODES):
+        points = sorted((hash_key(f"{shard}#{i}"), shard) for shard in shards for i in range(virtual_nodes))
+        self.hashes = [point for point, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def shard(self, key):
+        i = bisect_right(self.hashes, hash_key(key))
+        return self.shards[i % len(self.shards)]
+
+
+class ChecksumWriter:
+    # file wrapper that keeps a CRC-32 and the size of everything written through it
+    def __init__(self, f):
+        self.f = f
+        self.crc = 0
+        self.size = 0
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        return self.f.write(data)
+
+
+def file_checksum(f):
+    crc = size = 0
+    while True:
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return crc, size
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+
+
+class ShardJournal(JournalStorage):
+    # A JournalStorage whose snapshot is checked against the CRC-32 written next to it.
+    # The checksum file lists the new snapshot's checksum and the previous one: it is
+    # written before the snapshot is swapped in, so either file it may be paired with
+    # after a crash still verifies.
+    def __init__(self, filename, **options):
+        super().__init__(filename, **options)
+        self.checksum_filename = filename + CHECKSUM_SUFFIX
+
+    def read_checksums(self):
+        try:
+            with open(self.checksum_filename, "r", encoding="utf-8") as f:
+                return [tuple(checksum) for checksum in json.load(f)]
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+
+    def open_snapshot(self):
+        f, changes = super().open_snapshot()
+        checksums = self.read_checksums()
+        if f is not None and checksums is not None:
+            checksum = file_checksum(f)
+            f.seek(0)
+            if checksum not in checksums:
+                f.close()
+                raise ChecksumError(f"Checksum mismatch in {self.filename}")
+        return f, changes
+
+    def write_snapshot(self, notes, f):
+        checked = ChecksumWriter(f)
+        super().write_snapshot(notes, checked)
+        current = (self.read_checksums() or [None])[0]
+        temp_filename = self.checksum_filename + ".tmp"
+        with open(temp_filename, "w", encoding="utf-8") as out:
+            json.dump([checksum for checksum in ((checked.crc, checked.size), current) if checksum], out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(temp_filename, self.checksum_filename)
+
+
+class ShardedStorage(NoteStorage):
+    # notes.shards/ holds a manifest and one ShardJournal (snapshot, log, checksum) per
+    # shard; a note's shard follows from its id on a HashRing. Loads, flushes and
+    # compactions run per shard on a thread pool (file reads, checksums and fsync
+    # overlap; decoding still takes turns on the GIL) and only touch the shards that
+    # have changes. A shard that fails to decode or verify is moved aside and only its
+    # notes are missing; the others load as usual.
+    def __init__(self, dirname, shard_count=SHARD_COUNT, codec=None, **options):
+        self.dirname = dirname
+        self.manifest_filename = os.path.join(dirname, MANIFEST_NAME)
+        self.codec = codec
+        self.options = options
+        self.notices = []
+        manifest = self.read_manifest()
+        # a new store is written out with its first change
+        self.manifest_written = manifest is not None
+        self.use_manifest(manifest or {"shards": [f"{i:03d}" for i in range(shard_count)]})
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_filename, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write_manifest(self, manifest):
+        os.makedirs(self.dirname, exist_ok=True)
+        manifest["generation"] = self.generation + 1
+        temp_filename = self.manifest_filename + ".tmp"
+        with open(temp_filename, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, self.manifest_filename)
+        self.manifest_written = True
+        self.use_manifest(manifest)
+
+    def refresh_manifest(self):
+        # pick up a reshard done by another process
+        manifest = self.read_manifest()
+        if manifest is not None:
+            self.manifest_written = True
+            self.use_manifest(manifest)
+        elif not os.path.isdir(self.dirname):
+            raise FileNotFoundError(self.dirname)
+
+    def ensure_manifest(self):
+        if not self.manifest_written:
+            self.write_manifest(dict(self.manifest))
+
+    def use_manifest(self, manifest):
+        self.manifest = manifest
+        self.generation = manifest.get("generation", 0)
+        old = getattr(self, "shards", {})
+        self.shards = {name: old.get(name) or ShardJournal(self.shard_filename(name), codec=self.codec, **self.options)
+                       for name in manifest["shards"]}
+        self.ring = HashRing(manifest["shards"])
+        # note id -> shard name, filled by partition(): hashing every id again on each
+        # compaction costs more than rewriting the one dirty shard
+        self.owners = {}
+
+    def shard_filename(self, name):
+        return os.path.join(self.dirname, f"notes-{name}.json")
+
+    def shard_for(self, note_id):
+        return self.shards[self.ring.shard(note_id)]
+
+    def run(self, function, shards):
+        # function(shard) for each shard on a thread pool, results in order
+        shards = list(shards)
+        if len(shards) <= 1:
+            return [function(shard) for shard in shards]
+        with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard") as pool:
+            return list(pool.map(function, shards))
+
+    def set_aside(self, shard, error):
+        backup = shard.quarantine()
+        self.notices.append(f"Shard {os.path.basename(shard.filename)} is damaged ({error}); "
+                            f"it was moved to {backup} and its notes are missing.")
+
+    def load_shard(self, shard):
+        try:
+            return shard.load()
+        except FileNotFoundError:
+            return []
+        except (json.JSONDecodeError, UnicodeDecodeError, CodecError) as e:
+            self.set_aside(shard, e)
+            try:
+                # the shard's log is still good
+                return shard.load()
+            except (FileNotFoundError, json.JSONDecodeError, CodecError):
+                return []
+
+    def load(self):
+        self.refresh_manifest()
+        self.notices = []
+        shard_rows = self.run(self.load_shard, self.shards.values())
+        if "previous" in self.manifest:
+            # a reshard was interrupted: notes may sit in both their old and new shard
+            for shard in self.shards.values():
+                shard.loaded = None
+            rows = list({row[ID_FIELD]: row for rows in shard_rows for row in rows}.values())
+            self.move_notes(rows, HashRing(self.manifest["previous"]))
+            return rows
+        return [row for rows in shard_rows for row in rows]
+
+    def build_index(self, index, notes):
+        # from every shard's cached index when each shard was loaded in full
+        shards = self.shards.values()
+        if type(index) is InvertedIndex and all(shard.loaded is not None for shard in shards):
+            index.clear()
+            for shard in shards:
+                shard.extend_index(index, notes)
+        else:
+            for shard in shards:
+                shard.loaded = None
+            index.build(notes.values())
+
+    def iter_load(self, streaming=True):
+        self.refresh_manifest()
+        if not streaming or "previous" in self.manifest:
+            return iter(self.load())
+        self.notices = []
+        return self.stream_shards(list(self.shards.values()))
+
+    def stream_shards(self, shards):
+        # one shard after the other; a damaged shard ends early and the next one follows
+        for shard in shards:
+            try:
+                yield from shard.iter_load(streaming=True)
+            except FileNotFoundError:
+                continue
+            except (json.JSONDecodeError, UnicodeDecodeError, CodecError) as e:
+                self.set_aside(shard, e)
+
+    def record(self, op, note_dict):
+        self.ensure_manifest()
+        shard = self.shard_for(note_dict["id"])
+        shard.flush_soon = self.flush_soon
+        shard.record(op, note_dict)
+
+    def record_many(self, op, note_dicts):
+        groups = {}
+        for note_dict in note_dicts:
+            groups.setdefault(self.ring.shard(note_dict["id"]), []).append(note_dict)
+        self.ensure_manifest()
+        written = self.run(lambda name: self.shards[name].record_many(op, groups[name]), groups)
+        return sum(written)
+
+    def flush(self):
+        dirty = [shard for shard in self.shards.values() if shard.unsaved()]
+        if not dirty:
+            return 0
+        self.ensure_manifest()
+        return sum(self.run(lambda shard: shard.flush(), dirty))
+
+    def unsaved(self):
+        return sum(shard.unsaved() for shard in self.shards.values())
+
+    def has_changes(self):
+        manifest = self.read_manifest()
+        if manifest is not None and manifest.get("generation", 0) != self.generation:
+            return True
+        return any(shard.has_changes() for shard in self.shards.values())
+
+    def read_changes(self):
+        manifest = self.read_manifest()
+        if manifest is not None and manifest.get("generation", 0) != self.generation:
+            return None
+        changes = {}
+        for shard in self.shards.values():
+            shard_changes = shard.read_changes() if shard.has_changes() else {}
+            if shard_changes is None:
+                return None
+            changes.update(shard_changes)
+        return changes
+
+    def needs_compaction(self):
+        return any(shard.needs_compaction() for shard in self.shards.values())
+
+    def partition(self, notes):
+        # shard name -> {note id: note}
+        parts = {name: {} for name in self.shards}
+        owners, shard = self.owners, self.ring.shard
+        for note in notes.values():
+            name = owners.get(note.id)
+            if name is None:
+                name = owners[note.id] = shard(note.id)
+            parts[name][note.id] = note
+        return parts
+
+    def compact(self, notes):
+        # only the shards with a log (or no snapshot yet) are rewritten
+        self.ensure_manifest()
+        parts = self.partition(notes)
+        stale = [name for name, shard in self.shards.items()
+                 if shard.log_records or shard.unsaved() or not os.path.exists(shard.filename)]
+        return all(self.run(lambda name: self.shards[name].compact(parts[name]), stale))
+
+    def reshard(self, shard_count, notes):
+        # Grow to shard_count shards. Only the notes the ring hands to the new shards are
+        # written: as additions to the new shards and deletions appended to the logs of
+        # their old ones. The manifest keeps the previous shard list until every move is
+        # on disk, so an interrupted reshard is finished by the next load.
+        names = list(self.manifest["shards"])
+        if shard_count < len(names):
+            raise ValueError("The number of shards can only grow")
+        if shard_count == len(names):
+            return 0
+        self.flush()
+        previous = HashRing(names)
+        names += [f"{i:03d}" for i in range(len(names), shard_count)]
+        self.write_manifest({"shards": names, "previous": self.manifest["shards"]})
+        return self.move_notes(list(map(row_from_note, notes.values())), previous)
+
+    def move_notes(self, rows, previous):
+        moved = 0
+        for row in rows:
+            note_id = row[ID_FIELD]
+            old, new = previous.shard(note_id), self.ring.shard(note_id)
+            if old != new:
+                title, content, _, timestamp = row
+                self.shards[new].record("add", {"id": note_id, "title": title, "content": content,
+                                                "timestamp": timestamp})
+                moved += 1
+        # the new copies are on disk before any old one is deleted
+        self.flush()
+        for row in rows:
+            note_id = row[ID_FIELD]
+            old = previous.shard(note_id)
+            if old in self.shards and old != self.ring.shard(note_id):
+                self.shards[old].record("delete", {"id": note_id})
+        self.flush()
+        self.write_manifest({"shards": self.manifest["shards"]})
+        return moved
+
+    def take_notices(self):
+        notices, self.notices = self.notices, []
+        return notices
+
+    def close(self):
+        self.flush()
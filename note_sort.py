@@ -0,0 +1,92 @@
+import datetime
+from bisect import bisect_left, insort
+
+from note_compact import EPOCH, SECOND, parse_timestamp
+
+
+def note_seconds(note):
+    # the timestamp as a number: CompactNote keeps it as one, a Note's string is
+    # parsed (once per change, by the SortedOrder holding it)
+    seconds = getattr(note, "seconds", None)
+    if seconds is not None:
+        return seconds
+    try:
+        return parse_timestamp(note.timestamp)
+    except ValueError:
+        # an unreadable timestamp sorts as the oldest
+        return float("-inf")
+
+
+def to_seconds(moment):
+    # a range bound: None, a datetime, a timestamp string or seconds already
+    if moment is None or isinstance(moment, (int, float)):
+        return moment
+    if isinstance(moment, datetime.datetime):
+        return (moment - EPOCH) // SECOND
+    return parse_timestamp(moment)
+
+
+# listing orders besides insertion order: name -> (sort key of a note, newest/last first)
+SORT_ORDERS = {
+    "timestamp": (note_seconds, True),
+    "title": (lambda note: note.title.lower(), False),
+}
+
+
+def check_sort(sort):
+    if sort is not None and sort not in SORT_ORDERS:
+        raise ValueError(f"Unknown sort order: {sort}")
+    return sort
+
+
+class SortedOrder:
+    # Note ids sorted by one of SORT_ORDERS, as a sequence like NoteManager.order.
+    # Sorted once when first asked for, then kept sorted with bisect on every change,
+    # so a page is a slice of page size ids and never a re-sort.
+    def __init__(self, sort, notes=()):
+        self.key, self.reverse = SORT_ORDERS[check_sort(sort)]
+        # (key, note id), ascending; ties are broken by id
+        self.entries = sorted((self.key(note), note.id) for note in notes)
+        # note id -> its entry, to find it again when the note changes
+        self.positions = {entry[1]: entry for entry in self.entries}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("note index out of range")
+        return self.entries[-1 - index if self.reverse else index][1]
+
+    def between(self, low=None, high=None, limit=None):
+        # ids of the notes with low <= key < high (None = unbounded), in listing order;
+        # two binary searches, then only the (first `limit`) ids in range are copied
+        start = 0 if low is None else bisect_left(self.entries, (low,))
+        end = len(self.entries) if high is None else bisect_left(self.entries, (high,))
+        if limit is not None:
+            if self.reverse:
+                start = max(start, end - limit)
+            else:
+                end = min(end, start + limit)
+        entries = self.entries[start:end]
+        if self.reverse:
+            entries.reverse()
+        return [entry[1] for entry in entries]
+
+    def update(self, note):
+        # a new or edited note
+        entry = (self.key(note), note.id)
+        if self.positions.get(note.id) == entry:
+            return
+        self.discard(note.id)
+        insort(self.entries, entry)
+        self.positions[note.id] = entry
+
+    def discard(self, note_id):
+        entry = self.positions.pop(note_id, None)
+        if entry is not None:
+            del self.entries[bisect_left(self.entries, entry)]
@@ -0,0 +1,366 @@
+import datetime
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping, ValuesView
+
+from note_codec import CodecError
+from note_compact import format_timestamp
+from note_fuzzy import TrigramIndex
+from note_index import tokenize
+from note_sort import check_sort
+from note_storage import SYNC_BATCH_SIZE, NoteStorage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_timestamp ON notes (timestamp);
+CREATE INDEX IF NOT EXISTS notes_title ON notes (lower(title), id);
+"""
+
+# the full-text table mirrors notes through triggers, so it never has to be rebuilt
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5 (
+    title, content, content='notes', content_rowid='seq'
+);
+CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes BEGIN
+    INSERT INTO notes_fts (rowid, title, content) VALUES (new.seq, new.title, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_delete AFTER DELETE ON notes BEGIN
+    INSERT INTO notes_fts (notes_fts, rowid, title, content) VALUES ('delete', old.seq, old.title, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_update AFTER UPDATE ON notes BEGIN
+    INSERT INTO notes_fts (notes_fts, rowid, title, content) VALUES ('delete', old.seq, old.title, old.content);
+    INSERT INTO notes_fts (rowid, title, content) VALUES (new.seq, new.title, new.content);
+END;
+"""
+
+NOTE_COLUMNS = "title, content, id, timestamp"
+# note_sort.SORT_ORDERS as ORDER BY clauses on the indexes above; lower() only folds
+# ASCII here, so titles differing in other letters' case may sort apart
+SORT_COLUMNS = {
+    "timestamp": "timestamp DESC, id DESC",
+    "title": "lower(title), id",
+}
+
+
+class SqliteStorage(NoteStorage):
+    # Notes stay in an SQLite database (WAL mode) instead of memory: NoteManager.notes
+    # reads and writes rows on demand, search goes through FTS5, and menu numbers are
+    # answered with LIMIT/OFFSET queries. Changes are committed in batches.
+    in_memory = False
+
+    def __init__(self, filename, batch_size=SYNC_BATCH_SIZE):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.connection = None
+        self.fts = False
+        self.changes = 0
+        self.notices = []
+        # the autosave thread commits too (see note_autosave)
+        self.lock = threading.RLock()
+
+    def connect(self):
+        if self.connection is None:
+            connection = sqlite3.connect(self.filename, check_same_thread=False)
+            try:
+                self.setup(connection)
+            except BaseException:
+                connection.close()
+                raise
+            self.connection = connection
+        return self.connection
+
+    def setup(self, connection):
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.executescript(SCHEMA)
+        try:
+            connection.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # sqlite built without FTS5: search falls back to LIKE
+            self.fts = False
+
+    def open_notes(self, note_class):
+        try:
+            return SqliteNoteStore(self, note_class)
+        except sqlite3.OperationalError:
+            # locked or unreachable, not damaged
+            raise
+        except sqlite3.DatabaseError as e:
+            # not a database, or a damaged one: handled like an undecodable notes.json
+            self.disconnect()
+            raise CodecError(f"{self.filename} is not a usable notes database ({e})") from None
+
+    def empty_notes(self, note_class):
+        try:
+            return self.open_notes(note_class)
+        except (CodecError, sqlite3.Error) as e:
+            # the file still cannot be opened: keep this session's notes in memory only
+            self.disconnect()
+            self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+            self.setup(self.connection)
+            self.notices.append(f"{self.filename} cannot be opened ({e}); changes will not be saved.")
+            return SqliteNoteStore(self, note_class)
+
+    def quarantine(self):
+        # the database goes aside with its WAL files; a new one is created in its place
+        self.disconnect()
+        backup = f"{self.filename}.corrupt-{datetime.datetime.now():%Y%m%d-%H%M%S}"
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.replace(self.filename + suffix, backup + suffix)
+            except FileNotFoundError:
+                if not suffix:
+                    return None
+        return backup
+
+    def take_notices(self):
+        notices, self.notices = self.notices, []
+        return notices
+
+    def new_index(self):
+        return SqliteIndex(self)
+
+    def note_order(self, notes):
+        return SqliteNoteOrder(notes)
+
+    def sorted_order(self, sort, notes):
+        return SqliteSortedOrder(sort, notes)
+
+    def record(self, op, note_dict):
+        with self.lock:
+            self.changes += 1
+            full = self.changes >= self.batch_size
+        if full:
+            self.flush_batch()
+
+    def record_many(self, op, note_dicts):
+        self.flush()
+
+    def unsaved(self):
+        return self.changes
+
+    def flush(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.commit()
+            self.changes = 0
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, notes):
+        connection = self.connect()
+        connection.commit()
+        if self.fts:
+            connection.execute("INSERT INTO notes_fts (notes_fts) VALUES ('optimize')")
+            connection.commit()
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.commit()
+                self.connection.close()
+                self.connection = None
+
+    def disconnect(self):
+        # close without committing, for a database that failed
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+class SqliteNoteStore(MutableMapping):
+    # note id -> note, backed by the notes table (ordered by insertion)
+    def __init__(self, storage, note_class):
+        self.storage = storage
+        self.connection = storage.connect()
+        self.note_class = note_class
+        self.count = self.connection.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, note_id):
+        return self.connection.execute("SELECT 1 FROM notes WHERE id = ?", (note_id,)).fetchone() is not None
+
+    def __getitem__(self, note_id):
+        row = self.connection.execute(f"SELECT {NOTE_COLUMNS} FROM notes WHERE id = ?", (note_id,)).fetchone()
+        if row is None:
+            raise KeyError(note_id)
+        return self.note_class(*row)
+
+    def __setitem__(self, note_id, note):
+        values = (note.title, note.content, note.timestamp, note_id)
+        cursor = self.connection.execute("UPDATE notes SET title = ?, content = ?, timestamp = ? WHERE id = ?", values)
+        if cursor.rowcount == 0:
+            self.connection.execute("INSERT INTO notes (title, content, timestamp, id) VALUES (?, ?, ?, ?)", values)
+            self.count += 1
+
+    def __delitem__(self, note_id):
+        cursor = self.connection.execute("DELETE FROM notes WHERE id = ?", (note_id,))
+        if cursor.rowcount == 0:
+            raise KeyError(note_id)
+        self.count -= cursor.rowcount
+
+    def __iter__(self):
+        for (note_id,) in self.connection.execute("SELECT id FROM notes ORDER BY seq"):
+            yield note_id
+
+    def values(self):
+        return SqliteNoteValues(self)
+
+    def iter_rows(self):
+        for row in self.connection.execute(f"SELECT {NOTE_COLUMNS} FROM notes ORDER BY seq"):
+            yield self.note_class(*row)
+
+
+class SqliteNoteValues(ValuesView):
+    def __iter__(self):
+        return self._mapping.iter_rows()
+
+
+class SqliteNoteOrder:
+    # menu numbers as a live view over the table; position i is the i-th row by seq
+    order_by = "seq"
+
+    def __init__(self, notes):
+        self.notes = notes
+        self.connection = notes.connection
+
+    def __len__(self):
+        return len(self.notes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            rows = self.connection.execute(f"SELECT id FROM notes ORDER BY {self.order_by} LIMIT ? OFFSET ?",
+                                           (max(0, stop - start), start))
+            return [note_id for (note_id,) in rows][::step]
+        if index < 0:
+            index += len(self)
+        row = self.connection.execute(f"SELECT id FROM notes ORDER BY {self.order_by} LIMIT 1 OFFSET ?",
+                                      (index,)).fetchone()
+        if index < 0 or row is None:
+            raise IndexError("note index out of range")
+        return row[0]
+
+    # new rows show up in the queries by themselves
+    def append(self, note_id):
+        pass
+
+    def extend(self, note_ids):
+        pass
+
+
+class SqliteSortedOrder(SqliteNoteOrder):
+    # Same interface as note_sort.SortedOrder, answered by queries: a page is ORDER BY
+    # ... LIMIT/OFFSET and a time range a WHERE on the timestamp index, so nothing is
+    # read up front and rows written by other connections show up.
+    def __init__(self, sort, notes):
+        super().__init__(notes)
+        self.sort = check_sort(sort)
+        self.order_by = SORT_COLUMNS[self.sort]
+
+    def between(self, low=None, high=None, limit=None):
+        # ids of the notes with low <= timestamp < high (seconds, None = unbounded)
+        if self.sort != "timestamp":
+            raise ValueError(f"The {self.sort} order has no ranges")
+        conditions = []
+        parameters = []
+        for bound, condition in ((low, "timestamp >= ?"), (high, "timestamp < ?")):
+            if bound is not None:
+                conditions.append(condition)
+                parameters.append(format_timestamp(bound))
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        rows = self.connection.execute(f"SELECT id FROM notes {where}ORDER BY {self.order_by} LIMIT ?",
+                                       (*parameters, -1 if limit is None else limit))
+        return [note_id for (note_id,) in rows]
+
+    def update(self, note):
+        pass
+
+    def discard(self, note_id):
+        pass
+
+
+class SqliteIndex:
+    # same interface as InvertedIndex; the triggers keep notes_fts up to date
+    def __init__(self, storage):
+        self.storage = storage
+        # trigrams of every word in the notes, for fuzzy queries (None = read on next use)
+        self.trigrams = None
+        # (connection, PRAGMA data_version) the trigrams were read at
+        self.trigrams_version = None
+
+    def build(self, notes):
+        self.trigrams = None
+
+    def add(self, note, keep_sorted=True):
+        if self.trigrams is not None:
+            for term in tokenize(note.title) + tokenize(note.content):
+                self.trigrams.add(term)
+
+    def update(self, note):
+        # the words the edit removed stay in the vocabulary; they just match nothing
+        self.add(note)
+
+    def remove(self, note_id):
+        pass
+
+    def vocabulary(self, connection):
+        # data_version changes when another connection commits, so the words are read
+        # again after other processes wrote; this one's own notes come through add
+        (version,) = connection.execute("PRAGMA data_version").fetchone()
+        if self.trigrams is None or self.trigrams_version != (connection, version):
+            terms = set()
+            for title, content in connection.execute("SELECT title, content FROM notes"):
+                terms.update(tokenize(title))
+                terms.update(tokenize(content))
+            self.trigrams = TrigramIndex(terms)
+            self.trigrams_version = (connection, version)
+        return self.trigrams
+
+    def search(self, query, mode="all", prefix=True, limit=None):
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        if mode not in ("all", "any", "fuzzy"):
+            raise ValueError(f"Search mode {mode} is not supported by this storage")
+        connection = self.storage.connect()
+        limit = -1 if limit is None else limit
+        # words to look for: any word of a group, and every group for "all"
+        groups = [[term] for term in terms]
+        if mode == "fuzzy":
+            # every word of the query, each as any word within a few typos of it
+            trigrams = self.vocabulary(connection)
+            groups = [list(trigrams.similar(term)) for term in terms]
+            if not all(groups):
+                return []
+            mode, prefix = "all", False
+        join = " AND " if mode == "all" else " OR "
+
+        if not self.storage.fts:
+            condition = join.join("(" + " OR ".join(["title LIKE ? OR content LIKE ?"] * len(group)) + ")"
+                                  for group in groups)
+            parameters = [f"%{term}%" for group in groups for term in group for _ in (0, 1)]
+            rows = connection.execute(f"SELECT id FROM notes WHERE {condition} ORDER BY seq LIMIT ?",
+                                      (*parameters, limit))
+            return [note_id for (note_id,) in rows]
+
+        star = "*" if prefix else ""
+        match = join.join("(" + " OR ".join(f'"{term}"{star}' for term in group) + ")" for group in groups)
+        # bm25 is lower for better matches; titles count double like in InvertedIndex
+        rows = connection.execute(
+            "SELECT notes.id FROM notes_fts JOIN notes ON notes.seq = notes_fts.rowid "
+            "WHERE notes_fts MATCH ? ORDER BY bm25(notes_fts, 2.0, 1.0) LIMIT ?", (match, limit))
+        return [note_id for (note_id,) in rows]
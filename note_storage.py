@@ -0,0 +1,515 @@
+import contextlib
+import datetime
+import gc
+import json
+import marshal
+import os
+import sys
+import threading
+import uuid
+import zlib
+
+import note_metrics
+from note_codec import CODECS, DEFAULT_CODEC, ID_FIELD, detect_codec, get_codec, load_rows, row_from_dict, row_from_note
+from note_index import InvertedIndex
+from note_sort import SortedOrder
+
+try:
+    import fcntl
+except ImportError:
+    # no flock() on Windows: a single process per store is assumed there
+    fcntl = None
+
+LOG_SUFFIX = ".log"
+LOCK_SUFFIX = ".lock"
+VERSION_SUFFIX = ".version"
+# decoded snapshot rows in marshal format, reused while the snapshot is unchanged
+CACHE_SUFFIX = ".cache"
+CACHE_VERSION = 1
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+# a directory of shard files (see note_shard)
+SHARDED_SUFFIX = ".shards"
+# codec name that opens the binary snapshot with mmap instead of loading it
+MAPPED_CODEC = "mmap"
+# records kept in memory before they are appended (and fsync'ed) as one batch
+SYNC_BATCH_SIZE = 64
+# once the log holds this many records, save folds it into the snapshot
+COMPACT_AFTER = 10000
+
+
+@contextlib.contextmanager
+def file_lock(filename, exclusive=True):
+    # advisory lock shared by every process that opens the same notes file
+    if fcntl is None:
+        yield
+        return
+    with open(filename, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def gc_paused():
+    # Bulk loads create millions of objects, none of them part of a reference cycle;
+    # the cyclic GC would otherwise rescan the growing heap over and over meanwhile.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def open_storage(filename, codec=None):
+    # pick the backend from the file name: notes.db is SQLite, notes.shards a
+    # directory of shards (see note_shard), anything else a
+    # snapshot written with `codec` (see note_codec) plus a journal; codec="mmap"
+    # maps a binary snapshot instead of loading it (see note_mmap)
+    if filename.endswith(SQLITE_SUFFIXES):
+        from note_sqlite import SqliteStorage
+        return SqliteStorage(filename)
+    if filename.endswith(SHARDED_SUFFIX):
+        from note_shard import ShardedStorage
+        return ShardedStorage(filename, codec=codec)
+    if codec == MAPPED_CODEC:
+        from note_mmap import MmapStorage
+        return MmapStorage(filename)
+    return JournalStorage(filename, codec=codec)
+
+
+class NoteStorage:
+    # What NoteManager expects from a storage backend. Backends with in_memory = True
+    # hand every note over through load()/iter_load(), as (title, content, id,
+    # timestamp) rows (see note_codec.ROW_FIELDS); the others return a live
+    # id -> note mapping from open_notes() and answer searches and menu numbers
+    # themselves through new_index() and note_order().
+    in_memory = True
+
+    def load(self):
+        raise NotImplementedError
+
+    def iter_load(self):
+        return iter(self.load())
+
+    def open_notes(self, note_class):
+        raise NotImplementedError
+
+    def empty_notes(self, note_class):
+        # an empty live mapping, when open_notes() failed
+        return self.open_notes(note_class)
+
+    def new_index(self):
+        return InvertedIndex()
+
+    def build_index(self, index, notes):
+        # index the notes just loaded
+        index.build(notes.values())
+
+    def note_order(self, notes):
+        return list(notes)
+
+    def sorted_order(self, sort, notes):
+        # the notes in a note_sort.SORT_ORDERS order, kept up to date by NoteManager
+        return SortedOrder(sort, notes.values())
+
+    # called instead of flush() when a batch of records fills up, so that a thread of
+    # the caller's writes it (NoteManager hands it to its Autosaver); None writes the
+    # batch on the recording thread
+    flush_soon = None
+
+    def record(self, op, note_dict):
+        raise NotImplementedError
+
+    def flush_batch(self):
+        if self.flush_soon is not None:
+            self.flush_soon()
+        else:
+            self.flush()
+
+    def record_many(self, op, note_dicts):
+        for note_dict in note_dicts:
+            self.record(op, note_dict)
+
+    def flush(self):
+        raise NotImplementedError
+
+    def unsaved(self):
+        # number of recorded changes not yet written
+        return 0
+
+    def has_changes(self):
+        # whether another process changed the store since we last read it
+        return False
+
+    def read_changes(self):
+        # note id -> note dict (None = deleted) written by other processes since the
+        # last read, or None when the whole store has to be loaded again
+        return {}
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, notes):
+        return True
+
+    def quarantine(self):
+        # move an unreadable store aside instead of overwriting it later; returns
+        # where it went, or None when there is nothing to move
+        return None
+
+    def take_notices(self):
+        # messages about the last load worth showing the user (e.g. recovered damage)
+        return []
+
+    def close(self):
+        self.flush()
+
+
+class JournalStorage(NoteStorage):
+    # notes.json is a snapshot; every change after it is appended to notes.json.log
+    # as one JSON line, so saving an edit writes that note only.
+    #
+    # Several processes can share one store: appends and compaction hold an exclusive
+    # lock on notes.json.lock, loads and reads a shared one. Each process remembers how
+    # far into the log it has read and the generation in notes.json.version (bumped by
+    # every compaction), so picking up other writers' changes means reading the new
+    # tail of the log; only a compaction elsewhere forces a full reload.
+    def __init__(self, filename, batch_size=SYNC_BATCH_SIZE, compact_after=COMPACT_AFTER, codec=None, cache=True):
+        self.filename = filename
+        # the format compaction writes; any format is read (note_codec.load_rows).
+        # None keeps the format of the existing snapshot.
+        self.codec = get_codec(codec) if codec is not None else None
+        self.log_filename = filename + LOG_SUFFIX
+        self.lock_filename = filename + LOCK_SUFFIX
+        self.version_filename = filename + VERSION_SUFFIX
+        # cache=True keeps the rows of a fully loaded snapshot in notes.json.cache (see
+        # snapshot_rows); None turns it off
+        self.cache_filename = filename + CACHE_SUFFIX if cache else None
+        self.batch_size = batch_size
+        self.compact_after = compact_after
+        # tags our log records so that our own changes are not merged back in
+        self.writer = uuid.uuid4().hex[:8]
+        # the dirty notes: note id -> the log record of its latest unsaved change, so a
+        # note edited ten times between two flushes is written once
+        self.pending = {}
+        # flush() may run on an autosave thread: `lock` guards pending, `write_lock`
+        # keeps log writes and reads of this process from interleaving
+        self.lock = threading.RLock()
+        self.write_lock = threading.RLock()
+        self.log_records = 0
+        self.log_offset = 0
+        self.generation = 0
+        # (cache stamp, rows, cached index state or None) of the snapshot last loaded
+        self.loaded = None
+        self.replayed = set()
+
+    def load(self):
+        return list(self.iter_load(streaming=False))
+
+    def iter_load(self, streaming=True):
+        # The log is read up front (compaction keeps it small); the snapshot is
+        # streamed unless streaming=False, which decodes it in one go (faster).
+        # Missing files are reported here rather than on first next().
+        self.loaded = None
+        f, changes = self.open_snapshot()
+        # the notes the log changes, to be indexed again over a cached snapshot index
+        self.replayed = set(changes)
+        return self.replay(f, changes, streaming)
+
+    def open_snapshot(self):
+        # (open snapshot file or None, note id -> note dict or None from the log),
+        # read under one shared lock so that the two belong together
+        with self.write_lock, self.lock, file_lock(self.lock_filename, exclusive=False):
+            self.generation = self.read_generation()
+            records, self.log_offset, log_found = self.read_log(0)
+            try:
+                f = open(self.filename, "rb")
+                if self.codec is None:
+                    self.codec = detect_codec(f)
+                note_metrics.count("bytes_read", os.fstat(f.fileno()).st_size)
+            except FileNotFoundError:
+                if not log_found:
+                    raise
+                f = None
+            self.log_records = len(records)
+            self.pending = {}
+        note_metrics.count("bytes_read", self.log_offset)
+        changes = {}
+        for record in records:
+            self.apply(changes, record)
+        return f, changes
+
+    def read_generation(self):
+        try:
+            with open(self.version_filename, "r", encoding="utf-8") as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def read_log(self, offset):
+        # (records, end offset, whether the log exists) for the log from offset on
+        records = []
+        try:
+            with open(self.log_filename, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # a crash in the middle of an append leaves a torn last line
+                        break
+                    offset += len(line)
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        except FileNotFoundError:
+            return records, 0, False
+        return records, offset, True
+
+    def replay(self, f, changes, streaming=True):
+        if f is not None:
+            with f:
+                rows = load_rows(f, True) if streaming else self.snapshot_rows(f)
+                for row in rows:
+                    if row[ID_FIELD] in changes:
+                        d = changes.pop(row[ID_FIELD])
+                        if d is None:
+                            continue
+                        row = row_from_dict(d)
+                    yield row
+        for d in changes.values():
+            if d is not None:
+                yield row_from_dict(d)
+
+    def snapshot_rows(self, f):
+        # Every row of the open snapshot. Decoding JSON and indexing the notes are the
+        # bulk of a start, so both are cached in notes.json.cache with marshal, stamped
+        # with the snapshot's inode, size and mtime: a compaction or any other rewrite
+        # of the snapshot makes the cache stale and the next load rebuilds it.
+        if self.cache_filename is None:
+            return load_rows(f)
+        stat = os.fstat(f.fileno())
+        stamp = (CACHE_VERSION, sys.version_info[:2], stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        cached = self.read_cache(stamp)
+        if cached is not None:
+            note_metrics.count("snapshot_cache_hits")
+            rows, index_state = cached
+        else:
+            note_metrics.count("snapshot_cache_misses")
+            rows, index_state = list(load_rows(f)), None
+        self.loaded = (stamp, rows, index_state)
+        return rows
+
+    def read_cache(self, stamp):
+        # (rows, index state) from the cache, or None when it is missing, stale or damaged
+        try:
+            with open(self.cache_filename, "rb") as f:
+                header = marshal.load(f)
+                if tuple(header[:-1]) != stamp:
+                    return None
+                data = f.read()
+            if zlib.crc32(data) != header[-1]:
+                return None
+            return marshal.loads(data)
+        except (OSError, EOFError, ValueError, TypeError, IndexError):
+            return None
+
+    def write_cache(self, stamp, rows, index_state):
+        # best effort: a store that cannot have a cache is only slower to open
+        temp_filename = f"{self.cache_filename}.{self.writer}.tmp"
+        try:
+            data = marshal.dumps((rows, index_state))
+            with open(temp_filename, "wb") as f:
+                marshal.dump(stamp + (zlib.crc32(data),), f)
+                f.write(data)
+            os.replace(temp_filename, self.cache_filename)
+        except (OSError, ValueError):
+            with contextlib.suppress(OSError):
+                os.remove(temp_filename)
+
+    def build_index(self, index, notes):
+        if self.loaded is not None and type(index) is InvertedIndex:
+            index.clear()
+            self.extend_index(index, notes)
+        else:
+            self.loaded = None
+            index.build(notes.values())
+
+    def extend_index(self, index, notes):
+        # Add the notes of the last load() to the index from the cached snapshot index:
+        # only the notes the log changed are indexed again. A snapshot that was not
+        # cached yet is indexed from its rows and the cache written.
+        loaded, self.loaded = self.loaded, None
+        stamp, rows, index_state = loaded
+        if index_state is not None:
+            index.merge(*index_state)
+        else:
+            snapshot_index = InvertedIndex()
+            for title, content, note_id, _ in rows:
+                snapshot_index.add_text(note_id, title, content, keep_sorted=False)
+            self.write_cache(stamp, rows, snapshot_index.state())
+            index.merge(*snapshot_index.state())
+        for note_id in self.replayed:
+            index.remove(note_id)
+            note = notes.get(note_id)
+            if note is not None:
+                index.add(note, keep_sorted=False)
+        return True
+
+    def apply(self, notes, record):
+        # replaying is idempotent, so a log left behind by an interrupted compaction is harmless
+        if record["op"] == "delete":
+            notes[record["id"]] = None
+        else:
+            note = record["note"]
+            notes[note["id"]] = note
+
+    def log_record(self, op, note_dict):
+        if op == "delete":
+            return {"op": op, "id": note_dict["id"], "w": self.writer}
+        return {"op": op, "note": note_dict, "w": self.writer}
+
+    def record(self, op, note_dict):
+        with self.lock:
+            self.pending[note_dict["id"]] = self.log_record(op, note_dict)
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.flush_batch()
+
+    def record_many(self, op, note_dicts):
+        # bulk changes go to the log as one append and one fsync
+        with self.lock:
+            for note_dict in note_dicts:
+                self.pending[note_dict["id"]] = self.log_record(op, note_dict)
+        return self.flush()
+
+    def unsaved(self):
+        return len(self.pending)
+
+    def flush(self):
+        # The dirty records are taken under `lock` and written outside it, so recording
+        # a change never waits for the fsync of a flush running on another thread.
+        with self.write_lock:
+            with self.lock:
+                records, self.pending = self.pending, {}
+            if not records:
+                return 0
+            data = "".join(json.dumps(record, separators=(",", ":")) + "\n"
+                           for record in records.values()).encode("utf-8")
+            try:
+                with file_lock(self.lock_filename):
+                    self.repair_log()
+                    with open(self.log_filename, "ab") as f:
+                        start = f.tell()
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+            except BaseException:
+                # keep them dirty; changes recorded meanwhile are newer
+                with self.lock:
+                    records.update(self.pending)
+                    self.pending = records
+                raise
+            # nobody else wrote since our last read, so there is nothing to catch up on
+            if start == self.log_offset:
+                self.log_offset = start + len(data)
+            self.log_records += len(records)
+        note_metrics.count("bytes_written", len(data))
+        return len(data)
+
+    def repair_log(self):
+        # cut off a torn last line so that new records start on a line of their own
+        try:
+            f = open(self.log_filename, "rb+")
+        except FileNotFoundError:
+            return
+        with f:
+            size = end = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - 4096)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline != -1:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end != size:
+                f.truncate(end)
+
+    def log_size(self):
+        try:
+            return os.path.getsize(self.log_filename)
+        except FileNotFoundError:
+            return 0
+
+    def has_changes(self):
+        # two cheap checks, no lock: a new generation or a log that is not where we left it
+        return self.read_generation() != self.generation or self.log_size() != self.log_offset
+
+    def read_changes(self):
+        with self.write_lock, file_lock(self.lock_filename, exclusive=False):
+            if self.read_generation() != self.generation or self.log_size() < self.log_offset:
+                return None
+            offset = self.log_offset
+            records, self.log_offset, _ = self.read_log(offset)
+            self.log_records += len(records)
+        note_metrics.count("bytes_read", self.log_offset - offset)
+
+        # last record per note wins; if that one is ours (or we have newer unsaved
+        # changes to the note) memory is already up to date
+        latest = {}
+        for record in records:
+            note_id = record["id"] if record["op"] == "delete" else record["note"]["id"]
+            latest[note_id] = record
+        with self.lock:
+            pending_ids = set(self.pending)
+        changes = {}
+        for note_id, record in latest.items():
+            if record.get("w") == self.writer or note_id in pending_ids:
+                continue
+            changes[note_id] = None if record["op"] == "delete" else record["note"]
+        return changes
+
+    def needs_compaction(self):
+        return self.log_records >= self.compact_after
+
+    def compact(self, notes):
+        # Write the new snapshot next to the old one and swap it in, then drop the log.
+        # Skipped (False) when another process changed the store since we last read it.
+        with self.write_lock, file_lock(self.lock_filename):
+            if self.read_generation() != self.generation or self.log_size() != self.log_offset:
+                return False
+            temp_filename = self.filename + ".tmp"
+            with open(temp_filename, "wb") as f:
+                self.write_snapshot(notes, f)
+                f.flush()
+                os.fsync(f.fileno())
+                note_metrics.count("bytes_written", f.tell())
+            os.replace(temp_filename, self.filename)
+            if os.path.exists(self.log_filename):
+                os.remove(self.log_filename)
+            self.generation += 1
+            with open(self.version_filename, "w", encoding="utf-8") as f:
+                f.write(str(self.generation))
+            with self.lock:
+                self.pending = {}
+            self.log_records = 0
+            self.log_offset = 0
+        return True
+
+    def write_snapshot(self, notes, f):
+        codec = self.codec or CODECS[DEFAULT_CODEC]
+        codec.dump(map(row_from_note, notes.values()), f)
+
+    def quarantine(self):
+        # the log stays: its records are still good and are replayed without the snapshot
+        backup = f"{self.filename}.corrupt-{datetime.datetime.now():%Y%m%d-%H%M%S}"
+        with file_lock(self.lock_filename):
+            try:
+                os.replace(self.filename, backup)
+            except FileNotFoundError:
+                return None
+        return backup
@@ -0,0 +1,15 @@
+from note_import import check_batch, checked_batches
+
+
+def test_timestamps_are_stored_zero_padded():
+    items = [{"title": "hello there", "content": "hello world", "timestamp": "2024-2-1 0:0:0"}]
+    notes, rejects = check_batch("csv", 1, items, 3)
+    assert rejects == []
+    assert notes[0][4] == "2024-02-01 00:00:00"
+
+
+def test_csv_with_byte_order_mark(tmp_path):
+    filename = tmp_path / "notes.csv"
+    filename.write_text("title,content\nhello there,hello world\n", encoding="utf-8-sig")
+    batches = list(checked_batches(str(filename), "csv", 3))
+    assert [note[1] for notes, rejects in batches for note in notes] == ["hello there"]
@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+
+import pytest
+
+from main import NoteManager
+
+
+def corrupt_files(tmp_path):
+    return [path.name for path in tmp_path.iterdir() if path.name.startswith("notes.json.corrupt-")]
+
+
+@pytest.mark.parametrize("data", [
+    b"[{\"title\": \"\xff\xfe\"}]",
+    json.dumps({"notes": []}).encode(),
+    json.dumps([["hello", "world"]]).encode(),
+    json.dumps([{"title": "hello"}]).encode(),
+])
+@pytest.mark.parametrize("streaming", [False, True])
+def test_damaged_snapshot_is_moved_aside(tmp_path, data, streaming):
+    filename = tmp_path / "notes.json"
+    filename.write_bytes(data)
+    manager = NoteManager(str(filename), verbose=False, streaming=streaming)
+    manager.read_notes()
+    assert len(manager.notes) == 0
+    assert len(corrupt_files(tmp_path)) == 1
+    manager.add_note("hello there", "hello world content")
+    manager.save_notes()
+    assert (tmp_path / corrupt_files(tmp_path)[0]).read_bytes() == data
+
+
+def test_full_batch_is_written_by_the_autosave_thread(tmp_path):
+    manager = NoteManager(str(tmp_path / "notes.json"), verbose=False, autosave=60)
+    flushes = []
+    flush = manager.storage.flush
+    manager.storage.flush = lambda: flushes.append(threading.current_thread()) or flush()
+    for i in range(manager.storage.batch_size):
+        manager.add_note(f"title {i}", f"content {i}")
+    deadline = time.monotonic() + 5
+    while manager.storage.unsaved() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert manager.storage.unsaved() == 0
+    assert flushes and threading.main_thread() not in flushes
+    manager.close()
+    assert len(NoteManager(str(tmp_path / "notes.json"), verbose=False).notes) == manager.storage.batch_size
+
+
+def saved_manager(tmp_path):
+    manager = NoteManager(str(tmp_path / "notes.json"), verbose=False)
+    for i in range(5):
+        manager.add_note(f"title {i}", f"content {i}")
+    manager.compact_notes()
+    return manager
+
+
+def titles(manager):
+    return sorted(note.title for note in manager.notes.values())
+
+
+def test_log_is_replayed_over_the_snapshot(tmp_path):
+    manager = saved_manager(tmp_path)
+    first, second = list(manager.notes)[:2]
+    manager.update_note(first, "edited title", "edited content")
+    manager.remove_notes([second])
+    manager.add_note("added title", "added content")
+    manager.save_notes()
+    # no compaction and no close: the process dies here
+    reopened = NoteManager(str(tmp_path / "notes.json"), verbose=False)
+    assert titles(reopened) == titles(manager)
+    assert reopened.notes[first].content == "edited content"
+
+
+def test_torn_last_log_line_is_ignored(tmp_path):
+    manager = saved_manager(tmp_path)
+    manager.add_note("added title", "added content")
+    manager.save_notes()
+    with open(tmp_path / "notes.json.log", "ab") as f:
+        f.write(b'{"op": "add", "note": {"id": "x", "tit')
+    reopened = NoteManager(str(tmp_path / "notes.json"), verbose=False)
+    assert titles(reopened) == titles(manager)
+
+
+def test_log_left_by_an_interrupted_compaction_is_harmless(tmp_path):
+    manager = saved_manager(tmp_path)
+    manager.add_note("added title", "added content")
+    manager.save_notes()
+    log = (tmp_path / "notes.json.log").read_bytes()
+    manager.compact_notes()
+    # the snapshot was replaced, but the crash came before the log was emptied
+    (tmp_path / "notes.json.log").write_bytes(log)
+    reopened = NoteManager(str(tmp_path / "notes.json"), verbose=False)
+    assert titles(reopened) == titles(manager)
@@ -0,0 +1,65 @@
+import pytest
+
+from main import Note, NoteManager
+from note_parallel import ScanPool, scan_notes
+
+NOTES = [Note(f"note {i}", "hello " * (i % 4) + "world", f"id-{i:03d}") for i in range(40)]
+
+
+@pytest.mark.parametrize("limit", [None, 1, 5, 39])
+@pytest.mark.parametrize("mode, term", [("substring", "hello"), ("regex", r"hel+o\b"), ("substring", "note 1")])
+def test_parallel_scan_matches_the_scan_in_process(mode, term, limit):
+    notes = {note.id: note for note in NOTES}
+    expected = scan_notes(notes, term, mode, limit, processes=1)
+    assert scan_notes(notes, term, mode, limit, processes=2, threshold=0) == expected
+
+
+def test_scan_pool_is_kept_between_scans():
+    notes = {note.id: note for note in NOTES}
+    expected = scan_notes(notes, "hello", processes=1)
+    with ScanPool() as pool:
+        assert scan_notes(notes, "hello", processes=2, threshold=0, pool=pool) == expected
+        executor = pool.executor
+        assert executor._mp_context.get_start_method() != "fork"
+        assert scan_notes(notes, "world", processes=2, threshold=0, pool=pool) == scan_notes(notes, "world",
+                                                                                              processes=1)
+        assert pool.executor is executor
+    assert pool.executor is None
+
+
+def test_limited_scan_ranks_the_first_matches():
+    notes = {note.id: note for note in NOTES}
+    # ids 1, 2 and 3 match first; 3 has the most hits
+    assert scan_notes(notes, "hello", limit=3, processes=1) == ["id-003", "id-002", "id-001"]
+
+
+def test_limited_scan_stops_early():
+    seen = []
+
+    class Notes(dict):
+        def values(self):
+            for note in super().values():
+                seen.append(note.id)
+                yield note
+
+    notes = Notes((note.id, note) for note in NOTES)
+    assert len(scan_notes(notes, "hello", limit=2, processes=1, in_memory=False)) == 2
+    assert seen == ["id-000", "id-001", "id-002"]
+
+
+@pytest.mark.parametrize("codec", ["mmap", None])
+def test_scan_of_stores_not_held_in_memory(tmp_path, codec):
+    filename = str(tmp_path / ("notes.json" if codec else "notes.db"))
+    if codec:
+        binary = NoteManager(filename, verbose=False, codec="binary")
+        binary.notes = {note.id: note for note in NOTES}
+        binary.compact_notes()
+    else:
+        manager = NoteManager(filename, verbose=False)
+        for note in NOTES:
+            manager.notes[note.id] = note
+        manager.save_notes()
+    manager = NoteManager(filename, verbose=False, codec=codec)
+    manager.search_processes = 1
+    expected = scan_notes({note.id: note for note in NOTES}, "hello", limit=5, processes=1)
+    assert [note.id for note in manager.find_notes("hello", mode="substring", limit=5)] == expected
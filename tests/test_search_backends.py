@@ -0,0 +1,74 @@
+import pytest
+
+from main import NoteManager
+
+NOTES = [
+    ("Plan—draft", "meeting “notes” here"),
+    ("Café résumé", "Straße und ÉTÉ à Paris"),
+    ("İstanbul trip", "Kelvin sign: 5 K and plain notes"),
+    ("Plain ascii title", "planning drafts, notes and cafés"),
+]
+QUERIES = ["plan", "draft", "notes", "café", "été", "résumé", "straße", "istanbul", "stanbul", "k", "paris notes"]
+
+
+@pytest.fixture
+def managers(tmp_path):
+    filename = str(tmp_path / "notes.json")
+    binary = NoteManager(filename, verbose=False, codec="binary")
+    for title, content in NOTES:
+        binary.add_note(title, content)
+    binary.save_notes()
+    binary.compact_notes()
+    return binary, NoteManager(filename, verbose=False, codec="mmap")
+
+
+@pytest.mark.parametrize("prefix", [False, True])
+@pytest.mark.parametrize("query", QUERIES)
+def test_mmap_search_matches_in_memory_index(managers, query, prefix):
+    binary, mapped = managers
+    # notes with equal scores may come in either order
+    expected = sorted(note.id for note in binary.find_notes(query, prefix=prefix))
+    assert sorted(note.id for note in mapped.find_notes(query, prefix=prefix)) == expected
+
+
+def test_mmap_search_finds_words_next_to_unicode_punctuation(managers):
+    _, mapped = managers
+    for query in ("plan", "draft", "notes"):
+        assert "Plan—draft" in [note.title for note in mapped.find_notes(query, prefix=False)]
+
+
+def test_mmap_search_with_overlay_changes(managers):
+    binary, mapped = managers
+    for manager in (binary, mapped):
+        note_id = next(note.id for note in manager.notes.values() if note.title == "Café résumé")
+        manager.update_note(note_id, "Café notes", "nothing else")
+        manager.add_note("Notebook — ÉTÉ", "notes again")
+    for query in ("café", "notes", "été", "résumé"):
+        for prefix in (False, True):
+            expected = sorted(note.title for note in binary.find_notes(query, prefix=prefix))
+            assert sorted(note.title for note in mapped.find_notes(query, prefix=prefix)) == expected
+
+
+@pytest.mark.parametrize("query", ["meting", "plainn", "pariss notes", "cafe", "zzzzzz"])
+def test_mmap_fuzzy_search_matches_in_memory_index(managers, query):
+    binary, mapped = managers
+    for manager in (binary, mapped):
+        manager.add_note("Overlay meetings", "typo tolerant")
+    expected = sorted(note.title for note in binary.find_notes(query, "fuzzy"))
+    assert sorted(note.title for note in mapped.find_notes(query, "fuzzy")) == expected
+
+
+def test_sqlite_fuzzy_search(tmp_path):
+    manager = NoteManager(str(tmp_path / "notes.db"), verbose=False)
+    for title, content in NOTES:
+        manager.add_note(title, content)
+    assert [note.title for note in manager.find_notes("meting", "fuzzy")] == ["Plan—draft"]
+    manager.add_note("Hello there", "greetings")
+    assert [note.title for note in manager.find_notes("helo", "fuzzy")] == ["Hello there"]
+    manager.save_notes()
+    # written by another process: read again after its commit
+    other = NoteManager(str(tmp_path / "notes.db"), verbose=False)
+    other.add_note("Goodbye now", "farewell")
+    other.save_notes()
+    assert [note.title for note in manager.find_notes("godbye", "fuzzy")] == ["Goodbye now"]
+    assert manager.find_notes("zzzzzz", "fuzzy") == []
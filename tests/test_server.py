@@ -0,0 +1,33 @@
+import json
+
+from main import NoteManager
+from note_server import run_lines
+
+
+def replies(manager, payload, export_dir):
+    return json.loads(run_lines(manager, [json.dumps(payload).encode("utf-8")], export_dir))
+
+
+def test_failing_request_does_not_stop_the_batch(tmp_path):
+    manager = NoteManager(str(tmp_path / "notes.json"), verbose=False)
+    batch = [
+        {"id": 1, "op": "add", "args": {"title": "hello there", "content": "hello world content"}},
+        {"id": 2, "op": "search", "args": {"term": None}},
+        {"id": 3, "op": "search", "args": {"term": "hello"}},
+    ]
+    added, failed, found = replies(manager, batch, str(tmp_path))
+    assert added["ok"] and not failed["ok"] and found["ok"]
+    assert [note["id"] for note in found["result"]] == [added["result"]["id"]]
+
+
+def test_export_only_takes_plain_file_names(tmp_path):
+    manager = NoteManager(str(tmp_path / "notes.json"), verbose=False)
+    manager.add_note("hello there", "hello world content")
+    export_dir = tmp_path / "exports"
+    export_dir.mkdir()
+    for filename in ("../notes.csv", str(tmp_path / "notes.csv"), ".hidden.csv", ""):
+        reply = replies(manager, {"id": 1, "op": "export", "args": {"filename": filename}}, str(export_dir))
+        assert not reply["ok"]
+    assert not (tmp_path / "notes.csv").exists()
+    reply = replies(manager, {"id": 2, "op": "export", "args": {"filename": "notes.csv"}}, str(export_dir))
+    assert reply["ok"] and (export_dir / "notes.csv").exists()
@@ -0,0 +1,111 @@
+import json
+import os
+
+import pytest
+
+from main import NoteManager
+from note_shard import HashRing, ShardedStorage
+
+
+def sharded_manager(tmp_path, count=60, shard_count=4):
+    dirname = str(tmp_path / "notes.shards")
+    manager = NoteManager(dirname, verbose=False, storage=ShardedStorage(dirname, shard_count=shard_count))
+    for i in range(count):
+        manager.add_note(f"title {i}", f"content {i}")
+    manager.compact_notes()
+    return manager
+
+
+def reopen(manager, verbose=False):
+    return NoteManager(manager.filename, verbose=verbose)
+
+
+def shard_ids(manager, name):
+    with open(manager.storage.shards[name].filename, encoding="utf-8") as f:
+        return {note["id"] for note in json.load(f)}
+
+
+def corrupt_files(manager):
+    # the shard files moved aside, by their original name
+    return [name.split(".corrupt-")[0] for name in os.listdir(manager.filename) if ".corrupt-" in name]
+
+
+def test_checksum_mismatch_sets_only_that_shard_aside(tmp_path, capsys):
+    manager = sharded_manager(tmp_path)
+    damaged = shard_ids(manager, "000")
+    filename = manager.storage.shards["000"].filename
+    with open(filename, encoding="utf-8") as f:
+        text = f.read()
+    # still valid JSON, but not what the checksum was taken of
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(text.replace("content", "CONTENT", 1))
+    reopened = reopen(manager, verbose=True)
+    assert set(reopened.notes) == set(manager.notes) - damaged
+    assert "Shard notes-000.json is damaged" in capsys.readouterr().out
+    assert corrupt_files(manager) == ["notes-000.json"]
+
+
+def test_damaged_shard_keeps_its_log(tmp_path):
+    manager = sharded_manager(tmp_path)
+    added = manager.add_note("added title", "added content")
+    manager.save_notes()
+    name = manager.storage.ring.shard(added.id)
+    # the snapshot's notes are lost, the one in the shard's log is not
+    lost = shard_ids(manager, name)
+    with open(manager.storage.shards[name].filename, "wb") as f:
+        f.write(b"[{\"id\": ")
+    reopened = reopen(manager)
+    assert set(reopened.notes) == set(manager.notes) - lost
+    assert added.id in reopened.notes
+    assert corrupt_files(manager) == [f"notes-{name}.json"]
+
+
+def test_snapshot_from_before_the_last_compaction_still_verifies(tmp_path):
+    manager = sharded_manager(tmp_path)
+    filename = manager.storage.shards["001"].filename
+    with open(filename, "rb") as f:
+        old = f.read()
+    note_id = next(iter(shard_ids(manager, "001")))
+    manager.update_note(note_id, "edited title", "edited content")
+    manager.compact_notes()
+    # a crash after the checksums were written but before the snapshot was swapped in
+    with open(filename, "wb") as f:
+        f.write(old)
+    reopened = reopen(manager)
+    assert corrupt_files(manager) == []
+    assert reopened.notes[note_id].title != "edited title"
+    assert set(reopened.notes) == set(manager.notes)
+
+
+def test_reshard_moves_notes_to_the_new_shards_only(tmp_path):
+    manager = sharded_manager(tmp_path, count=200)
+    before = {name: shard_ids(manager, name) for name in manager.storage.shards}
+    moved = manager.reshard_notes(5)
+    assert 0 < moved < 100
+    manager.compact_notes()
+    assert set(manager.storage.shards) == {"000", "001", "002", "003", "004"}
+    assert len(shard_ids(manager, "004")) == moved
+    for name, ids in before.items():
+        # the old shards only lose notes, to the new one
+        assert shard_ids(manager, name) <= ids
+    reopened = reopen(manager)
+    assert set(reopened.notes) == set(manager.notes)
+    ring = HashRing(list(reopened.storage.shards))
+    for name in reopened.storage.shards:
+        assert all(ring.shard(note_id) == name for note_id in shard_ids(reopened, name))
+    with pytest.raises(ValueError):
+        manager.reshard_notes(3)
+
+
+def test_interrupted_reshard_is_finished_by_the_next_load(tmp_path):
+    manager = sharded_manager(tmp_path, count=100)
+    storage = manager.storage
+    names = list(storage.manifest["shards"])
+    # the manifest names the new shards, but no note was moved yet
+    storage.write_manifest({"shards": names + ["004"], "previous": names})
+    reopened = reopen(manager)
+    assert set(reopened.notes) == set(manager.notes)
+    assert "previous" not in reopened.storage.manifest
+    assert sum(1 for note_id in reopened.notes if reopened.storage.ring.shard(note_id) == "004") > 0
+    again = reopen(manager)
+    assert set(again.notes) == set(manager.notes)
@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+
+from main import NoteManager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPACT = """
+import sys
+from main import NoteManager
+manager = NoteManager(sys.argv[1], verbose=False)
+manager.add_note("from the other process", "written before compacting")
+manager.compact_notes()
+"""
+
+
+def titles(manager):
+    return sorted(note.title for note in manager.notes.values())
+
+
+def compact_elsewhere(filename):
+    subprocess.run([sys.executable, "-c", COMPACT, filename], cwd=ROOT, check=True)
+
+
+def test_refresh_after_another_process_compacted(tmp_path):
+    filename = str(tmp_path / "notes.json")
+    first = NoteManager(filename, verbose=False)
+    second = NoteManager(filename, verbose=False)
+    first.add_note("saved by the first", "before the compaction")
+    first.save_notes()
+    second.add_note("unsaved in the second", "kept through the reload")
+    compact_elsewhere(filename)
+    assert second.refresh_notes()
+    expected = ["from the other process", "saved by the first", "unsaved in the second"]
+    assert titles(second) == expected
+    # the second's own change went to the new journal, not just to memory
+    assert titles(NoteManager(filename, verbose=False)) == expected
+
+
+def test_refresh_reads_the_log_written_after_a_compaction(tmp_path):
+    filename = str(tmp_path / "notes.json")
+    first = NoteManager(filename, verbose=False)
+    second = NoteManager(filename, verbose=False)
+    compact_elsewhere(filename)
+    assert first.refresh_notes() and second.refresh_notes()
+    note_id = next(iter(first.notes))
+    first.update_note(note_id, "edited by the first", "after the compaction")
+    first.save_notes()
+    assert second.refresh_notes()
+    assert second.notes[note_id].title == "edited by the first"
+    assert not second.refresh_notes()
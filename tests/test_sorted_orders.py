@@ -0,0 +1,66 @@
+import pytest
+
+from main import Note, NoteManager
+
+NOTES = [Note(f"{'Bcdea'[i % 5]} title {i:02d}", f"content number {i} hello", f"id-{i:02d}",
+              f"2025-01-{1 + i % 28:02d} 12:{i:02d}:00") for i in range(40)]
+
+
+def open_managers(tmp_path, backend):
+    memory = NoteManager(str(tmp_path / "memory.json"), verbose=False)
+    memory.notes = {note.id: note for note in NOTES}
+    memory.index.build(NOTES)
+    if backend == "mmap":
+        filename = str(tmp_path / "notes.json")
+        binary = NoteManager(filename, verbose=False, codec="binary")
+        binary.notes = {note.id: note for note in NOTES}
+        binary.compact_notes()
+        return memory, NoteManager(filename, verbose=False, codec="mmap")
+    manager = NoteManager(str(tmp_path / "notes.db"), verbose=False)
+    for note in NOTES:
+        manager.notes[note.id] = note
+    manager.save_notes()
+    return memory, manager
+
+
+def ids(notes):
+    return [note.id for note in notes]
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "mmap"])
+def test_ranges_match_the_in_memory_order(tmp_path, backend):
+    memory, manager = open_managers(tmp_path, backend)
+    for since, until, limit in ((None, None, 5), ("2025-01-03 00:00:00", "2025-01-10 00:00:00", None),
+                                ("2025-01-20 12:05:00", None, 3), (None, "2025-01-02 00:00:00", None)):
+        assert ids(manager.notes_between(since, until, limit)) == ids(memory.notes_between(since, until, limit))
+        assert (sorted(ids(manager.find_notes("hello", since=since, until=until)))
+                == sorted(ids(memory.find_notes("hello", since=since, until=until))))
+
+
+def test_sqlite_ranges_see_other_connections(tmp_path):
+    _, manager = open_managers(tmp_path, "sqlite")
+    assert ids(manager.notes_between(limit=1)) == ["id-27"]
+    other = NoteManager(str(tmp_path / "notes.db"), verbose=False)
+    other.notes["id-new"] = Note("A first title", "content", "id-new", "2025-02-01 00:00:00")
+    other.save_notes()
+    assert ids(manager.notes_between(limit=1)) == ["id-new"]
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "mmap"])
+def test_sorted_pages_match_the_in_memory_orders(tmp_path, backend):
+    memory, manager = open_managers(tmp_path, backend)
+    for sort in ("title", "timestamp"):
+        memory.set_sort(sort)
+        manager.set_sort(sort)
+        for cursor in (0, 7, 35):
+            assert ids(manager.list_notes(cursor, 10)[0]) == ids(memory.list_notes(cursor, 10)[0])
+
+
+def test_sqlite_sorted_pages_see_other_connections(tmp_path):
+    _, manager = open_managers(tmp_path, "sqlite")
+    manager.set_sort("title")
+    assert manager.list_notes(0, 1)[0][0].id == "id-04"
+    other = NoteManager(str(tmp_path / "notes.db"), verbose=False)
+    other.notes["id-new"] = Note("A first title", "content", "id-new", "2025-02-01 00:00:00")
+    other.save_notes()
+    assert manager.list_notes(0, 1)[0][0].id == "id-new"
@@ -0,0 +1,21 @@
+from main import NoteManager
+
+
+def test_corrupt_database_is_moved_aside(tmp_path):
+    filename = tmp_path / "notes.db"
+    filename.write_bytes(b"not a database " * 100)
+    manager = NoteManager(str(filename), verbose=False)
+    assert len(manager.notes) == 0
+    assert [path.name.startswith("notes.db.corrupt-") for path in tmp_path.iterdir()].count(True) == 1
+    manager.add_note("hello there", "hello world content")
+    manager.save_notes()
+    reopened = NoteManager(str(filename), verbose=False)
+    assert [note.title for note in reopened.find_notes("hello")] == ["hello there"]
+
+
+def test_unopenable_database_falls_back_to_memory(tmp_path):
+    filename = tmp_path / "notes.db"
+    filename.mkdir()
+    manager = NoteManager(str(filename), verbose=False)
+    manager.add_note("hello there", "hello world content")
+    assert [note.title for note in manager.find_notes("hello")] == ["hello there"]